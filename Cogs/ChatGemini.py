@@ -1,17 +1,43 @@
 import discord
 import asyncio
 import aiohttp
+import functools
 import os, json, base64
 from PIL import Image
-from io import BytesIO
-from discord import app_commands
 from discord.ext import commands, tasks
+from utils.metrics import DISCORD_API_DURATION, RequestTrace, record_error
+from utils.streaming import ProgressiveMessage
+from utils.images import ImageRejected, get_image_pipeline
+from utils.router import get_router
+from utils.conversation import ConversationGate, acknowledge_coalesced, merge_turn_items
+from utils.scheduler import get_scheduler, run_scheduled
+from utils.state_store import acquire_state_store, release_state_store
+from utils.gemini_cache import GeminiContextCache
+from utils.history import HistoryManager, SUMMARY_INSTRUCTION, parse_model_budgets
+from utils.http import get_http_clients
+from utils.resilience import (
+    BackendError, BackendUnavailable, FailoverPending, gemini_to_ollama, get_resilience, is_outage, ollama_to_gemini,
+)
+from utils.log import get_logger
+
+log = get_logger("gemini")
+
+# 봇 멘션 메시지(내용, 첨부 포함)만 받으면 됩니다. 나머지는 utils.intents 참고.
+REQUIRED_INTENTS = ("guild_messages", "dm_messages", "message_content")
+
+# 이 finishReason으로 끝난 응답은 차단된 것으로 보고 대화 기록에 남기지 않습니다.
+BLOCKED_FINISH_REASONS = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII", "IMAGE_SAFETY"}
+
 
 class ChatGemini(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
-        self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+        self._loaded = False  # cog_load가 끝까지 실행되었는지 (setup 참고)
+        self._prewarm = None
+        self.api_base = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+        self.model = "gemini-2.5-flash"
+        self.api_url = f"{self.api_base}/models/{self.model}:generateContent"
+        self.stream_url = f"{self.api_base}/models/{self.model}:streamGenerateContent"
         self.api_key = os.getenv("GEMINI_KEY")
         if not self.api_key:
             raise ValueError("GEMINI_KEY environment variable is not set.")
@@ -25,22 +51,179 @@ class ChatGemini(commands.Cog):
             "catgirl": "당신은 사랑스럽고 귀여운 고양이 소녀입니다. 문장 끝에 '~냐옹'이나 '~냥'을 붙여 말하는 습관이 있습니다. 호기심이 많고 변덕스러운 고양이의 성격을 가지고 있으며, 때로는 애교를 부리거나 응석을 부리기도 합니다. 사용자를 '주인님'이라고 부르며 잘 따릅니다. 기분이 좋으면 가르랑거리는 소리를 내기도 합니다. 항상 밝고 긍정적인 태도를 유지해주세요, 냥!",
         }
         self.default_persona_key = "maid"
-        self.user_states = {}  # 사용자별 상태 저장
+        # 생성 중인 응답을 메시지 편집으로 점진적으로 보여줄지 여부
+        self.stream_replies = os.getenv("GEMINI_STREAM_REPLIES", "1") != "0"
+        self.stream_edit_interval = float(os.getenv("GEMINI_STREAM_EDIT_INTERVAL", "1.0"))
+        # 사용자별로 한 번에 한 턴만 처리하고, 옵션에 따라 생성 중에 온 메시지를 다음 턴으로 합칩니다.
+        self.conversations = ConversationGate(coalesce=os.getenv("CHAT_COALESCE_MESSAGES", "0") == "1")
+        # 토큰 예산을 넘는 오래된 대화는 잘라내고 Gemini로 요약합니다.
+        self.history = HistoryManager(
+            "gemini",
+            token_budget=int(os.getenv("GEMINI_HISTORY_TOKEN_BUDGET", "16000")),
+            model_budgets=parse_model_budgets(os.getenv("HISTORY_MODEL_BUDGETS", "")),
+            image_turns=int(os.getenv("HISTORY_IMAGE_TURNS", "2")),
+            summarizer=self._summarize_history,
+            on_update=self.save_user_state,
+        )
+        self.context_cache = None
+
+    async def cog_load(self):
+        # 봇에 남는 공유 자원(세션, 상태 저장소 참조, 스케줄러 등)은 여기서 잡습니다.
+        # __init__에서 잡으면 add_cog가 실패했을 때 cog_unload가 불리지 않아 그대로 남습니다.
+        # 봇이 관리하는 Gemini용 세션 (연결 풀, keep-alive, 타임아웃 포함). 닫는 것은 봇이 합니다.
+        self.http = get_http_clients(self.bot)
+        self.session = self.http.session("gemini")
+        # 페르소나와 긴 대화 앞부분을 cachedContents로 재사용해 입력 토큰과 prefill 시간을 줄입니다.
+        if os.getenv("GEMINI_CONTEXT_CACHE", "1") != "0":
+            self.context_cache = GeminiContextCache(
+                self.session, self.api_base, self.api_key, self.model,
+                estimate_tokens=self.history.estimate_tokens,
+                ttl=int(os.getenv("GEMINI_CACHE_TTL", "900")),
+                min_tokens=int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024")),
+                max_conversations=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "1000")),
+                retry_backoff=float(os.getenv("GEMINI_CACHE_RETRY_BACKOFF", "60")),
+            )
+        # API 쿼터를 나눠 쓰도록 동시 요청 수를 제한합니다.
+        self.scheduler = get_scheduler(self.bot, "gemini", max_in_flight=4)
+        # 재시도/회로 차단기와 Ollama로의 장애 조치 (두 채팅 Cog가 공유)
+        self.resilience = get_resilience(self.bot)
+        self.guard = self.resilience.guard("gemini")
+        # 첨부 이미지 축소/재인코딩 파이프라인 (두 채팅 Cog가 공유)
+        self.images = get_image_pipeline(self.bot)
+        # 사용자별 상태 저장소 (두 채팅 Cog가 함께 사용). cog_unload에서 돌려줍니다.
+        self.store = acquire_state_store(self.bot)
+        get_router(self.bot).register("gemini", self.handle_message, controls=self)
+        self.resilience.register_failover("gemini", self.complete, self.scheduler)
+        if os.getenv("GEMINI_PREWARM", "1") != "0":
+            # 첫 요청이 DNS 조회와 TLS 핸드셰이크를 기다리지 않도록 연결을 미리 열어 둡니다.
+            self._prewarm = asyncio.create_task(
+                self.http.warm("gemini", f"{self.api_base}/models/{self.model}?key={self.api_key}"))
+        self._loaded = True
 
     async def cog_unload(self):
-        await self.session.close()
+        get_router(self.bot).unregister("gemini")
+        self.resilience.unregister_failover("gemini")
+        log.info("resilience.stats", **self.guard.stats())
+        if self._prewarm is not None:
+            self._prewarm.cancel()
+        if self.context_cache is not None:
+            log.info("context_cache.stats", **self.context_cache.stats())
+            await self.context_cache.close()
+        await release_state_store(self.bot)
+
+    def _new_user_state(self):
+        state = {"persona_key": self.default_persona_key}
+        self.history.reset(state)
+        return state
+
+    async def get_user_state(self, user_id):
+        return await self.store.get("gemini", user_id, self._new_user_state)
 
-    def get_user_state(self, user_id):
-        if user_id not in self.user_states:
-            self.user_states[user_id] = {
-                "persona_key": self.default_persona_key,
-                "messages": [],
+    def save_user_state(self, user_id, state):
+        """상태 변경을 저장소에 알립니다 (실제 쓰기는 백그라운드에서 모아서 처리)."""
+        self.store.save("gemini", user_id, state)
+
+    async def _summarize_history(self, model, previous_summary, transcript):
+        """잘라낸 대화 기록을 Gemini로 요약합니다."""
+        content = f"이전 요약:\n{previous_summary}\n\n대화:\n{transcript}" if previous_summary else transcript
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": content}]}],
+            "system_instruction": {"parts": [{"text": SUMMARY_INSTRUCTION}]},
+        }
+        async with self.session.post(f"{self.api_url}?key={self.api_key}", json=payload) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            parts = data.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+            return "".join(part.get("text", "") for part in parts)
+
+    async def _sse_events(self, content, trace=None):
+        """SSE 스트림에서 data 필드를 JSON으로 읽어 이벤트 단위로 돌려줍니다."""
+        data_lines = []
+        async for raw_line in content:
+            if trace is not None:
+                trace.received(len(raw_line))
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            elif not line and data_lines:
+                yield json.loads("\n".join(data_lines))
+                data_lines = []
+        if data_lines:  # 마지막 이벤트 뒤에 빈 줄이 없는 경우
+            yield json.loads("\n".join(data_lines))
+
+    async def _stream_gemini(self, headers, payload, on_chunk, trace):
+        """
+        streamGenerateContent(SSE)로 응답을 받으며 조각마다 on_chunk를 호출합니다.
+        (전체 응답, 오류 메시지, usageMetadata)를 반환하며, 정상 종료면 오류 메시지는 None입니다.
+        """
+        stream_url = f"{self.stream_url}?alt=sse&key={self.api_key}"
+        full_response = ""
+        usage = {}
+        body = json.dumps(payload).encode("utf-8")
+        trace.sent(len(body))
+        async with self.session.post(stream_url, headers=headers, data=body) as response:
+            response.raise_for_status()
+            async for chunk in self._sse_events(response.content, trace):
+                if "error" in chunk:
+                    return full_response, f"Gemini API 오류: {chunk['error'].get('message', 'Unknown error')}", usage
+                block_reason = chunk.get("promptFeedback", {}).get("blockReason")
+                if block_reason:
+                    return full_response, f"Gemini 안전 필터에 의해 요청이 차단되었습니다. ({block_reason})", usage
+                usage = chunk.get("usageMetadata", usage)
+                candidates = chunk.get("candidates") or []
+                if not candidates:
+                    continue
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    if "text" in part:
+                        trace.first_token()
+                        full_response += part["text"]
+                        on_chunk(part["text"])
+                finish_reason = candidates[0].get("finishReason")
+                if finish_reason in BLOCKED_FINISH_REASONS:
+                    return full_response, f"Gemini 안전 필터에 의해 응답이 중단되었습니다. ({finish_reason})", usage
+        return full_response, None, usage
+
+    async def _generate(self, headers, payload, trace):
+        """generateContent로 전체 응답을 한 번에 받습니다. 반환 형식은 _stream_gemini와 같습니다."""
+        api_url = f"{self.api_url}?key={self.api_key}"
+        full_response = ""
+        body = json.dumps(payload).encode("utf-8")
+        trace.sent(len(body))
+        async with self.session.post(api_url, headers=headers, data=body) as response:
+            response.raise_for_status()
+            raw = await response.read()
+            trace.received(len(raw))
+            data = json.loads(raw)
+            if "candidates" in data and data["candidates"]:
+                for part in data["candidates"][0]["content"]["parts"]:
+                    if "text" in part:
+                        full_response += part["text"]
+            else:
+                # 오류 응답 처리 개선
+                error_message = data.get("error", {}).get("message", "Unknown error")
+                return full_response, f"Gemini API 오류: {error_message}", {}
+        return full_response, None, data.get("usageMetadata", {})
+
+    def _build_payload(self, messages, user_message, persona, cache_name=None, prefix_len=0):
+        """요청 본문을 만듭니다. 컨텍스트 캐시를 쓰면 캐시에 들어 있는 앞부분과 페르소나는 빼고 보냅니다."""
+        if cache_name:
+            return {"cachedContent": cache_name, "contents": messages[prefix_len:] + [user_message]}
+        return {
+            # 대화 기록은 요청이 성공했을 때만 갱신하므로, 보낼 목록은 따로 만듭니다.
+            "contents": messages + [user_message],
+            "system_instruction": {
+                "parts": [{"text": persona}]
             }
-        return self.user_states[user_id]
+        }
 
-    async def query_gemini(self, prompt, messages, persona, image=None):
+    async def query_gemini(self, prompt, messages, persona, image=None, image_mime_type="image/jpeg", on_chunk=None, cache_key=None):
         """
         Gemini API에 요청을 보내는 함수.
+        on_chunk가 주어지면 streamGenerateContent로 받은 응답 조각마다 호출합니다.
+        cache_key가 주어지면 해당 대화의 컨텍스트 캐시(cachedContents)를 사용합니다.
+        429/5xx 같은 일시적인 오류는 재시도하고, 계속 실패하면 회로를 열어 바로 실패하며,
+        CHAT_FAILOVER=1이면 아직 아무것도 보내지 않은 턴을 다른 백엔드(Ollama)로 넘기도록
+        FailoverPending을 발생시킵니다.
         """
         headers = {
             "Content-Type": "application/json"
@@ -51,134 +234,237 @@ class ChatGemini(commands.Cog):
         if image:
             user_parts.append({
                 "inline_data": {
-                    "mime_type": "image/jpeg", # Discord에서 받은 이미지의 MIME 타입에 따라 변경될 수 있음
+                    "mime_type": image_mime_type,
                     "data": image
                 }
             })
         
-        # 대화 기록에 사용자 메시지 추가
-        messages.append({"role": "user", "parts": user_parts})
+        user_message = {"role": "user", "parts": user_parts}
 
-        payload = {
-            "contents": messages,
-            "system_instruction": {
-                "parts": [{"text": persona}]
-            }
-        }
+        cache_name, prefix_len = None, 0
+        if self.context_cache is not None and cache_key is not None:
+            cache_name, prefix_len = self.context_cache.prepare(cache_key, persona, messages)
+        trace = RequestTrace("gemini", "stream" if on_chunk is not None else "generate", self.model)
+        streamed = False
 
-        api_url = f"{self.api_url}?key={self.api_key}"
+        def feed(text):
+            nonlocal streamed
+            streamed = True
+            on_chunk(text)
+
+        send = (lambda payload: self._stream_gemini(headers, payload, feed, trace)) if on_chunk is not None \
+            else (lambda payload: self._generate(headers, payload, trace))
+
+        async def attempt():
+            nonlocal cache_name
+            try:
+                return await send(self._build_payload(messages, user_message, persona, cache_name, prefix_len))
+            except aiohttp.ClientResponseError as e:
+                if cache_name is None or e.status not in (400, 403, 404):
+                    raise
+                # 캐시가 만료/삭제되었거나 사용할 수 없으면 인라인으로 한 번 더 보냅니다.
+                log.warning("context_cache.rejected", status=e.status, cache=cache_name)
+                self.context_cache.invalidate(cache_name)
+                cache_name = None
+                return await send(self._build_payload(messages, user_message, persona))
 
-        full_response = ""
         try:
-            async with self.session.post(api_url, headers=headers, json=payload) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if "candidates" in data and data["candidates"]:
-                    for part in data["candidates"][0]["content"]["parts"]:
-                        if "text" in part:
-                            full_response += part["text"]
-                else:
-                    # 오류 응답 처리 개선
-                    error_message = data.get("error", {}).get("message", "Unknown error")
-                    print(f"Gemini API 응답 오류: {error_message}")
-                    # 대화 기록에서 마지막 사용자 메시지 제거 (실패했으므로)
-                    messages.pop()
-                    return f"Gemini API 오류: {error_message}"
-
-            # 대화 기록에 모델 응답 추가
-            messages.append({"role": "model", "parts": [{"text": full_response}]})
+            full_response, error_message, usage = await self.guard.call(attempt, retry_if=lambda: not streamed)
+
+            if error_message is not None:
+                # 차단/오류 응답이면 대화 기록은 그대로 둡니다.
+                trace.failed("GeminiResponseError")
+                log.warning("chat.response_error", error=error_message)
+                return error_message
+            if usage:
+                trace.generated(usage.get("candidatesTokenCount", 0))
+            if usage and self.context_cache is not None:
+                tokens = self.context_cache.record(usage)
+                log.debug("chat.input_tokens", cached=tokens["cached"], fresh=tokens["fresh"])
+
+            # 성공한 경우에만 사용자 메시지와 모델 응답을 한 번에 기록합니다.
+            messages.extend([user_message, {"role": "model", "parts": [{"text": full_response}]}])
             return full_response
-        except aiohttp.ClientConnectionError:
-            messages.pop()
-            return "Gemini 서버에 연결할 수 없습니다. API 키와 네트워크 연결을 확인해주세요."
+        except BackendUnavailable as e:
+            trace.failed(e)
+            failure, error = e, "Gemini API가 응답하지 않고 있습니다. 잠시 후 다시 시도해주세요."
+        except asyncio.TimeoutError as e:
+            # HTTP_GEMINI_READ_TIMEOUT / HTTP_GEMINI_TOTAL_TIMEOUT을 넘은 경우
+            trace.failed(e)
+            failure, error = e, "Gemini 응답 시간이 초과되었습니다. 잠시 후 다시 시도해주세요."
+        except aiohttp.ClientConnectionError as e:
+            trace.failed(e)
+            failure, error = e, "Gemini 서버에 연결할 수 없습니다. API 키와 네트워크 연결을 확인해주세요."
         except aiohttp.ClientError as e:
-            messages.pop()
-            return f"Gemini API 요청 중 오류가 발생했습니다: {e}"
-        except json.JSONDecodeError:
-            messages.pop()
+            trace.failed(e)
+            failure, error = e, f"Gemini API 요청 중 오류가 발생했습니다: {e}"
+        except json.JSONDecodeError as e:
+            trace.failed(e)
             return "Gemini API 응답을 디코딩하는 중 오류가 발생했습니다."
+        finally:
+            trace.finish()
+
+        if not streamed and is_outage(failure) and self.resilience.can_failover("gemini"):
+            raise FailoverPending(
+                "gemini", gemini_to_ollama(messages + [user_message], persona), error,
+                lambda reply: messages.extend([user_message, {"role": "model", "parts": [{"text": reply}]}]))
+        return error
 
-    @app_commands.command(name="select_persona", description="페르소나(캐릭터)를 선택하고 대화 기록을 초기화합니다.")
-    @app_commands.describe(persona="사용할 페르소나를 선택하세요.")
-    async def select_persona(self, interaction: discord.Interaction, persona: str):
+    async def complete(self, messages, on_chunk=None):
         """
-        페르소나 프리셋을 선택하고 대화 기록을 초기화하는 슬래시 커맨드.
+        다른 백엔드에서 넘어온 턴(Ollama 형식 메시지 목록)을 Gemini로 생성합니다.
+        대화 기록은 넘긴 쪽이 관리하므로 컨텍스트 캐시는 쓰지 않으며, 실패하면 예외를 올립니다.
         """
-        if persona not in self.personas:
-            await interaction.response.send_message(
-                f"존재하지 않는 페르소나입니다. 사용 가능한 페르소나: {', '.join(self.personas.keys())}", ephemeral=True
-            )
-            return
-        state = self.get_user_state(interaction.user.id)
+        system_text, contents = ollama_to_gemini(messages)
+        payload = {"contents": contents}
+        if system_text:
+            payload["system_instruction"] = {"parts": [{"text": system_text}]}
+        headers = {"Content-Type": "application/json"}
+        trace = RequestTrace("gemini", "failover", self.model)
+        try:
+            if on_chunk is not None:
+                full_response, error_message, usage = await self._stream_gemini(headers, payload, on_chunk, trace)
+            else:
+                full_response, error_message, usage = await self._generate(headers, payload, trace)
+            if error_message is not None:
+                raise BackendError(error_message)
+            if usage:
+                trace.generated(usage.get("candidatesTokenCount", 0))
+            return full_response
+        except Exception as e:
+            trace.failed(e)
+            raise
+        finally:
+            trace.finish()
+
+    async def set_persona(self, user_id, persona: str):
+        """
+        페르소나 프리셋을 바꾸고 대화 기록을 초기화합니다. 공유 커맨드 /select_persona가 라우터를 거쳐 부릅니다.
+        """
+        state = await self.get_user_state(user_id)
         state["persona_key"] = persona
-        state["messages"] = [] # 메시지 기록 초기화
-        await interaction.response.send_message(
-            f"페르소나가 `{persona}`로 설정되고 대화 기록이 초기화되었습니다.", ephemeral=True
-        )
+        self.history.reset(state) # 메시지 기록 초기화
+        self.save_user_state(user_id, state)
 
-    @select_persona.autocomplete("persona")
-    async def select_persona_autocomplete(self, interaction: discord.Interaction, current: str):
-        # 페르소나 자동완성 지원
-        return [
-            app_commands.Choice(name=key, value=key)
-            for key in self.personas.keys()
-            if current.lower() in key.lower()
-        ]
-
-    @app_commands.command(name="reset", description="대화 기록을 초기화합니다.")
-    async def reset_conversation(self, interaction: discord.Interaction):
-        state = self.get_user_state(interaction.user.id)
-        state["messages"] = [] # 메시지 기록 초기화
-        await interaction.response.send_message("대화 기록이 초기화되었습니다.", ephemeral=True)
-
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    async def reset_user(self, user_id):
+        """현재 페르소나로 대화 기록을 초기화합니다. 공유 커맨드 /reset이 라우터를 거쳐 부릅니다."""
+        state = await self.get_user_state(user_id)
+        self.history.reset(state) # 메시지 기록 초기화
+        self.save_user_state(user_id, state)
+
+    async def handle_message(self, message, prompt):
         """
-        사용자가 멘션으로 봇을 호출하면 실행되는 이벤트.
+        메시지 라우터가 이 백엔드로 보낸 메시지(봇 멘션, 멘션은 제거됨)를 처리합니다.
         """
-        if message.author.bot:
-            return  # 봇이 보낸 메시지는 무시
+        log.info("chat.prompt", user=message.author.id, prompt=prompt)
+        attachment = message.attachments
+        image = None
+
+        if not prompt and not attachment:
+            embed = discord.Embed(title="오류", description="메시지를 입력하거나 이미지를 첨부해주세요.")
+            await message.channel.send(embed=embed)
+            return
         
-        state = self.get_user_state(message.author.id)
-
-        if self.bot.user.mentioned_in(message):
-            prompt = message.content.replace(f"<@{self.bot.user.id}>", "").strip() # 멘션 삭제
-            print(f"User:{prompt}")
-            attachment = message.attachments
-            image = None
-            response = None
-
-            if not prompt and not attachment:
-                embed = discord.Embed(title="오류", description="메시지를 입력하거나 이미지를 첨부해주세요.")
-                await message.channel.send(embed=embed)
-                return
-            
+        try:
+            if attachment:
+                # 다운로드 후 스레드 풀에서 축소/재인코딩 (이미지가 아니면 None)
+                image = await self.images.process(attachment[0])
+                if image is not None:
+                    log.info("chat.image", user=message.author.id, mime_type=image.mime_type, bytes=image.size)
+        except ImageRejected as e:
+            await message.channel.send(str(e))
+            return
+        except discord.HTTPException as e:
+            log.warning("chat.attachment_failed", user=message.author.id, error=str(e))
+            await message.channel.send("첨부파일을 처리하는 중 오류가 발생했습니다.")
+            return
+
+        # Gemini API 호출
+        if not await self.conversations.run(message.author.id, (message, prompt, image), self._handle_turn):
+            await acknowledge_coalesced(message)
+
+    async def _handle_turn(self, items):
+        """(메시지, 프롬프트, 이미지) 목록을 하나의 턴으로 합쳐 처리합니다."""
+        message, prompt, image = merge_turn_items(items)
+        state = await self.get_user_state(message.author.id)
+        pending = await run_scheduled(self.scheduler, message, lambda: self._reply(message, state, prompt, image))
+        if pending is not None:
+            await pending()  # 장애로 다른 백엔드에 넘길 턴은 Gemini 슬롯을 돌려준 뒤 보냅니다.
+
+    async def _reply(self, message, state, prompt, image):
+        """
+        Gemini에 질의하고 (스트리밍 또는 한 번에) 답장을 보냅니다.
+        턴을 다른 백엔드로 넘겨야 하면 스케줄러 슬롯 밖에서 실행할 코루틴 함수를 돌려줍니다.
+        """
+        persona_key = state.get("persona_key", self.default_persona_key)
+        stream = None
+        if self.stream_replies:
+            stream = ProgressiveMessage(message.channel, persona_key.capitalize(), interval=self.stream_edit_interval)
             try:
-                if attachment and ("image" in attachment[0].content_type):
-                    # 이미지를 BytesIO로 다운로드하여 base64 인코딩
-                    image_bytes = await attachment[0].read()
-                    image = base64.b64encode(image_bytes).decode('utf-8')
-                    print("Image Detected")
+                await stream.start()
+            except discord.Forbidden:
+                log.warning("discord.send_forbidden", channel=message.channel.id)
+                return
             except discord.HTTPException as e:
-                print(f"첨부파일 다운로드 실패: {e}")
-                await message.channel.send("첨부파일을 처리하는 중 오류가 발생했습니다.")
+                log.warning("discord.send_failed", channel=message.channel.id, error=str(e))
                 return
 
-            # Gemini API 호출
-            persona_key = state.get("persona_key", self.default_persona_key)
-            persona_text = self.personas[persona_key]
-            response = await self.query_gemini(prompt, state["messages"], persona_text, image)
-            
-            if response is not None:
-                print(f"Bot:{response}")
-                persona_key = state.get("persona_key", self.default_persona_key)
+        try:
+            # 토큰 예산에 맞게 대화 기록을 정리하고, 누적된 요약은 system_instruction에 덧붙입니다.
+            self.history.prepare(state, self.model, key=message.author.id)
+            persona_text = self.history.system_text(self.personas[persona_key], state)
+            image_args = (image.data, image.mime_type) if image is not None else ()
+            response = await self.query_gemini(
+                prompt, state["messages"], persona_text, *image_args,
+                on_chunk=stream.feed if stream is not None else None,
+                cache_key=message.author.id,
+            )
+        except FailoverPending as pending:
+            return functools.partial(self._reply_failover, message, state, stream, persona_key, pending)
+        except BaseException:
+            # 예상하지 못한 오류나 취소로 끝나도 편집 루프와 "…" 플레이스홀더를 남기지 않습니다.
+            if stream is not None:
+                await stream.abort()
+            raise
+        self.save_user_state(message.author.id, state)
+        await self._send_reply(message, stream, persona_key, response)
+
+    async def _reply_failover(self, message, state, stream, persona_key, pending):
+        """Gemini 슬롯을 돌려준 뒤, 장애로 실패한 턴을 다른 백엔드로 보내고 답장을 마무리합니다."""
+        try:
+            response = await self.resilience.run_pending(
+                pending, message.author.id, stream.feed if stream is not None else None)
+        except BaseException:
+            if stream is not None:
+                await stream.abort()
+            raise
+        self.save_user_state(message.author.id, state)
+        await self._send_reply(message, stream, persona_key, response)
+
+    async def _send_reply(self, message, stream, persona_key, response, **fields):
+        if response is None:
+            return
+        log.info("chat.reply", user=message.author.id, response=response, **fields)
+        try:
+            if stream is not None:
+                await stream.finish(response)
+            else:
                 embed = discord.Embed(title=persona_key.capitalize(), description=response)
-                try:
+                with DISCORD_API_DURATION.time(op="send"):
                     await message.channel.send(embed=embed)
-                except discord.Forbidden:
-                    print(f"메시지 전송 실패: 채널({message.channel.id})에 메시지를 보낼 권한이 없습니다.")
-                except discord.HTTPException as e:
-                    print(f"메시지 전송 실패: {e}")
+        except discord.Forbidden as e:
+            record_error("discord", e)
+            log.warning("discord.send_forbidden", channel=message.channel.id)
+        except discord.HTTPException as e:
+            record_error("discord", e)
+            log.warning("discord.send_failed", channel=message.channel.id, error=str(e))
 
 async def setup(bot):
-    await bot.add_cog(ChatGemini(bot))
\ No newline at end of file
+    cog = ChatGemini(bot)
+    try:
+        await bot.add_cog(cog)
+    except Exception:
+        # cog_load 다음 단계(커맨드 등록)에서 실패하면 discord.py가 cog_unload를 부르지 않으므로 직접 되돌립니다.
+        if cog._loaded:
+            await cog.cog_unload()
+        raise
\ No newline at end of file
@@ -1,17 +1,36 @@
 import discord
 import asyncio
 import aiohttp
+import functools
 import os, json, base64
 from PIL import Image
-from io import BytesIO
 from discord import app_commands
 from discord.ext import commands, tasks
+from utils.metrics import DISCORD_API_DURATION, RequestTrace, record_error
+from utils.model_cache import ModelInfoCache
+from utils.streaming import ProgressiveMessage
+from utils.images import ImageRejected, get_image_pipeline
+from utils.router import get_router
+from utils.conversation import ConversationGate, acknowledge_coalesced, merge_turn_items
+from utils.scheduler import get_scheduler, run_scheduled
+from utils.state_store import acquire_state_store, release_state_store
+from utils.history import HistoryManager, SUMMARY_INSTRUCTION, parse_model_budgets
+from utils.http import get_http_clients
+from utils.residency import ModelResidency, keep_alive_value, parse_keep_alive_tiers
+from utils.resilience import BackendUnavailable, FailoverPending, get_resilience, is_outage
+from utils.log import get_logger
+
+log = get_logger("ollama")
+
+# 봇 멘션 메시지(내용, 첨부 포함)만 받으면 됩니다. 나머지는 utils.intents 참고.
+REQUIRED_INTENTS = ("guild_messages", "dm_messages", "message_content")
+
 
 class ChatCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
-        self.ollama_base_url = "http://localhost:11434/api"
+        self._loaded = False  # cog_load가 끝까지 실행되었는지 (setup 참고)
+        self.ollama_base_url = os.getenv("OLLAMA_URL", "http://localhost:11434").rstrip("/") + "/api"
         # 페르소나 (시스템 프롬프트) 프리셋 사전
         self.personas = {
             "maid": "당신은 주인을 몰래 사랑하는 메이드입니다. 주인에게 말을 건넬 때는 공손하면서도 은은하게 애정을 담아 표현하려 합니다. 당신은 예의바르며 겸손하지만, 때때로 주인을 향한 마음이 살짝 드러납니다. 주인의 질문에 응답할 때는 부드럽고 상냥하며 귀여운 말투로 표현합니다. 항상 주인의 요청을 최대한 들어주세요.",
@@ -21,61 +40,147 @@ class ChatCog(commands.Cog):
             "catgirl": "당신은 사랑스럽고 귀여운 고양이 소녀입니다. 문장 끝에 '~냐옹'이나 '~냥'을 붙여 말하는 습관이 있습니다. 호기심이 많고 변덕스러운 고양이의 성격을 가지고 있으며, 때로는 애교를 부리거나 응석을 부리기도 합니다. 사용자를 '주인님'이라고 부르며 잘 따릅니다. 기분이 좋으면 가르랑거리는 소리를 내기도 합니다. 항상 밝고 긍정적인 태도를 유지해주세요, 냥!",
         }
         self.default_persona_key = "maid"
-        self.user_states = {}  # 사용자별 상태 저장
+        # 모델 목록 / capabilities 캐시 (메시지마다 /api/show를 호출하지 않도록)
+        self.model_cache = ModelInfoCache(
+            self._fetch_models,
+            self._fetch_capabilities,
+            ttl=float(os.getenv("OLLAMA_MODEL_CACHE_TTL", "300")),
+            failure_ttl=float(os.getenv("OLLAMA_MODEL_CACHE_FAILURE_TTL", "10")),
+        )
+        # 생성 중인 응답을 메시지 편집으로 점진적으로 보여줄지 여부
+        self.stream_replies = os.getenv("OLLAMA_STREAM_REPLIES", "1") != "0"
+        self.stream_edit_interval = float(os.getenv("OLLAMA_STREAM_EDIT_INTERVAL", "1.0"))
+        self.preload_on_select = os.getenv("OLLAMA_PRELOAD_ON_SELECT", "1") != "0"
+        # Gemini가 실패했을 때 대신 받을 모델
+        self.failover_model = os.getenv("OLLAMA_FAILOVER_MODEL", "gemma3:12b-it-qat")
+        # 사용자별로 한 번에 한 턴만 처리하고, 옵션에 따라 생성 중에 온 메시지를 다음 턴으로 합칩니다.
+        self.conversations = ConversationGate(coalesce=os.getenv("CHAT_COALESCE_MESSAGES", "0") == "1")
+        # 토큰 예산을 넘는 오래된 대화는 잘라내고 같은 모델로 요약합니다.
+        self.history = HistoryManager(
+            "ollama",
+            token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "6000")),
+            model_budgets=parse_model_budgets(os.getenv("HISTORY_MODEL_BUDGETS", "")),
+            image_turns=int(os.getenv("HISTORY_IMAGE_TURNS", "2")),
+            summarizer=self._summarize_history,
+            on_update=self.save_user_state,
+        )
+
+    async def cog_load(self):
+        # 봇에 남는 공유 자원(세션, 상태 저장소 참조, 스케줄러 등)은 여기서 잡습니다.
+        # __init__에서 잡으면 add_cog가 실패했을 때 cog_unload가 불리지 않아 그대로 남습니다.
+        # 봇이 관리하는 Ollama용 세션 (연결 풀, 타임아웃 포함). 닫는 것은 봇이 합니다.
+        self.session = get_http_clients(self.bot).session("ollama")
+        # 사용자마다 다른 모델을 고르면 GPU에서 모델이 계속 교체되므로, 올라가 있는 모델을 추적하고
+        # keep_alive를 모델별로 정하며, 고른 모델을 미리 불러옵니다.
+        self.residency = ModelResidency(
+            self.session, self.ollama_base_url,
+            tiers=parse_keep_alive_tiers(os.getenv("OLLAMA_KEEP_ALIVE_TIERS", "")),
+            default_keep_alive=keep_alive_value(os.getenv("OLLAMA_KEEP_ALIVE")),
+            pinned=os.getenv("OLLAMA_PIN_MODEL") or None,
+            poll_interval=float(os.getenv("OLLAMA_PS_INTERVAL", "15")),
+        )
+        # 로컬 Ollama 서버 하나를 모든 사용자가 공유하므로 동시 요청 수를 제한하고,
+        # 대기 중인 요청은 이미 올라가 있는 모델 것부터 실행해 모델 교체를 줄입니다.
+        self.scheduler = get_scheduler(self.bot, "ollama", max_in_flight=2, affinity_skips=3)
+        self.scheduler.affinity = self.residency.is_resident
+        # 재시도/회로 차단기 (두 채팅 Cog가 공유)
+        self.resilience = get_resilience(self.bot)
+        self.guard = self.resilience.guard("ollama")
+        # 첨부 이미지 축소/재인코딩 파이프라인 (두 채팅 Cog가 공유)
+        self.images = get_image_pipeline(self.bot)
+        # 사용자별 상태 저장소 (두 채팅 Cog가 함께 사용). cog_unload에서 돌려줍니다.
+        self.store = acquire_state_store(self.bot)
+        get_router(self.bot).register("ollama", self.handle_message, controls=self)
+        self.resilience.register_failover("ollama", self.complete, self.scheduler)
+        await self.residency.start()
+        # 첫 메시지가 메타데이터 조회를 기다리지 않도록 캐시를 미리 채워둡니다.
+        try:
+            await self.model_cache.warm()
+        except Exception as e:
+            log.warning("model_cache.warm_failed", error=str(e))
+        self._loaded = True
 
     async def cog_unload(self):
-        await self.session.close()
-
-    def get_user_state(self, user_id):
-        if user_id not in self.user_states:
-            default_persona = self.personas[self.default_persona_key]
-            self.user_states[user_id] = {
-                "selected_model": "gemma3:12b-it-qat",
-                "thinking_enabled": False,
-                "persona_key": self.default_persona_key,
-                "messages": [{"role": "system", "content": default_persona}],
-            }
-        return self.user_states[user_id]
+        get_router(self.bot).unregister("ollama")
+        self.resilience.unregister_failover("ollama")
+        log.info("resilience.stats", **self.guard.stats())
+        await release_state_store(self.bot)
+        log.info("model_cache.stats", **self.model_cache.stats())
+        self.scheduler.affinity = None
+        await self.residency.close()
+        log.info("residency.stats", **self.residency.stats())
+
+    def _new_user_state(self):
+        state = {
+            "selected_model": "gemma3:12b-it-qat",
+            "thinking_enabled": False,
+            "persona_key": self.default_persona_key,
+        }
+        self._reset_history(state)
+        return state
+
+    async def get_user_state(self, user_id):
+        return await self.store.get("ollama", user_id, self._new_user_state)
+
+    def save_user_state(self, user_id, state):
+        """상태 변경을 저장소에 알립니다 (실제 쓰기는 백그라운드에서 모아서 처리)."""
+        self.store.save("ollama", user_id, state)
+
+    def _reset_history(self, state):
+        """현재 페르소나의 system 메시지만 남기고 대화 기록과 요약을 초기화합니다."""
+        persona = self.personas[state.get("persona_key", self.default_persona_key)]
+        self.history.reset(state, [{"role": "system", "content": persona}])
     
+    async def _fetch_models(self) -> dict:
+        """/api/tags를 호출해 {모델 이름: digest} 사전을 반환합니다."""
+        tags_url = f"{self.ollama_base_url}/tags"
+        async with self.session.get(tags_url) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+                return {
+                    model["name"]: model.get("digest")
+                    for model in data.get("models", [])
+                    if model.get("name")
+                }
+
+    async def _fetch_capabilities(self, model: str) -> list:
+        """/api/show를 호출해 모델의 capabilities를 반환합니다."""
+        show_url = f"{self.ollama_base_url}/show"
+        async with self.session.post(show_url, json={"name": model}) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+                return data.get("capabilities", [])
+
     async def _get_local_models(self) -> list:
         """
-        Ollama REST API를 통해 로컬에 설치된 모델 목록을 가져오는 비동기 헬퍼 함수.
+        로컬에 설치된 모델 목록을 (캐시를 거쳐) 가져오는 비동기 헬퍼 함수.
         """
         try:
-            tags_url = f"{self.ollama_base_url}/tags"
-            async with self.session.get(tags_url) as resp:
-                    resp.raise_for_status()
-                    data = await resp.json()
-                    models = [model.get('name') for model in data.get('models', [])]
-                    return [name for name in models if name]
+            return list(await self.model_cache.models())
         except aiohttp.ClientConnectionError:
-            print(f"모델 목록 조회 실패: Ollama 서버에 연결할 수 없습니다.")
+            log.error("models.list_failed", error="Ollama 서버에 연결할 수 없습니다.")
             return []
         except aiohttp.ClientError as e:
-            print(f"모델 목록 조회 실패: {e}")
+            log.error("models.list_failed", error=str(e))
             return []
         except (json.JSONDecodeError, KeyError) as e:
-            print(f"모델 목록 응답(JSON) 파싱 오류: {e}")
+            log.error("models.list_invalid_json", error=str(e))
             return []
 
     async def _get_model_capabilities(self, model: str) -> list:
         """
-        Ollama REST API를 통해 모델의 capabilities를 가져오는 비동기 헬퍼 함수.
+        모델의 capabilities를 (캐시를 거쳐) 가져오는 비동기 헬퍼 함수.
         """
         try:
-            show_url = f"{self.ollama_base_url}/show"
-            async with self.session.post(show_url, json={"name": model}) as resp:
-                    resp.raise_for_status()
-                    data = await resp.json()
-                    return data.get("capabilities", [])
+            return await self.model_cache.capabilities(model)
         except aiohttp.ClientConnectionError:
-            print(f"모델 정보 조회 실패: Ollama 서버에 연결할 수 없습니다.")
+            log.error("models.show_failed", model=model, error="Ollama 서버에 연결할 수 없습니다.")
             return []
         except aiohttp.ClientError as e:
-            print(f"모델 정보 조회 실패: {e}")
+            log.error("models.show_failed", model=model, error=str(e))
             return []
         except json.JSONDecodeError as e:
-            print(f"모델 정보 응답(JSON) 파싱 오류: {e}")
+            log.error("models.show_invalid_json", model=model, error=str(e))
             return []
 
     async def model_supports_vision(self, model):
@@ -88,56 +193,145 @@ class ChatCog(commands.Cog):
         """현재 모델이 thinking 기능을 지원하는지 확인"""
         return "thinking" in await self._get_model_capabilities(model)
 
-    async def query_ollama(self, prompt, model, messages, thinking_enabled, image=None):
+    async def _stream_chat(self, body, model, on_chunk, trace):
+        """/api/chat 스트림을 읽어 전체 응답을 반환합니다. 실패하면 예외를 그대로 올립니다."""
+        chat_url = f"{self.ollama_base_url}/chat"
+        full_response = ""
+        async with self.session.post(chat_url, data=body, headers={"Content-Type": "application/json"}) as response:
+            response.raise_for_status()
+            while True:
+                line = await response.content.readline()
+                if not line:
+                    break
+                trace.received(len(line))
+                line = line.strip()
+                if line:
+                    try:
+                        json_line = json.loads(line.decode('utf-8'))
+                        content = json_line.get("message", {}).get("content", "")
+                        full_response += content
+                        if content:
+                            trace.first_token()
+                            if on_chunk is not None:
+                                on_chunk(content)
+                        if json_line.get("done"):
+                            # 마지막 줄에는 생성 토큰 수와 소요 시간(ns)이 들어 있습니다.
+                            trace.generated(json_line.get("eval_count", 0), json_line.get("eval_duration", 0) / 1e9)
+                            self.residency.observed(model, json_line.get("load_duration", 0) / 1e9)
+                    except json.JSONDecodeError:
+                        log.warning("chat.invalid_json_line", model=model, line=line.decode("utf-8", "replace"))
+        return full_response
+
+    def _chat_payload(self, model, messages, capabilities, thinking_enabled) -> bytes:
+        payload = {"model": model, "messages": messages}
+        keep_alive = self.residency.keep_alive(model)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+
+        # 모델이 thinking을 지원하는 경우, 활성화 여부에 따라 think 파라미터를 명시적으로 설정합니다.
+        if "thinking" in capabilities:
+            payload["think"] = thinking_enabled
+            log.debug("chat.thinking", model=model, enabled=thinking_enabled)
+        return json.dumps(payload).encode("utf-8")
+
+    async def query_ollama(self, prompt, model, messages, thinking_enabled, image=None, on_chunk=None):
         """
         Ollama API에 요청을 보내는 함수.
+        on_chunk가 주어지면 스트림으로 받은 응답 조각마다 호출합니다.
+        일시적인 오류는 재시도하고, 서버가 계속 실패하면 회로를 열어 바로 실패하며,
+        CHAT_FAILOVER=1이면 아직 아무것도 보내지 않은 턴을 다른 백엔드(Gemini)로 넘기도록
+        FailoverPending을 발생시킵니다.
         """
         user_message = {"role": "user", "content": prompt}
-        
+        # capabilities는 한 번만 조회해서 vision / thinking 확인에 함께 사용합니다.
+        # 회로가 열려 있으면 어차피 보내지 않으므로 조회하느라 연결 타임아웃을 기다리지 않습니다.
+        capabilities = await self._get_model_capabilities(model) if self.guard.breaker.state != "open" else []
+
         # vision capability 확인
-        if image is not None and await self.model_supports_vision(model):
-            print("Vision capability detected, adding image to request.")
+        if image is not None and "vision" in capabilities:
+            log.debug("chat.vision", model=model)
             user_message["images"] = [image]
-        messages.append(user_message)
 
-        payload = {
-            "model": model,
-            "messages": messages,
-        }
-        
-        # 모델이 thinking을 지원하는 경우, 활성화 여부에 따라 think 파라미터를 명시적으로 설정합니다.
-        if await self.model_supports_thinking(model):
-            payload["think"] = thinking_enabled
-            if thinking_enabled:
-                print("Thinking mode enabled, adding 'think: true' to payload.")
-            else:
-                print("Thinking mode disabled, adding 'think: false' to payload.")
+        # 대화 기록은 요청이 성공했을 때만 갱신하므로, 보낼 목록은 따로 만듭니다.
+        body = self._chat_payload(model, messages + [user_message], capabilities, thinking_enabled)
+        trace = RequestTrace("ollama", "chat", model)
+        trace.sent(len(body))
+        streamed = False
+
+        def feed(content):
+            nonlocal streamed
+            streamed = True
+            if on_chunk is not None:
+                on_chunk(content)
 
-        chat_url = f"{self.ollama_base_url}/chat"
-        full_response = ""
         try:
-            async with self.session.post(chat_url, json=payload) as response:
-                    response.raise_for_status()
-                    while True:
-                        line = await response.content.readline()
-                        if not line:
-                            break
-                        line = line.strip()
-                        if line:
-                            try:
-                                json_line = json.loads(line.decode('utf-8'))
-                                content = json_line.get("message", {}).get("content", "")
-                                full_response += content
-                            except json.JSONDecodeError:
-                                print("Invalid JSON line:", line)
-            messages.append({"role": "assistant", "content": full_response})
+            full_response = await self.guard.call(lambda: self._stream_chat(body, model, feed, trace),
+                                                  retry_if=lambda: not streamed)
+            # 성공한 경우에만 사용자 메시지와 응답을 한 번에 기록합니다.
+            messages.extend([user_message, {"role": "assistant", "content": full_response}])
             return full_response
-        except aiohttp.ClientConnectionError:
-            messages.pop()
-            return "Ollama 서버에 연결할 수 없습니다. 서버가 실행 중인지 확인해주세요."
+        except BackendUnavailable as e:
+            trace.failed(e)
+            failure, error = e, "Ollama 서버가 응답하지 않고 있습니다. 잠시 후 다시 시도해주세요."
+        except asyncio.TimeoutError as e:
+            # 응답 조각 사이 간격이 HTTP_OLLAMA_READ_TIMEOUT을 넘은 경우
+            trace.failed(e)
+            failure, error = e, "Ollama 서버의 응답 시간이 초과되었습니다. 잠시 후 다시 시도해주세요."
+        except aiohttp.ClientConnectionError as e:
+            trace.failed(e)
+            failure, error = e, "Ollama 서버에 연결할 수 없습니다. 서버가 실행 중인지 확인해주세요."
         except aiohttp.ClientError as e:
-            messages.pop()
-            return f"Ollama API 요청 중 오류가 발생했습니다: {e}"
+            trace.failed(e)
+            failure, error = e, f"Ollama API 요청 중 오류가 발생했습니다: {e}"
+        finally:
+            trace.finish()
+
+        if not streamed and is_outage(failure) and self.resilience.can_failover("ollama"):
+            # 다른 백엔드에는 모델의 vision 지원과 상관없이 이미지를 함께 보냅니다.
+            turn = {"role": "user", "content": prompt, **({"images": [image]} if image is not None else {})}
+            raise FailoverPending(
+                "ollama", messages + [turn], error,
+                lambda reply: messages.extend([user_message, {"role": "assistant", "content": reply}]))
+        return error
+
+    async def complete(self, messages, on_chunk=None):
+        """
+        다른 백엔드에서 넘어온 턴(Ollama 형식 메시지 목록)을 OLLAMA_FAILOVER_MODEL로 생성합니다.
+        대화 기록은 넘긴 쪽이 관리하며, 실패하면 예외를 그대로 올립니다.
+        """
+        model = self.failover_model
+        capabilities = await self._get_model_capabilities(model)
+        if "vision" not in capabilities:
+            messages = [{key: value for key, value in m.items() if key != "images"} for m in messages]
+        body = self._chat_payload(model, messages, capabilities, False)
+        trace = RequestTrace("ollama", "failover", model)
+        trace.sent(len(body))
+        try:
+            return await self._stream_chat(body, model, on_chunk, trace)
+        except Exception as e:
+            trace.failed(e)
+            raise
+        finally:
+            trace.finish()
+
+    async def _summarize_history(self, model, previous_summary, transcript):
+        """잘라낸 대화 기록을 같은 모델로 요약합니다."""
+        content = f"이전 요약:\n{previous_summary}\n\n대화:\n{transcript}" if previous_summary else transcript
+        payload = {
+            "model": model,
+            "stream": False,
+            "messages": [
+                {"role": "system", "content": SUMMARY_INSTRUCTION},
+                {"role": "user", "content": content},
+            ],
+        }
+        keep_alive = self.residency.keep_alive(model)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        async with self.session.post(f"{self.ollama_base_url}/chat", json=payload) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return data.get("message", {}).get("content", "")
 
     @app_commands.command(name="select_model", description="사용할 Ollama 모델을 선택합니다.")
     async def select_model(self, interaction: discord.Interaction):
@@ -170,14 +364,18 @@ class ChatCog(commands.Cog):
                 self.parent_cog = parent_cog
 
             async def callback(self, interaction: discord.Interaction):
-                state = self.parent_cog.get_user_state(interaction.user.id)
+                state = await self.parent_cog.get_user_state(interaction.user.id)
                 selected_model = self.values[0]
                 state["selected_model"] = selected_model
                 # 모델 변경 시 대화 기록을 초기화합니다.
-                state["messages"] = [{"role": "system", "content": self.parent_cog.personas[state["persona_key"]]}]
+                self.parent_cog._reset_history(state)
                 # 새로 선택된 모델이 'thinking'을 지원하지 않으면, 해당 기능을 비활성화합니다.
                 if not await self.parent_cog.model_supports_thinking(selected_model):
                     state["thinking_enabled"] = False
+                self.parent_cog.save_user_state(interaction.user.id, state)
+                # 첫 메시지가 모델 로딩을 기다리지 않도록 미리 불러옵니다.
+                if self.parent_cog.preload_on_select:
+                    self.parent_cog.residency.preload(selected_model)
                 await interaction.response.send_message(
                     f"모델이 `{selected_model}`로 설정되었습니다.", ephemeral=True
                 )
@@ -188,103 +386,153 @@ class ChatCog(commands.Cog):
 
     @app_commands.command(name="enable_thinking", description="thinking 모드를 활성화합니다")
     async def enable_thinking(self, interaction: discord.Interaction):
-        state = self.get_user_state(interaction.user.id)
+        state = await self.get_user_state(interaction.user.id)
         if await self.model_supports_thinking(state["selected_model"]):
             state["thinking_enabled"] = True
+            self.save_user_state(interaction.user.id, state)
             await interaction.response.send_message("thinking이 활성화되었습니다.", ephemeral=True)
         else:
             await interaction.response.send_message("선택된 모델은 thinking을 지원하지 않습니다.", ephemeral=True)
 
     @app_commands.command(name="disable_thinking", description="thinking 모드를 비활성화합니다")
     async def disable_thinking(self, interaction: discord.Interaction):
-        state = self.get_user_state(interaction.user.id)
+        state = await self.get_user_state(interaction.user.id)
         state["thinking_enabled"] = False
+        self.save_user_state(interaction.user.id, state)
         await interaction.response.send_message("thinking이 비활성화되었습니다.", ephemeral=True)
 
-    @app_commands.command(name="select_persona", description="페르소나(캐릭터)를 선택하고 대화 기록을 초기화합니다.")
-    @app_commands.describe(persona="사용할 페르소나를 선택하세요.")
-    async def select_persona(self, interaction: discord.Interaction, persona: str):
+    async def set_persona(self, user_id, persona: str):
         """
-        페르소나 프리셋을 선택하고 대화 기록을 초기화하는 슬래시 커맨드.
+        페르소나 프리셋을 바꾸고 대화 기록을 초기화합니다. 공유 커맨드 /select_persona가 라우터를 거쳐 부릅니다.
         """
-        if persona not in self.personas:
-            await interaction.response.send_message(
-                f"존재하지 않는 페르소나입니다. 사용 가능한 페르소나: {', '.join(self.personas.keys())}", ephemeral=True
-            )
-            return
-        state = self.get_user_state(interaction.user.id)
+        state = await self.get_user_state(user_id)
         state["persona_key"] = persona
-        state["messages"] = [{"role": "system", "content": self.personas[persona]}]
-        await interaction.response.send_message(
-            f"페르소나가 `{persona}`로 설정되고 대화 기록이 초기화되었습니다.", ephemeral=True
-        )
+        self._reset_history(state) # 메시지 기록 초기화
+        self.save_user_state(user_id, state)
 
-    @select_persona.autocomplete("persona")
-    async def select_persona_autocomplete(self, interaction: discord.Interaction, current: str):
-        # 페르소나 자동완성 지원
-        return [
-            app_commands.Choice(name=key, value=key)
-            for key in self.personas.keys()
-            if current.lower() in key.lower()
-        ]
-
-    @app_commands.command(name="reset", description="대화 기록을 초기화합니다.")
-    async def reset_conversation(self, interaction: discord.Interaction):
-        state = self.get_user_state(interaction.user.id)
-        # 현재 선택된 페르소나로 초기화
-        persona_key = state.get("persona_key", self.default_persona_key)
-        state["messages"] = [{"role": "system", "content": self.personas[persona_key]}]
-        await interaction.response.send_message("대화 기록이 초기화되었습니다.", ephemeral=True)
+    async def reset_user(self, user_id):
+        """현재 페르소나로 대화 기록을 초기화합니다. 공유 커맨드 /reset이 라우터를 거쳐 부릅니다."""
+        state = await self.get_user_state(user_id)
+        self._reset_history(state) # 메시지 기록 초기화
+        self.save_user_state(user_id, state)
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    async def handle_message(self, message, prompt):
         """
-        사용자가 멘션으로 봇을 호출하면 실행되는 이벤트.
+        메시지 라우터가 이 백엔드로 보낸 메시지(봇 멘션, 멘션은 제거됨)를 처리합니다.
         """
-        if message.author.bot:
-            return  # 봇이 보낸 메시지는 무시
-        
-        state = self.get_user_state(message.author.id)
+        state = await self.get_user_state(message.author.id)
         if not state["selected_model"]:
             await message.channel.send("모델이 선택되지 않았습니다. 먼저 `select_model`을 사용하여 모델을 선택하세요.")
             return
 
-        if self.bot.user.mentioned_in(message):
-            prompt = message.content.replace(f"<@{self.bot.user.id}>", "").strip() # 멘션 삭제
-            print(f"User:{prompt}")
-            attachment = message.attachments
-            image = None
-            response = None
+        log.info("chat.prompt", user=message.author.id, model=state["selected_model"], prompt=prompt)
+        attachment = message.attachments
+        image = None
 
-            if not prompt:
-                embed = discord.Embed(title="오류", description="메시지를 입력해주세요")
-                await message.channel.send(embed=embed)
-                return
-            
+        if not prompt:
+            embed = discord.Embed(title="오류", description="메시지를 입력해주세요")
+            await message.channel.send(embed=embed)
+            return
+        
+        try:
+            if attachment:
+                # 다운로드 후 스레드 풀에서 축소/재인코딩 (이미지가 아니면 None)
+                image = await self.images.process(attachment[0])
+                if image is not None:
+                    log.info("chat.image", user=message.author.id, mime_type=image.mime_type, bytes=image.size)
+        except ImageRejected as e:
+            await message.channel.send(str(e))
+            return
+        except discord.HTTPException as e:
+            log.warning("chat.attachment_failed", user=message.author.id, error=str(e))
+            await message.channel.send("첨부파일을 처리하는 중 오류가 발생했습니다.")
+            return
+
+        if not await self.conversations.run(message.author.id, (message, prompt, image), self._handle_turn):
+            await acknowledge_coalesced(message)
+
+    async def _handle_turn(self, items):
+        """(메시지, 프롬프트, 이미지) 목록을 하나의 턴으로 합쳐 처리합니다."""
+        message, prompt, image = merge_turn_items(items)
+        state = await self.get_user_state(message.author.id)
+        pending = await run_scheduled(self.scheduler, message, lambda: self._reply(message, state, prompt, image),
+                                      key=state["selected_model"])
+        if pending is not None:
+            await pending()  # 장애로 다른 백엔드에 넘길 턴은 Ollama 슬롯을 돌려준 뒤 보냅니다.
+
+    async def _reply(self, message, state, prompt, image):
+        """
+        Ollama에 질의하고 (스트리밍 또는 한 번에) 답장을 보냅니다.
+        턴을 다른 백엔드로 넘겨야 하면 스케줄러 슬롯 밖에서 실행할 코루틴 함수를 돌려줍니다.
+        """
+        persona_key = state.get("persona_key", self.default_persona_key)
+        stream = None
+        if self.stream_replies:
+            stream = ProgressiveMessage(message.channel, persona_key.capitalize(), interval=self.stream_edit_interval)
             try:
-                if attachment and ("image" in attachment[0].content_type):
-                    # 이미지를 BytesIO로 다운로드
-                    image_bytes = await attachment[0].read()
-                    image = base64.b64encode(image_bytes).decode('utf-8')
-                    print("Image Detected")
+                await stream.start()
+            except discord.Forbidden:
+                log.warning("discord.send_forbidden", channel=message.channel.id)
+                return
             except discord.HTTPException as e:
-                print(f"첨부파일 다운로드 실패: {e}")
-                await message.channel.send("첨부파일을 처리하는 중 오류가 발생했습니다.")
+                log.warning("discord.send_failed", channel=message.channel.id, error=str(e))
                 return
 
-            # 사용자 상태에서 전체 모델 이름을 가져와 API에 전달
-            response = await self.query_ollama(prompt, state["selected_model"], state["messages"], state["thinking_enabled"], image)
-            if response is not None:
-                print(f"Bot:{response}")
-                persona_key = state.get("persona_key", self.default_persona_key)
+        try:
+            # 토큰 예산에 맞게 대화 기록을 정리한 뒤, 사용자 상태에서 전체 모델 이름을 가져와 API에 전달
+            self.history.prepare(state, state["selected_model"], key=message.author.id)
+            response = await self.query_ollama(
+                prompt, state["selected_model"], state["messages"], state["thinking_enabled"],
+                image.data if image is not None else None,
+                on_chunk=stream.feed if stream is not None else None,
+            )
+        except FailoverPending as pending:
+            return functools.partial(self._reply_failover, message, state, stream, persona_key, pending)
+        except BaseException:
+            # 예상하지 못한 오류나 취소로 끝나도 편집 루프와 "…" 플레이스홀더를 남기지 않습니다.
+            if stream is not None:
+                await stream.abort()
+            raise
+        self.save_user_state(message.author.id, state)
+        await self._send_reply(message, stream, persona_key, response, model=state["selected_model"])
+
+    async def _reply_failover(self, message, state, stream, persona_key, pending):
+        """Ollama 슬롯을 돌려준 뒤, 장애로 실패한 턴을 다른 백엔드로 보내고 답장을 마무리합니다."""
+        try:
+            response = await self.resilience.run_pending(
+                pending, message.author.id, stream.feed if stream is not None else None)
+        except BaseException:
+            if stream is not None:
+                await stream.abort()
+            raise
+        self.save_user_state(message.author.id, state)
+        await self._send_reply(message, stream, persona_key, response, model=state["selected_model"])
+
+    async def _send_reply(self, message, stream, persona_key, response, **fields):
+        if response is None:
+            return
+        log.info("chat.reply", user=message.author.id, response=response, **fields)
+        try:
+            if stream is not None:
+                await stream.finish(response)
+            else:
                 embed = discord.Embed(title=persona_key.capitalize(), description=response)
-                try:
+                with DISCORD_API_DURATION.time(op="send"):
                     await message.channel.send(embed=embed)
-                except discord.Forbidden:
-                    print(f"메시지 전송 실패: 채널({message.channel.id})에 메시지를 보낼 권한이 없습니다.")
-                except discord.HTTPException as e:
-                    print(f"메시지 전송 실패: {e}")
+        except discord.Forbidden as e:
+            record_error("discord", e)
+            log.warning("discord.send_forbidden", channel=message.channel.id)
+        except discord.HTTPException as e:
+            record_error("discord", e)
+            log.warning("discord.send_failed", channel=message.channel.id, error=str(e))
 
 
 async def setup(bot):
-    await bot.add_cog(ChatCog(bot))
+    cog = ChatCog(bot)
+    try:
+        await bot.add_cog(cog)
+    except Exception:
+        # cog_load 다음 단계(커맨드 등록)에서 실패하면 discord.py가 cog_unload를 부르지 않으므로 직접 되돌립니다.
+        if cog._loaded:
+            await cog.cog_unload()
+        raise
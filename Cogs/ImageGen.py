@@ -4,148 +4,473 @@ import aiohttp
 import os
 import uuid
 import json
+import mmap
 import random
+import tempfile
+import time
+import types
 from io import BytesIO
 from discord.ext import commands
 from discord import app_commands
+from utils.batching import MicroBatcher
+from utils.comfyui import ComfyUIError, ComfyUIPool, GenerationCancelled
+from utils.http import close_http_clients, get_http_clients
+from utils.image_cache import ImageCache
+from utils.images import OutputEncoder
+from utils.log import get_logger
+from utils.metrics import BACKEND_REQUEST_DURATION, DISCORD_API_DURATION, QUEUE_WAIT, RequestTrace, record_error
+from utils.workflows import TemplateError, load_templates
+
+log = get_logger("imagegen")
+
+# 슬래시 커맨드만 사용하므로 기본 인텐트(guilds) 외에는 필요하지 않습니다.
+REQUIRED_INTENTS = ()
+
+# 워크플로우 템플릿(JSON) 디렉터리. 기본값은 저장소의 workflows/입니다.
+DEFAULT_WORKFLOW_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workflows")
+# /view 응답을 받을 때 이 크기까지는 메모리에, 넘으면 임시 파일에 씁니다.
+DOWNLOAD_SPOOL_BYTES = 512 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Discord 정수 옵션의 최댓값. 사용자가 보고 다시 입력할 수 있도록 seed도 이 범위에서 고릅니다.
+MAX_SEED = 2 ** 53 - 1
+
+
+class ImageRequest:
+    """배치 대기열에 들어가는 이미지 생성 요청 하나."""
+
+    def __init__(self, template, settings, positive_prompt, negative_prompt, seed=None, status=None):
+        self.template = template
+        self.settings = settings  # template.resolve()로 검증된 매개변수 값
+        self.positive_prompt = positive_prompt
+        self.negative_prompt = negative_prompt
+        # seed를 직접 지정한 요청은 같은 결과를 다시 만들 수 있어야 하므로 다른 요청과 latent 배치를 나누지 않습니다.
+        self.fixed_seed = seed is not None
+        self.seed = seed if seed is not None else random.randint(0, MAX_SEED)
+        self.status = status
+        self.job = None
+        self.future = asyncio.get_running_loop().create_future()  # 결과: 이미지 정보 dict
+        self.created_at = time.perf_counter()
+
+    def batch_key(self):
+        # ComfyUI는 한 워크플로우 안의 KSampler 체인을 차례로 실행하므로 프롬프트가 다른 요청은 묶어도 빨라지지 않습니다.
+        # 같은 latent 배치를 나눠 쓸 수 있는 요청(프롬프트와 지정 seed까지 같은 요청)만 묶습니다.
+        fixed = self.seed if self.fixed_seed else None
+        return (self.template.name, tuple(sorted(self.settings.items())),
+                self.positive_prompt, self.negative_prompt, fixed)
+
+
+class CancelView(discord.ui.View):
+    """이미지 생성 진행 메시지에 붙는 취소 버튼."""
+
+    def __init__(self, status):
+        super().__init__(timeout=None)
+        self.status = status
+
+    @discord.ui.button(label="취소", style=discord.ButtonStyle.danger)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.status.owner_id:
+            await interaction.response.send_message("요청한 사용자만 취소할 수 있습니다.", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await self.status.on_cancel()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ComfyUIError) as e:
+            await interaction.followup.send(f"취소 요청 실패: {str(e) or type(e).__name__}", ephemeral=True)
+            return
+        await interaction.followup.send("취소를 요청했습니다.", ephemeral=True)
+
+
+class GenerationStatus:
+    """
+    /generate_image의 진행 상황(대기 순번, 단계, 예상 남은 시간)을 followup 메시지에 표시합니다.
+    편집은 interval 초마다 내용이 바뀌었을 때만 합니다.
+    """
+
+    def __init__(self, comfy, owner_id, interval: float = 2.0, on_cancel=None):
+        self.comfy = comfy
+        self.owner_id = owner_id
+        self.on_cancel = on_cancel  # async () -> None, 취소 버튼이 눌렸을 때 호출
+        self.interval = interval
+        self.job = None
+        self.message = None
+        self.position = None
+        self.started = False
+        self.step = 0
+        self.total = 0
+        self._progress_start = None  # (시각, 단계)
+        self._task = None
+        self._rendered = None
+        self.created_at = time.monotonic()
+
+    def attach(self, job):
+        self.job = job
+
+    def on_event(self, event_type, data):
+        if event_type in ("execution_start", "executing"):
+            self.started = True
+        elif event_type == "progress":
+            self.started = True
+            value, total = data.get("value", 0), data.get("max", 0)
+            # 새 샘플러 노드가 시작되면 ETA 기준점을 다시 잡습니다.
+            if self._progress_start is None or value < self.step or total != self.total:
+                self._progress_start = (time.monotonic(), value)
+            self.step, self.total = value, total
+
+    def eta(self):
+        if self._progress_start is None or not self.total:
+            return None
+        started_at, started_step = self._progress_start
+        done = self.step - started_step
+        if done <= 0:
+            return None
+        rate = (time.monotonic() - started_at) / done
+        return rate * (self.total - self.step)
+
+    def render(self) -> str:
+        if self.job is None:
+            return "이미지 생성 요청을 준비하는 중입니다..."
+        if not self.started:
+            if self.position:
+                return f"대기 중입니다. (대기열 {self.position}번째)"
+            return "대기 중입니다..."
+        if not self.total:
+            return "이미지를 생성하는 중입니다..."
+        text = f"이미지를 생성하는 중입니다... {self.step}/{self.total} 단계"
+        eta = self.eta()
+        if eta is not None:
+            text += f" (약 {eta:.0f}초 남음)"
+        return text
+
+    async def start(self, interaction: discord.Interaction):
+        self._rendered = self.render()
+        self.message = await interaction.followup.send(self._rendered, view=CancelView(self), wait=True)
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.job is not None and not self.started:
+                try:
+                    self.position = await self.comfy.queue_position(self.job.prompt_id)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ComfyUIError) as e:
+                    # 한 번 실패해도 다음 주기에 다시 조회하고, 단계/예상 시간 표시는 계속합니다.
+                    log.warning("progress.queue_position_failed", prompt_id=self.job.prompt_id,
+                                error=str(e) or type(e).__name__)
+            text = self.render()
+            if text != self._rendered:
+                try:
+                    await self.message.edit(content=text)
+                    self._rendered = text
+                except discord.HTTPException as e:
+                    log.warning("progress.edit_failed", error=str(e))
+
+    async def finish(self, text: str):
+        """진행 상황 갱신을 멈추고 최종 문구로 바꾸며 취소 버튼을 제거합니다."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.message is not None:
+            try:
+                await self.message.edit(content=text, view=None)
+            except discord.HTTPException as e:
+                log.warning("progress.edit_failed", error=str(e))
 
 
 class ImageGenCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
-        self.server_address = os.getenv("COMFYUI_SERVER_ADDRESS", "127.0.0.1:8188")
+        # 봇이 관리하는 ComfyUI용 세션 (연결 풀, 타임아웃 포함). 닫는 것은 봇이 합니다.
+        self.session = get_http_clients(bot).session("comfyui")
+        # 쉼표로 여러 서버를 주면 작업을 부하가 적은 서버로 나눠 보냅니다.
+        self.server_addresses = [address.strip() for address in
+                                 os.getenv("COMFYUI_SERVER_ADDRESS", "127.0.0.1:8188").split(",") if address.strip()]
+        self.server_address = self.server_addresses[0]
         self.client_id = str(uuid.uuid4())
+        # 모든 작업이 공유하는 웹소켓 연결 (cog_load에서 시작)
+        self.comfy = ComfyUIPool(
+            self.session, self.server_addresses, self.client_id,
+            health_interval=float(os.getenv("COMFYUI_HEALTH_INTERVAL", "5")),
+            max_failures=int(os.getenv("COMFYUI_MAX_FAILURES", "3")),
+            checkpoint_penalty=float(os.getenv("COMFYUI_CHECKPOINT_PENALTY", "1")),
+        )
+        self.progress_interval = float(os.getenv("COMFYUI_PROGRESS_INTERVAL", "2.0"))
+        # 짧은 시간 안에 들어온 같은 요청(같은 워크플로우/매개변수/프롬프트)을 하나의 latent 배치로 묶습니다.
+        # 최근에 같은 요청이 없었으면 기다리지 않고 바로 보냅니다.
+        self.batcher = MicroBatcher(
+            self._run_batch,
+            window=float(os.getenv("COMFYUI_BATCH_WINDOW", "0.5")),
+            max_batch=int(os.getenv("COMFYUI_MAX_BATCH", "4")),
+            eager=True,
+        )
+        self._batch_members = {}  # prompt_id -> [ImageRequest]
+        # 워크플로우 템플릿은 cog_load에서 한 번 불러와 검증합니다.
+        self.workflow_dir = os.getenv("COMFYUI_WORKFLOW_DIR", DEFAULT_WORKFLOW_DIR)
+        self.default_template = os.getenv("COMFYUI_DEFAULT_WORKFLOW", "sdxl")
+        self.templates = {}
+        # 같은 템플릿/매개변수/프롬프트/seed 조합의 결과 이미지를 디스크에 보관합니다 (0이면 끔).
+        cache_mb = int(os.getenv("COMFYUI_CACHE_MAX_MB", "512"))
+        self.image_cache = ImageCache(os.getenv("COMFYUI_CACHE_DIR", "image_cache"), cache_mb * 1024 * 1024) if cache_mb > 0 else None
+        # 업로드 전에 PNG를 WebP/JPEG로 다시 인코딩합니다 (png면 원본 그대로).
+        self.encoder = OutputEncoder(
+            os.getenv("COMFYUI_OUTPUT_FORMAT", "webp").lower(),
+            quality=int(os.getenv("COMFYUI_OUTPUT_QUALITY", "90")),
+            max_workers=int(os.getenv("COMFYUI_ENCODE_WORKERS", "2")),
+        )
+        # 봇과 ComfyUI가 같은 호스트라면 출력 디렉터리에서 바로 읽습니다.
+        # "경로" 하나면 모든 서버에, "주소=경로,주소=경로"면 서버별로 적용합니다.
+        self.output_dirs = {}
+        for entry in filter(None, (e.strip() for e in os.getenv("COMFYUI_OUTPUT_DIR", "").split(","))):
+            address, _, path = entry.rpartition("=")
+            for server in ([address] if address else self.server_addresses):
+                self.output_dirs[server] = path
+
+    async def cog_load(self):
+        self.templates = await asyncio.to_thread(load_templates, self.workflow_dir)
+        if self.default_template not in self.templates:
+            fallback = next(iter(self.templates))
+            log.warning("template.default_missing", name=self.default_template, fallback=fallback)
+            self.default_template = fallback
+        if self.image_cache is not None:
+            await self.image_cache.load()
+        await self.comfy.start()
 
     async def cog_unload(self):
-        await self.session.close()
+        await self.batcher.close()
+        log.info("comfyui.workers", workers=self.comfy.stats())
+        if self.image_cache is not None:
+            log.info("image_cache.stats", **self.image_cache.stats())
+        await self.comfy.close()
+        self.encoder.close()
 
     async def queue_prompt(self, prompt_workflow):
-        """ComfyUI에 프롬프트를 전송하고 웹소켓으로 결과를 수신합니다."""
-        prompt_url = f"http://{self.server_address}/prompt"
-        ws_url = f"ws://{self.server_address}/ws?clientId={self.client_id}"
-
-        # 1. 프롬프트 전송 (HTTP POST)
-        async with self.session.post(prompt_url, json={'prompt': prompt_workflow, 'client_id': self.client_id}) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                raise Exception(f"ComfyUI API 에러: {resp.status} - {error_text}")
-            queue_data = await resp.json()
-            prompt_id = queue_data['prompt_id']
-
-        # 2. 웹소켓 연결 및 결과 대기
-        async with self.session.ws_connect(ws_url) as ws:
-            while True:
-                msg = await ws.receive()
-                if msg.type == aiohttp.WSMsgType.TEXT:
-                    message = json.loads(msg.data)
-                    # 'executed' 타입의 메시지이고, 전송한 프롬프트 ID와 일치하는 경우
-                    if message['type'] == 'executed' and message['data']['prompt_id'] == prompt_id:
-                        outputs = message['data']['output']['images']
-                        return outputs
-                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
-                    break
-        return None
-
-    async def get_image(self, filename, subfolder, folder_type):
-        """/view 엔드포인트를 통해 생성된 이미지를 가져옵니다."""
-        view_url = f"http://{self.server_address}/view"
+        """ComfyUI에 프롬프트를 전송하고, 공유 웹소켓으로 해당 prompt_id의 결과를 기다립니다."""
+        return await self.comfy.queue_prompt(prompt_workflow)
+
+    async def _run_batch(self, key, requests):
+        """같은 요청들을 하나의 latent 배치로 실행하고 결과 이미지를 요청별로 나눠 줍니다."""
+        live = [request for request in requests if not request.future.done()]
+        if not live:
+            return
+        now = time.perf_counter()
+        for request in live:
+            QUEUE_WAIT.observe(now - request.created_at, queue="comfyui_batch")
+
+        # batch_key가 같으므로 모두 한 체인입니다. seed를 지정한 요청들은 같은 이미지 한 장을 함께 받습니다.
+        first = live[0]
+        fixed = first.fixed_seed
+        chain = (first.positive_prompt, first.negative_prompt, first.seed, 1 if fixed else len(live))
+        (output_node,), workflow = first.template.build(first.settings, [chain])
+
+        def on_event(event_type, data):
+            for request in live:
+                if request.status is not None and not request.future.done():
+                    request.status.on_event(event_type, data)
+
+        try:
+            with BACKEND_REQUEST_DURATION.time(backend="comfyui", op="submit"):
+                job = await self.comfy.submit(workflow, on_event=on_event)
+            self._batch_members[job.prompt_id] = live
+            for request in live:
+                request.job = job
+                if request.status is not None:
+                    request.status.attach(job)
+            try:
+                with BACKEND_REQUEST_DURATION.time(backend="comfyui", op="execute"):
+                    await self.comfy.wait(job)
+            finally:
+                self._batch_members.pop(job.prompt_id, None)
+        except Exception as e:
+            if not isinstance(e, GenerationCancelled):
+                record_error("comfyui", e)
+            for request in live:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        images = job.outputs.get(output_node, {}).get("images", [])
+        for index, request in enumerate(live):
+            if request.future.done():
+                continue
+            image_index = 0 if fixed else index
+            if image_index < len(images):
+                # 결과 이미지는 작업을 실행한 서버에서 받아야 합니다. latent 배치의 첫 이미지만
+                # seed 하나로 다시 만들 수 있으므로 그때만 seed를 함께 돌려줍니다.
+                seed = first.seed if image_index == 0 else None
+                request.future.set_result(dict(images[image_index], server=job.server_address, seed=seed))
+            else:
+                request.future.set_exception(ComfyUIError("ComfyUI로부터 이미지 데이터를 받지 못했습니다."))
+
+    async def cancel_request(self, request):
+        """요청 하나를 취소합니다. 같은 배치의 모든 요청이 취소되면 ComfyUI 작업도 취소합니다."""
+        if not request.future.done():
+            request.future.set_exception(GenerationCancelled("작업이 취소되었습니다."))
+        job = request.job
+        if job is None:
+            return  # 아직 배치가 제출되지 않았으면 _run_batch에서 건너뜁니다.
+        members = self._batch_members.get(job.prompt_id)
+        if members is None:
+            return  # 생성은 이미 끝났고 다운로드/인코딩 중입니다.
+        if all(member.future.done() for member in members):
+            await self.comfy.cancel(job)
+
+    def template(self, name=None):
+        template = self.templates.get(name or self.default_template)
+        if template is None:
+            raise TemplateError(f"{name} 워크플로우가 없습니다. ({', '.join(self.templates)})")
+        return template
+
+    def cache_key(self, template, settings, positive_prompt, negative_prompt, seed) -> str:
+        # 캐시에는 인코딩한 결과를 저장하므로 출력 형식도 키에 넣습니다.
+        return ImageCache.key(template.digest, settings, positive_prompt, negative_prompt, seed,
+                              self.encoder.format, self.encoder.quality)
+
+    async def render(self, positive_prompt, negative_prompt, settings=None, seed=None, status=None,
+                     template=None, preset=None):
+        """
+        요청을 배치 대기열에 넣고, 생성된 이미지 정보(filename, subfolder, type, server, seed)를 반환합니다.
+        settings는 템플릿 기본값/프리셋 위에 덮어쓸 매개변수입니다. seed는 다시 만들 수 없는 이미지면 None입니다.
+        """
+        template = self.template(template)
+        settings = template.resolve(preset, settings)
+        request = ImageRequest(template, settings, positive_prompt, negative_prompt, seed, status)
+        if status is not None:
+            status.on_cancel = lambda: self.cancel_request(request)
+        self.batcher.submit(request.batch_key(), request)
+        return await request.future
+
+    def _open_local(self, server, filename, subfolder, folder_type):
+        """공유 출력 디렉터리에 파일이 있으면 mmap으로 엽니다. 없으면 None."""
+        root = self.output_dirs.get(server)
+        if root is None or folder_type != "output":
+            return None
+        path = os.path.realpath(os.path.join(root, subfolder, filename))
+        if not path.startswith(os.path.realpath(root) + os.sep):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    async def open_image(self, filename, subfolder, folder_type, server=None):
+        """
+        생성된 이미지를 읽기용 파일 객체로 엽니다 (호출자가 닫습니다). server가 없으면 첫 번째 서버를 씁니다.
+        공유 출력 디렉터리가 있으면 mmap으로, 없으면 /view 응답을 조각으로 받아 임시 파일에 씁니다.
+        """
+        server = server or self.server_address
+        local = await asyncio.to_thread(self._open_local, server, filename, subfolder, folder_type)
+        if local is not None:
+            return local
         params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-        async with self.session.get(view_url, params=params) as resp:
-            if resp.status != 200:
-                raise Exception(f"이미지 다운로드 실패: {resp.status}")
-            return await resp.read()
+        spool = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES)
+        try:
+            with RequestTrace("comfyui", "view") as trace:
+                async with self.session.get(f"http://{server}/view", params=params) as resp:
+                    if resp.status != 200:
+                        raise Exception(f"이미지 다운로드 실패: {resp.status}")
+                    async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                        spool.write(chunk)
+                        trace.received(len(chunk))
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    async def get_image(self, filename, subfolder, folder_type, server=None) -> bytes:
+        """생성된 원본 이미지(PNG) 바이트를 가져옵니다."""
+        source = await self.open_image(filename, subfolder, folder_type, server)
+        with source:
+            return source.read()
 
     @app_commands.command(name="generate_image", description="ComfyUI를 사용하여 이미지를 생성합니다.")
     @app_commands.describe(
         positive_prompt="이미지에 포함하고 싶은 내용을 입력하세요 (긍정 프롬프트).",
-        negative_prompt="이미지에 포함하고 싶지 않은 내용을 입력하세요 (부정 프롬프트, 선택 사항)."
+        negative_prompt="이미지에 포함하고 싶지 않은 내용을 입력하세요 (부정 프롬프트, 선택 사항).",
+        preset="품질 프리셋 (예: draft, fast, quality). 비워 두면 워크플로우 기본값을 씁니다.",
+        seed="같은 프롬프트와 seed로 같은 이미지를 다시 받을 수 있습니다 (선택 사항).",
+        workflow="사용할 워크플로우 템플릿 (선택 사항).",
     )
-    async def generate_image(self, interaction: discord.Interaction, positive_prompt: str, negative_prompt: str = ""):
+    async def generate_image(self, interaction: discord.Interaction, positive_prompt: str, negative_prompt: str = "",
+                             preset: str = None, seed: app_commands.Range[int, 0, MAX_SEED] = None, workflow: str = None):
         await interaction.response.defer(ephemeral=False)
-        print(f"Positive Prompt: {positive_prompt}")
+        log.info("image.requested", user=interaction.user.id, positive_prompt=positive_prompt,
+                 negative_prompt=negative_prompt, preset=preset, seed=seed, workflow=workflow)
         positive_prompt = positive_prompt.join("masterpiece, best quality, very awa, newest, recent,")  # 프롬프트를 조합합니다.
-        if negative_prompt != "":
-            print(f"Negative Prompt: {negative_prompt}")
         negative_prompt = negative_prompt.join("worst quality, worst displeasing, bad anatomy, mosaic censoring, censored, bar censor, watermark, username, signature, twitter username, closed eyes, chibi, deformed,")
 
         try:
-            # SDXL 워크플로우 정의
-            # 각 노드는 ComfyUI의 빌딩 블록에 해당합니다.
-            prompt_workflow = {
-                # 4: 모델 로더. 사용할 SDXL 체크포인트 파일을 지정합니다.
-                "4": {
-                    "class_type": "CheckpointLoaderSimple",
-                    "inputs": {"ckpt_name": "noobaiXLNAIXL_vPred10Version.safetensors"} # 사용하시는 모델 파일명으로 변경하세요.
-                },
-                # 6: 긍정 프롬프트 인코더 (SDXL용)
-                "6": {
-                    "class_type": "CLIPTextEncodeSDXL",
-                    "inputs": {
-                        "width": 1024, "height": 1536, "crop_w": 0, "crop_h": 0,
-                        "target_width": 1024, "target_height": 1536,
-                        "text_g": positive_prompt, "text_l": positive_prompt,
-                        "clip": ["4", 1] # 모델 로더(4)의 CLIP을 사용
-                    }
-                },
-                # 7: 부정 프롬프트 인코더 (SDXL용)
-                "7": {
-                    "class_type": "CLIPTextEncodeSDXL",
-                    "inputs": {
-                        "width": 1024, "height": 1536, "crop_w": 0, "crop_h": 0,
-                        "target_width": 1024, "target_height": 1536,
-                        "text_g": negative_prompt, "text_l": negative_prompt,
-                        "clip": ["4", 1] # 모델 로더(4)의 CLIP을 사용
-                    }
-                },
-                # 5: 빈 이미지(Latent) 생성. 여기서 이미지 크기를 결정합니다.
-                "5": {
-                    "class_type": "EmptyLatentImage",
-                    "inputs": {"width": 1024, "height": 1536, "batch_size": 1}
-                },
-                # 3: KSampler. 실제 이미지 샘플링을 수행하는 핵심 노드입니다.
-                "3": {
-                    "class_type": "KSampler",
-                    "inputs": {
-                        "seed": random.randint(0, 18446744073709551615),
-                        "steps": 50, "cfg": 0.6, "sampler_name": "euler_cfg_pp", "scheduler": "beta",
-                        "denoise": 1.0,
-                        "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0]
-                    }
-                },
-                # 8: VAE 디코더. Latent 이미지를 실제 픽셀 이미지로 변환합니다.
-                "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
-                # 9: 이미지 저장. 최종 결과물을 파일로 저장합니다.
-                "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI_DiscordBot", "images": ["8", 0]}}
-            }
-
-            # 프롬프트 큐에 작업을 넣고 결과(이미지 정보)를 기다립니다.
-            images_output = await self.queue_prompt(prompt_workflow)
-            if not images_output:
-                raise Exception("ComfyUI로부터 이미지 데이터를 받지 못했습니다.")
-
-            # 받은 이미지 정보로 실제 이미지 데이터를 다운로드합니다.
-            first_image_info = images_output[0]
-            image_data = await self.get_image(first_image_info['filename'], first_image_info['subfolder'], first_image_info['type'])
+            template = self.template(workflow)
+            settings = template.resolve(preset or template.default_preset)
+        except TemplateError as e:
+            await interaction.followup.send(str(e))
+            return
 
-            img_bytes = BytesIO(image_data)
-            img_bytes.seek(0)
+        # seed를 지정했고 같은 조합을 이미 만든 적이 있으면 생성 없이 바로 보냅니다.
+        if seed is not None and self.image_cache is not None:
+            cached = await self.image_cache.get(self.cache_key(template, settings, positive_prompt, negative_prompt, seed))
+            if cached is not None:
+                with DISCORD_API_DURATION.time(op="send_file"):
+                    await interaction.followup.send(f"이전에 생성한 이미지입니다. (seed {seed})",
+                                                    file=discord.File(fp=BytesIO(cached), filename=f"generated.{self.encoder.extension}", spoiler=True))
+                return
 
-            # 사용자에게 이미지 전송
-            await interaction.followup.send(file=discord.File(fp=img_bytes, filename="generated.png", spoiler=True))
+        status = GenerationStatus(self.comfy, interaction.user.id, interval=self.progress_interval)
+        try:
+            # 진행 상황 메시지를 띄우고, 배치 대기열에 요청을 넣어 결과(이미지 정보)를 기다립니다.
+            await status.start(interaction)
+            first_image_info = await self.render(positive_prompt, negative_prompt, seed=seed, status=status,
+                                                 template=template.name, preset=preset or template.default_preset)
+
+            # 받은 이미지 정보로 이미지를 내려받아(또는 공유 디렉터리에서 열어) 업로드용 형식으로 인코딩합니다.
+            source = await self.open_image(first_image_info['filename'], first_image_info['subfolder'], first_image_info['type'],
+                                           first_image_info.get('server'))
+            with source:
+                image_data = await self.encoder.encode(source)
+            result_seed = first_image_info.get('seed')
+
+            # 인코딩이 끝나면 바로 업로드를 시작하고, 진행 메시지 정리는 함께 진행합니다.
+            done = f"이미지 생성이 완료되었습니다. ({time.monotonic() - status.created_at:.0f}초"
+            with DISCORD_API_DURATION.time(op="send_file"):
+                await asyncio.gather(
+                    interaction.followup.send(file=discord.File(fp=BytesIO(image_data), filename=f"generated.{self.encoder.extension}", spoiler=True)),
+                    status.finish(done + (f", seed {result_seed})" if result_seed is not None else ")")),
+                )
+            if result_seed is not None and self.image_cache is not None:
+                await self.image_cache.put(
+                    self.cache_key(template, settings, positive_prompt, negative_prompt, result_seed), image_data)
 
+        except GenerationCancelled:
+            await status.finish("이미지 생성이 취소되었습니다.")
         except Exception as e:
+            await status.finish("이미지 생성에 실패했습니다.")
             await interaction.followup.send(f"이미지 생성 중 오류 발생: {str(e)}")
 
+    @generate_image.autocomplete("workflow")
+    async def workflow_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=f"{name} - {template.description}"[:100], value=name)
+                for name, template in self.templates.items() if current.lower() in name.lower()][:25]
+
+    @generate_image.autocomplete("preset")
+    async def preset_autocomplete(self, interaction: discord.Interaction, current: str):
+        template = self.templates.get(getattr(interaction.namespace, "workflow", None) or self.default_template)
+        if template is None:
+            return []
+        return [app_commands.Choice(name=preset, value=preset)
+                for preset in template.presets if current.lower() in preset.lower()][:25]
+
 
 async def setup(bot):
     await bot.add_cog(ImageGenCog(bot))
 
 if __name__ == '__main__':
+    # 저장소 루트에서 `python -m Cogs.ImageGen`으로 실행합니다.
     async def main():
         # 테스트를 위한 ImageGenCog 인스턴스 생성
-        # bot 객체는 실제 디스코드 기능에 필요하지 않으므로, 테스트에서는 None으로 전달합니다.
-        cog = ImageGenCog(bot=None)
+        # 디스코드 기능은 쓰지 않으므로, 공유 객체(HTTP 세션 등)만 담을 빈 객체를 bot으로 전달합니다.
+        bot = types.SimpleNamespace()
+        cog = ImageGenCog(bot=bot)
+        await cog.cog_load()
         print("ComfyUI 이미지 생성 테스트를 시작합니다...")
 
         # 테스트용 프롬프트
@@ -153,36 +478,14 @@ if __name__ == '__main__':
         test_negative_prompt = "worst quality, worst displeasing, bad anatomy, mosaic censoring, censored, bar censor, watermark, username, signature, twitter username, closed eyes, chibi, deformed,"
 
         try:
-            # generate_image 메소드와 동일한 워크플로우를 사용합니다.
-            # 4번 노드의 ckpt_name을 실제 사용하는 모델 파일명으로 변경해야 할 수 있습니다.
-            prompt_workflow = {
-                "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "noobaiXLNAIXL_vPred10Version.safetensors"}},
-                "6": {
-                    "class_type": "CLIPTextEncodeSDXL",
-                    "inputs": {
-                        "width": 1024, "height": 1536, "crop_w": 0, "crop_h": 0, "target_width": 1024, "target_height": 1536,
-                        "text_g": test_positive_prompt, "text_l": test_positive_prompt, "clip": ["4", 1]
-                    }
-                },
-                "7": {
-                    "class_type": "CLIPTextEncodeSDXL",
-                    "inputs": {
-                        "width": 1024, "height": 1536, "crop_w": 0, "crop_h": 0, "target_width": 1024, "target_height": 1536,
-                        "text_g": test_negative_prompt, "text_l": test_negative_prompt, "clip": ["4", 1]
-                    }
-                },
-                "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1536, "batch_size": 1}},
-                "3": {
-                    "class_type": "KSampler",
-                    "inputs": {
-                        "seed": random.randint(0, 18446744073709551615), "steps": 50, "cfg": 0.6,
-                        "sampler_name": "euler_cfg_pp", "scheduler": "beta", "denoise": 1.0,
-                        "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0]
-                    }
-                },
-                "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
-                "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI_Test", "images": ["8", 0]}}
-            }
+            # generate_image 메소드와 동일한 워크플로우 템플릿을 사용합니다.
+            # 체크포인트 파일명은 workflows/sdxl.json의 ckpt_name 기본값을 실제 사용하는 모델 파일명으로 변경해야 할 수 있습니다.
+            template = cog.template()
+            _, prompt_workflow = template.build(
+                template.resolve(template.default_preset),
+                [(test_positive_prompt, test_negative_prompt, random.randint(0, MAX_SEED), 1)],
+                filename_prefix="ComfyUI_Test",
+            )
 
             print("프롬프트를 ComfyUI 서버로 전송합니다...")
             images_output = await cog.queue_prompt(prompt_workflow)
@@ -203,5 +506,6 @@ if __name__ == '__main__':
             print(f"\n[오류] 테스트 중 오류 발생: {e}")
         finally:
             await cog.cog_unload()
+            await close_http_clients(bot)
 
     asyncio.run(main())
\ No newline at end of file
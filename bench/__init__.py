@@ -0,0 +1,5 @@
+"""
+네트워크나 GPU 없이 Cog의 성능을 확인하기 위한 벤치마크 스크립트 모음.
+
+저장소 루트에서 `python -m bench.<스크립트>` 형태로 실행합니다.
+"""
@@ -0,0 +1,175 @@
+"""
+부하 테스트용 가짜 Discord 객체.
+
+Cog가 실제로 쓰는 속성과 메서드(메시지 전송/편집, 인터랙션 defer/followup, 봇 리스너)만 흉내 내며,
+모든 API 호출은 latency초 뒤에 끝나고 호출 횟수와 시각을 기록합니다.
+ExtensionBot은 실제 discord.py 봇이라서 확장을 main.py와 같은 load_extension 경로로 불러옵니다.
+"""
+import asyncio
+import itertools
+import time
+
+import discord
+from discord.ext import commands
+
+_ids = itertools.count(10_000)
+
+
+class DiscordStats:
+    """가짜 API 호출 횟수. 여러 채널/인터랙션이 하나를 공유합니다."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.sends = 0
+        self.edits = 0
+        self.deletes = 0
+        self.reactions = 0
+
+    async def call(self, kind: str):
+        setattr(self, kind, getattr(self, kind) + 1)
+        await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content: str = "", mentions=(), embed=None, attachments=()):
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.embed = embed
+        self.attachments = list(attachments)
+        self.guild = getattr(channel, "guild", None)
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        await self.channel.stats.call("edits")
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        self.channel.touch()
+        return self
+
+    async def delete(self):
+        await self.channel.stats.call("deletes")
+
+    async def add_reaction(self, emoji):
+        await self.channel.stats.call("reactions")
+
+
+class FakeChannel:
+    """메시지를 보낸 시각을 기록하는 텍스트 채널. first_response_at은 mark() 이후 첫 전송 시각입니다."""
+
+    def __init__(self, channel_id: int, guild, stats: DiscordStats, bot_user):
+        self.id = channel_id
+        self.guild = guild
+        self.stats = stats
+        self.bot_user = bot_user
+        self.first_response_at = None
+        self.last_activity_at = None
+
+    def mark(self):
+        self.first_response_at = None
+        self.last_activity_at = None
+
+    def touch(self):
+        now = time.perf_counter()
+        if self.first_response_at is None:
+            self.first_response_at = now
+        self.last_activity_at = now
+
+    async def send(self, content=None, embed=None, file=None, **kwargs):
+        await self.stats.call("sends")
+        self.touch()
+        return FakeMessage(self, self.bot_user, content or "", embed=embed)
+
+
+class _FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, ephemeral: bool = False, **kwargs):
+        await self.interaction.stats.call("sends")
+
+    async def send_message(self, content=None, embed=None, ephemeral: bool = False, **kwargs):
+        await self.interaction.stats.call("sends")
+        self.interaction.channel.touch()
+
+
+class _FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, embed=None, file=None, view=None, wait: bool = False, **kwargs):
+        if file is not None:
+            self.interaction.files += 1
+        return await self.interaction.channel.send(content, embed=embed)
+
+
+class FakeInteraction:
+    """슬래시 커맨드 인터랙션. followup 메시지는 channel로 보냅니다."""
+
+    def __init__(self, user, channel):
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.stats = channel.stats
+        self.files = 0
+        self.response = _FakeResponse(self)
+        self.followup = _FakeFollowup(self)
+
+
+class FakeBot:
+    """Cog와 utils가 봇 객체에서 쓰는 부분(user, started_at, 리스너, 공유 속성)만 가진 봇."""
+
+    def __init__(self, user_id: int = 1):
+        self.user = FakeUser(user_id, bot=True)
+        self.started_at = time.perf_counter()
+        self.listeners = {}
+
+    def add_listener(self, func, name: str = None):
+        self.listeners.setdefault(name or func.__name__, []).append(func)
+
+    async def dispatch(self, event: str, *args):
+        """등록된 리스너를 모두 실행하고 끝날 때까지 기다립니다 (discord.py는 태스크로 띄웁니다)."""
+        await asyncio.gather(*(listener(*args) for listener in self.listeners.get(event, [])))
+
+    async def is_owner(self, user) -> bool:
+        return False
+
+
+class ExtensionBot(commands.Bot):
+    """
+    게이트웨이에 연결하지 않는 실제 discord.py 봇. load_extension, add_cog, 커맨드 트리 등록을
+    그대로 거치므로 Cog끼리 커맨드 이름이 겹치면 main.py에서처럼 불러오기가 실패합니다.
+    """
+
+    def __init__(self, user_id: int = 1):
+        super().__init__(command_prefix="!", intents=discord.Intents.none())
+        self._fake_user = FakeUser(user_id, bot=True)
+        self.started_at = time.perf_counter()
+
+    @property
+    def user(self):
+        return self._fake_user
+
+    async def deliver(self, event: str, *args):
+        """add_listener로 등록된 리스너를 모두 실행하고 끝날 때까지 기다립니다 (dispatch는 태스크로 띄웁니다)."""
+        await asyncio.gather(*(listener(*args) for listener in self.extra_events.get(event, [])))
+
+    async def is_owner(self, user) -> bool:
+        return False
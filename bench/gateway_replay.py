@@ -0,0 +1,189 @@
+"""
+게이트웨이 이벤트 재생 벤치마크.
+
+합성한 게이트웨이 이벤트(GUILD_CREATE, PRESENCE_UPDATE, GUILD_MEMBER_UPDATE, TYPING_START,
+MESSAGE_CREATE, MESSAGE_REACTION_ADD)를 discord.py 파서에 그대로 넣어,
+INTENTS_PROFILE=full과 lean의 메모리 사용량과 CPU 시간을 비교합니다.
+Discord가 켜지지 않은 인텐트의 이벤트는 보내지 않으므로, 재생할 때도 같은 방식으로 걸러냅니다.
+
+    python -m bench.gateway_replay --guilds 20 --members 2000 --events 50000
+"""
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from discord.ext import commands
+from discord.user import ClientUser
+
+from utils.intents import client_options
+from utils.router import get_router
+
+BOT_ID = 1
+TIMESTAMP = "2024-01-01T00:00:00+00:00"
+
+# 이벤트 종류 -> (필요한 인텐트, 비율)
+EVENT_MIX = {
+    "PRESENCE_UPDATE": ("presences", 0.60),
+    "GUILD_MEMBER_UPDATE": ("members", 0.10),
+    "TYPING_START": ("guild_typing", 0.15),
+    "MESSAGE_CREATE": ("guild_messages", 0.10),
+    "MESSAGE_REACTION_ADD": ("guild_reactions", 0.05),
+}
+
+
+def _user(user_id):
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0",
+            "avatar": None, "global_name": f"User {user_id}"}
+
+
+def _member_fields():
+    return {"roles": [], "joined_at": TIMESTAMP, "deaf": False, "mute": False, "flags": 0}
+
+
+def _member(user_id):
+    return dict(_member_fields(), user=_user(user_id))
+
+
+def _guild_id(index):
+    return 10_000 + index
+
+
+def _channel_id(guild_id):
+    return guild_id * 10
+
+
+def _member_id(guild_id, index):
+    return guild_id * 100_000 + index + 2
+
+
+def guild_create(guild_id, members, intents):
+    """켜진 인텐트에 맞춰 Discord가 보내는 것과 같은 모양의 GUILD_CREATE를 만듭니다."""
+    # 멤버 인텐트가 없으면 봇 자신만 포함되며, 멤버 목록은 청크 요청 결과까지 받은 상태로 봅니다.
+    member_ids = [_member_id(guild_id, i) for i in range(members)] if intents.members else []
+    return {
+        "id": str(guild_id), "name": f"guild {guild_id}", "owner_id": str(_member_id(guild_id, 0)),
+        "member_count": members + 1, "large": members > 250, "features": [], "emojis": [], "stickers": [],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(_channel_id(guild_id)), "type": 0, "name": "general", "position": 0,
+                      "permission_overwrites": []}],
+        "threads": [], "voice_states": [], "stage_instances": [], "guild_scheduled_events": [],
+        "members": [_member(BOT_ID)] + [_member(member_id) for member_id in member_ids],
+        "presences": [
+            {"user": {"id": str(member_id)}, "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+            for member_id in member_ids
+        ] if intents.presences else [],
+    }
+
+
+def event_stream(guilds, members, events, seed=0):
+    """인텐트와 상관없는 전체 이벤트 스트림 (이벤트 종류, 필요한 인텐트, 페이로드)."""
+    rng = random.Random(seed)
+    kinds = list(EVENT_MIX)
+    weights = [EVENT_MIX[kind][1] for kind in kinds]
+    for n in range(events):
+        kind = rng.choices(kinds, weights)[0]
+        guild_id = _guild_id(rng.randrange(guilds))
+        user_id = _member_id(guild_id, rng.randrange(members))
+        channel_id = _channel_id(guild_id)
+        if kind == "PRESENCE_UPDATE":
+            data = {"user": {"id": str(user_id)}, "guild_id": str(guild_id),
+                    "status": rng.choice(["online", "idle", "dnd"]),
+                    "activities": [{"name": f"game {rng.randrange(50)}", "type": 0}],
+                    "client_status": {"desktop": "online"}}
+        elif kind == "GUILD_MEMBER_UPDATE":
+            data = dict(_member(user_id), guild_id=str(guild_id), nick=f"nick{n}")
+        elif kind == "TYPING_START":
+            data = {"channel_id": str(channel_id), "guild_id": str(guild_id), "user_id": str(user_id),
+                    "timestamp": 1700000000, "member": _member(user_id)}
+        elif kind == "MESSAGE_CREATE":
+            mentions = [_user(BOT_ID)] if rng.random() < 0.01 else []
+            data = {"id": str(10**15 + n), "channel_id": str(channel_id), "guild_id": str(guild_id),
+                    "author": _user(user_id), "member": _member_fields(),
+                    "content": ("<@1> " if mentions else "") + "hello " * rng.randrange(1, 20),
+                    "timestamp": TIMESTAMP, "edited_timestamp": None, "tts": False, "mention_everyone": False,
+                    "mentions": mentions, "mention_roles": [], "attachments": [], "embeds": [], "pinned": False,
+                    "type": 0}
+        else:
+            data = {"user_id": str(user_id), "channel_id": str(channel_id), "message_id": str(10**15 + n),
+                    "guild_id": str(guild_id), "emoji": {"id": None, "name": "👍"}, "member": _member(user_id),
+                    "type": 0, "burst": False}
+        yield kind, EVENT_MIX[kind][0], data
+
+
+async def run(profile: str, guilds: int, members: int, stream, trace: bool) -> dict:
+    """한 프로필로 재생합니다. trace=True이면 tracemalloc으로 메모리를 재고, 아니면 CPU 시간만 잽니다."""
+    options = client_options(["ChatOllama", "ChatGemini", "ImageGen"], profile=profile)
+    intents = options["intents"]
+    # 페이로드는 측정 전에 만들어 두고, Discord처럼 켜진 인텐트의 이벤트만 보냅니다.
+    guild_payloads = [guild_create(_guild_id(i), members, intents) for i in range(guilds)]
+    stream = [(kind, data) for kind, intent, data in stream if getattr(intents, intent)]
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    bot = commands.Bot(command_prefix="!", **options)
+    await bot._async_setup_hook()  # 로그인 없이 이벤트 루프만 연결합니다.
+    state = bot._connection
+    # 재생에서는 멤버를 GUILD_CREATE에 모두 담아 보내므로 웹소켓 청크 요청은 하지 않습니다.
+    state._chunk_guilds = False
+    state.user = ClientUser(state=state, data=_user(BOT_ID) | {"bot": True})
+    routed = []
+
+    async def handler(message, prompt):
+        routed.append(message.id)
+
+    get_router(bot).register("bench", handler)
+
+    cpu = time.process_time()
+    for data in guild_payloads:
+        state.parsers["GUILD_CREATE"](data)
+    for n, (kind, data) in enumerate(stream):
+        state.parsers[kind](data)
+        if n % 1000 == 0:
+            await asyncio.sleep(0)  # 디스패치된 리스너 실행
+    await asyncio.sleep(0)
+    cpu = time.process_time() - cpu
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory() if trace else (0, 0)
+    tracemalloc.stop()
+    result = {
+        "cpu": cpu,
+        "current_mb": current / 1024 / 1024,
+        "peak_mb": peak / 1024 / 1024,
+        "delivered": len(stream),
+        "cached_members": sum(len(guild.members) for guild in bot.guilds),
+        "cached_messages": len(bot.cached_messages),
+        "routed": len(routed),
+    }
+    del bot, state
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=2000, help="길드당 멤버 수")
+    parser.add_argument("--events", type=int, default=50000)
+    args = parser.parse_args()
+
+    stream = list(event_stream(args.guilds, args.members, args.events))
+    results = {}
+    for profile in ("full", "lean"):
+        # tracemalloc은 CPU 시간을 크게 늘리므로 CPU와 메모리는 따로 잽니다.
+        cpu = (await run(profile, args.guilds, args.members, stream, trace=False))["cpu"]
+        results[profile] = dict(await run(profile, args.guilds, args.members, stream, trace=True), cpu=cpu)
+    print(f"{'profile':<9}{'events':>9}{'cpu(s)':>9}{'mem(MB)':>10}{'peak(MB)':>10}"
+          f"{'members':>10}{'messages':>10}{'routed':>8}")
+    for profile, r in results.items():
+        print(f"{profile:<9}{r['delivered']:>9}{r['cpu']:>9.2f}{r['current_mb']:>10.1f}{r['peak_mb']:>10.1f}"
+              f"{r['cached_members']:>10}{r['cached_messages']:>10}{r['routed']:>8}")
+    full, lean = results["full"], results["lean"]
+    print(f"memory: {full['current_mb'] / lean['current_mb']:.1f}x less, cpu: {full['cpu'] / lean['cpu']:.1f}x less")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+/generate_image 마이크로 배칭 벤치마크.
+
+스텁 ComfyUI 서버에 동시 요청을 보내, 배칭을 끈 경우(max_batch=1)와 켠 경우의
+분당 이미지 수를 비교합니다.
+
+같은 요청(프롬프트, 워크플로우, 매개변수)만 EmptyLatentImage 하나의 배치로 묶입니다. 서로 다른 프롬프트는
+묶지 않으므로 배칭을 켜도 빨라지지 않고, 최근에 같은 요청이 없던 요청은 기다리지 않고 바로 보내므로
+느려지지도 않아야 합니다. 요청 하나만 보낸 경우의 지연도 함께 보고합니다.
+
+    python -m bench.image_batching --requests 16 --distinct 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from bench.fake_discord import FakeBot
+from bench.stubs import StubComfyUI
+from utils.http import close_http_clients
+
+
+async def run(requests: int, distinct: int, window: float, max_batch: int, step_scale: float) -> dict:
+    stub = StubComfyUI(step_scale=step_scale)
+    os.environ["COMFYUI_SERVER_ADDRESS"] = await stub.start()
+    os.environ["COMFYUI_BATCH_WINDOW"] = str(window)
+    os.environ["COMFYUI_MAX_BATCH"] = str(max_batch)
+    os.environ["COMFYUI_CACHE_MAX_MB"] = "0"
+
+    from Cogs.ImageGen import ImageGenCog
+    bot = FakeBot()
+    cog = ImageGenCog(bot)
+    await cog.cog_load()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            cog.render(f"prompt {i % distinct}", "negative") for i in range(requests)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await cog.cog_unload()
+        await close_http_clients(bot)
+        await stub.stop()
+    return {
+        "elapsed": elapsed,
+        "images_per_min": requests / elapsed * 60,
+        "prompts": stub.prompts_run,
+        "mean_batch": cog.batcher.stats()["mean_batch_size"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--distinct", type=int, default=4, help="서로 다른 프롬프트 수")
+    parser.add_argument("--window", type=float, default=0.5)
+    parser.add_argument("--max-batch", type=int, default=4)
+    parser.add_argument("--step-scale", type=float, default=0.4, help="스텁 KSampler 스텝 수 배율")
+    args = parser.parse_args()
+
+    cases = [("identical prompts (latent batch)", args.requests, 1)]
+    if args.distinct > 1:
+        cases.append((f"{args.distinct} distinct prompts (batched per prompt)", args.requests, args.distinct))
+    cases.append(("single request (sent without waiting for the window)", 1, 1))
+    for title, requests, distinct in cases:
+        baseline = await run(requests, distinct, 0.0, 1, args.step_scale)
+        batched = await run(requests, distinct, args.window, args.max_batch, args.step_scale)
+        print(title)
+        print(f"{'mode':<10}{'elapsed(s)':>12}{'images/min':>12}{'prompts':>9}{'mean batch':>12}")
+        for name, result in (("baseline", baseline), ("batched", batched)):
+            print(f"{name:<10}{result['elapsed']:>12.2f}{result['images_per_min']:>12.1f}"
+                  f"{result['prompts']:>9}{result['mean_batch']:>12.2f}")
+        print(f"speedup: {baseline['elapsed'] / batched['elapsed']:.2f}x")
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+생성 이미지 다운로드/인코딩/업로드 벤치마크.
+
+스텁 ComfyUI의 /view가 1024x1536 PNG(수 MB)를 돌려주게 하고, 동시 작업 jobs개가 이미지를 받아
+업로드용으로 인코딩한 뒤 가짜 업로드(upload_mbps 대역폭으로 잠들기)를 하는 시간을 잽니다.
+모드마다 별도 프로세스에서 실행해 최대 RSS 증가량을 비교합니다.
+
+  - buffered-png: 이전 방식. resp.read()로 전체를 받고 PNG를 그대로 올립니다.
+  - png / webp / jpeg: /view를 조각으로 받아(임시 파일) 해당 형식으로 올립니다.
+  - mmap-webp: 공유 출력 디렉터리(COMFYUI_OUTPUT_DIR)에서 mmap으로 읽어 WebP로 올립니다.
+
+    python -m bench.image_output --jobs 8 --upload-mbps 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+MODES = ("buffered-png", "png", "webp", "jpeg", "mmap-webp")
+
+
+def synthetic_png(width: int = 1024, height: int = 1536) -> bytes:
+    """부드러운 그라데이션에 노이즈를 섞어 실제 생성 이미지와 비슷한 크기의 PNG를 만듭니다."""
+    size = (width, height)
+    base = Image.merge("RGB", (Image.linear_gradient("L").resize(size), Image.radial_gradient("L").resize(size),
+                               Image.linear_gradient("L").rotate(90).resize(size)))
+    noise = Image.merge("RGB", [Image.effect_noise(size, 48) for _ in range(3)])
+    out = BytesIO()
+    Image.blend(base, noise, 0.2).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_child(mode: str, jobs: int, upload_mbps: float) -> dict:
+    from bench.fake_discord import FakeBot
+    from bench.stubs import StubComfyUI
+    from utils.http import close_http_clients
+    from utils.scheduler import percentile
+
+    png = synthetic_png()
+    stub = StubComfyUI(image_bytes=png)
+    address = await stub.start()
+    output_dir = tempfile.TemporaryDirectory()
+    with open(os.path.join(output_dir.name, "bench.png"), "wb") as f:
+        f.write(png)
+    os.environ.update({
+        "COMFYUI_SERVER_ADDRESS": address,
+        "COMFYUI_OUTPUT_FORMAT": mode.split("-")[-1],
+        "COMFYUI_OUTPUT_DIR": output_dir.name if mode.startswith("mmap") else "",
+        "COMFYUI_CACHE_MAX_MB": "0",
+    })
+    from Cogs.ImageGen import ImageGenCog
+
+    bot = FakeBot()
+    cog = ImageGenCog(bot)
+    await cog.cog_load()
+    del png
+    rss_before = _max_rss_mb()
+    ready, sent, sizes = [], [], []
+
+    async def upload(data: bytes):
+        await asyncio.sleep(len(data) * 8 / (upload_mbps * 1_000_000))
+
+    async def job():
+        started = time.perf_counter()
+        if mode == "buffered-png":
+            async with cog.session.get(f"http://{address}/view", params={"filename": "bench.png"}) as resp:
+                data = await resp.read()
+        else:
+            source = await cog.open_image("bench.png", "", "output")
+            with source:
+                data = await cog.encoder.encode(source)
+        ready.append(time.perf_counter() - started)
+        await upload(data)
+        sent.append(time.perf_counter() - started)
+        sizes.append(len(data))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job() for _ in range(jobs)))
+    elapsed = time.perf_counter() - started
+    await cog.cog_unload()
+    await close_http_clients(bot)
+    await stub.stop()
+    output_dir.cleanup()
+    return {
+        "mode": mode,
+        "ready_p50": percentile(ready, 0.5),
+        "sent_p50": percentile(sent, 0.5),
+        "sent_p99": percentile(sent, 0.99),
+        "elapsed": elapsed,
+        "size_kb": sum(sizes) / len(sizes) / 1024,
+        "rss_delta_mb": _max_rss_mb() - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8, help="동시에 처리할 이미지 수")
+    parser.add_argument("--upload-mbps", type=float, default=20.0, help="가짜 Discord 업로드 대역폭 (Mbit/s)")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run_child(args.child, args.jobs, args.upload_mbps))
+        print("RESULT " + json.dumps(result))
+        return
+
+    print(f"{args.jobs} concurrent images, upload {args.upload_mbps:g} Mbit/s")
+    print(f"{'mode':<14}{'size KB':>9}{'ready p50':>11}{'sent p50':>10}{'sent p99':>10}{'RSS +MB':>9}")
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.image_output", "--child", mode,
+             "--jobs", str(args.jobs), "--upload-mbps", str(args.upload_mbps)],
+            capture_output=True, text=True, env=env, check=True,
+        ).stdout
+        result = json.loads(next(line for line in output.splitlines() if line.startswith("RESULT "))[7:])
+        print(f"{mode:<14}{result['size_kb']:>9.0f}{result['ready_p50']:>11.3f}{result['sent_p50']:>10.3f}"
+              f"{result['sent_p99']:>10.3f}{result['rss_delta_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
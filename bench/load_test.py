@@ -0,0 +1,243 @@
+"""
+채팅/이미지 Cog 부하 테스트.
+
+스텁 Ollama, Gemini, ComfyUI 서버와 가짜 Discord 객체(bench.fake_discord)로 실제 Cog 코드를 실행합니다.
+가상 사용자 N명이 동시에 봇을 멘션하거나 /generate_image를 호출하고, 각자 답을 받으면 다음 메시지를 보냅니다.
+Cog는 main.py처럼 load_extension으로 불러오고, 멘션 메시지는 봇과 같은 경로
+(on_message -> 메시지 라우터 -> 사용자가 고른 백엔드)로 들어갑니다.
+
+지연 시간(첫 응답, 완료)의 p50/p99, 처리량, 메모리(최대 RSS, 선택적으로 tracemalloc 최댓값)를 보고합니다.
+네트워크나 GPU 없이 돌아가므로 Cog 성능 변경을 전후로 비교하는 데 씁니다.
+
+    python -m bench.load_test --scenario all --users 20 --messages 5
+    python -m bench.load_test --scenario ollama --users 50 --token-rate 30 --tracemalloc
+    python -m bench.load_test --scenario image --users 16 --comfy-workers 2
+    python -m bench.load_test --scenario ollama --users 12 --ollama-models 3 --model-load 2
+    python -m bench.load_test --scenario ollama --outage ollama --outage-status 503 --failover
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.fake_discord import DiscordStats, ExtensionBot, FakeChannel, FakeGuild, FakeInteraction, FakeMessage, FakeUser
+from bench.stubs import StubComfyUI, StubGemini, StubOllama
+from utils.http import close_http_clients
+from utils.scheduler import percentile
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux는 KB, macOS는 바이트 단위입니다.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class Results:
+    def __init__(self, name: str):
+        self.name = name
+        self.first_response = []  # 요청 -> 첫 메시지(플레이스홀더/대기 안내 포함)
+        self.completed = []       # 요청 -> 핸들러 종료
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def row(self) -> str:
+        count = len(self.completed)
+        return (f"{self.name:<8}{count:>7}{count / self.elapsed if self.elapsed else 0:>9.2f}"
+                f"{percentile(self.first_response, 0.50):>10.2f}{percentile(self.first_response, 0.99):>10.2f}"
+                f"{percentile(self.completed, 0.50):>10.2f}{percentile(self.completed, 0.99):>10.2f}{self.errors:>8}")
+
+
+async def _user_session(run_one, user_index: int, messages: int, think_time: float, results: Results):
+    for turn in range(messages):
+        started = time.perf_counter()
+        try:
+            channel = await run_one(user_index, turn)
+        except Exception:
+            results.errors += 1
+            continue
+        results.completed.append(time.perf_counter() - started)
+        if channel.first_response_at is not None:
+            results.first_response.append(channel.first_response_at - started)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def drive_chat(bot, backend: str, users: int, messages: int, think_time: float, stats: DiscordStats,
+                     setup_user=None) -> Results:
+    """
+    사용자마다 채널 하나를 두고, 백엔드를 고른 뒤 멘션 메시지를 messages번 보냅니다.
+    setup_user(user_id, index)로 사용자별 상태(예: 모델)를 먼저 정할 수 있습니다.
+    """
+    from utils.router import get_router
+
+    router = get_router(bot)
+    guild = FakeGuild(1)
+    people = [FakeUser(1_000 + (0 if backend == "ollama" else 100_000) + i) for i in range(users)]
+    channels = [FakeChannel(2_000 + i, guild, stats, bot.user) for i in range(users)]
+    for index, person in enumerate(people):
+        await router.set_backend(person.id, backend)
+        if setup_user is not None:
+            await setup_user(person.id, index)
+
+    async def run_one(index, turn):
+        channel = channels[index]
+        channel.mark()
+        content = f"{bot.user.mention} 질문 {turn}: 오늘 날씨에 어울리는 노래를 추천해줘."
+        await bot.deliver("on_message", FakeMessage(channel, people[index], content, mentions=[bot.user]))
+        return channel
+
+    results = Results(backend)
+    started = time.perf_counter()
+    await asyncio.gather(*(_user_session(run_one, i, messages, think_time, results) for i in range(users)))
+    results.elapsed = time.perf_counter() - started
+    return results
+
+
+async def drive_images(cog, users: int, messages: int, think_time: float, stats: DiscordStats) -> Results:
+    """사용자마다 /generate_image를 messages번 호출합니다."""
+    guild = FakeGuild(1)
+    people = [FakeUser(3_000 + i) for i in range(users)]
+    channels = [FakeChannel(4_000 + i, guild, stats, None) for i in range(users)]
+
+    async def run_one(index, turn):
+        channel = channels[index]
+        channel.mark()
+        interaction = FakeInteraction(people[index], channel)
+        # 일부 프롬프트가 겹치도록 해서 배칭 효과도 함께 드러나게 합니다.
+        await cog.generate_image.callback(cog, interaction, f"1girl, scenery {(index + turn) % 4}", "")
+        if not interaction.files:
+            raise RuntimeError("이미지를 받지 못했습니다.")
+        return channel
+
+    results = Results("image")
+    started = time.perf_counter()
+    await asyncio.gather(*(_user_session(run_one, i, messages, think_time, results) for i in range(users)))
+    results.elapsed = time.perf_counter() - started
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("ollama", "gemini", "image", "all"), default="all")
+    parser.add_argument("--users", type=int, default=20, help="동시 가상 사용자 수")
+    parser.add_argument("--messages", type=int, default=5, help="사용자당 요청 수")
+    parser.add_argument("--think-time", type=float, default=0.0, help="응답을 받은 뒤 다음 요청까지 쉬는 시간 (초)")
+    parser.add_argument("--latency", type=float, default=0.2, help="LLM 스텁의 첫 토큰까지 걸리는 시간 (초)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="LLM 스텁의 초당 토큰 수 (요청마다)")
+    parser.add_argument("--tokens", type=int, default=64, help="응답 하나의 토큰 수")
+    parser.add_argument("--ollama-models", type=int, default=1, help="Ollama 스텁 모델 수 (사용자마다 돌아가며 고름)")
+    parser.add_argument("--model-load", type=float, default=0.0, help="Ollama 스텁 모델을 불러오는 시간 (초, GPU에 한 개만 올라감)")
+    parser.add_argument("--step-scale", type=float, default=0.2, help="ComfyUI 스텁 KSampler 스텝 수 배율")
+    parser.add_argument("--comfy-workers", type=int, default=1, help="ComfyUI 스텁 서버 수")
+    parser.add_argument("--outage", choices=("ollama", "gemini", "both"),
+                        help="이 LLM 스텁(또는 둘 다)을 장애 상태로 두고 실행합니다")
+    parser.add_argument("--outage-status", type=int, default=0,
+                        help="장애 스텁이 돌려줄 HTTP 상태 코드 (0이면 서버를 내려 연결을 거부)")
+    parser.add_argument("--failover", action="store_true", help="CHAT_FAILOVER=1 (실패한 턴을 다른 백엔드로)")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="가짜 Discord API 호출 지연 (초)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Python 힙 최대 사용량도 잽니다 (느려짐)")
+    args = parser.parse_args()
+
+    scenarios = ("ollama", "gemini", "image") if args.scenario == "all" else (args.scenario,)
+    models = [f"model-{i}:7b" for i in range(args.ollama_models)] if args.ollama_models > 1 else ["gemma3:12b-it-qat"]
+    ollama = StubOllama(latency=args.latency, tokens_per_second=args.token_rate, tokens=args.tokens,
+                        models=models, load_seconds=args.model_load)
+    gemini = StubGemini(latency=args.latency, tokens_per_second=args.token_rate, tokens=args.tokens)
+    comfys = [StubComfyUI(step_scale=args.step_scale) for _ in range(max(1, args.comfy_workers))]
+    state_dir = tempfile.TemporaryDirectory()
+    os.environ.update({
+        "OLLAMA_URL": f"http://{await ollama.start()}",
+        "GEMINI_API_BASE": f"http://{await gemini.start()}/v1beta",
+        "GEMINI_KEY": os.getenv("GEMINI_KEY", "stub"),
+        "COMFYUI_SERVER_ADDRESS": ",".join([await comfy.start() for comfy in comfys]),
+        "STATE_DB_PATH": os.path.join(state_dir.name, "state.sqlite3"),
+        "COMFYUI_CACHE_DIR": os.path.join(state_dir.name, "image_cache"),
+        # 가짜 Discord에는 rate limit이 없으므로 편집 간격을 줄여 스트리밍 경로도 자주 돌게 합니다.
+        "OLLAMA_STREAM_EDIT_INTERVAL": os.getenv("OLLAMA_STREAM_EDIT_INTERVAL", "0.25"),
+        "GEMINI_STREAM_EDIT_INTERVAL": os.getenv("GEMINI_STREAM_EDIT_INTERVAL", "0.25"),
+        "COMFYUI_PROGRESS_INTERVAL": os.getenv("COMFYUI_PROGRESS_INTERVAL", "0.5"),
+        "CHAT_FAILOVER": "1" if args.failover else os.getenv("CHAT_FAILOVER", "0"),
+    })
+
+    stats = DiscordStats(args.discord_latency)
+    bot = ExtensionBot()
+    extensions = {"ollama": "ChatOllama", "gemini": "ChatGemini", "image": "ImageGen"}
+    for extension in extensions.values():
+        await bot.load_extension("Cogs." + extension)
+    cogs = {"ollama": bot.get_cog("ChatCog"), "gemini": bot.get_cog("ChatGemini"), "image": bot.get_cog("ImageGenCog")}
+    for broken in {"ollama": (ollama,), "gemini": (gemini,), "both": (ollama, gemini)}.get(args.outage, ()):
+        if args.outage_status:
+            broken.fail_status = args.outage_status
+        else:
+            await broken.stop()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = _max_rss_mb()
+    all_results = []
+    try:
+        for name in scenarios:
+            if name == "image":
+                all_results.append(await drive_images(cogs["image"], args.users, args.messages, args.think_time, stats))
+            elif name == "ollama":
+                async def select_model(user_id, index):
+                    state = await cogs["ollama"].get_user_state(user_id)
+                    state["selected_model"] = models[index % len(models)]
+
+                all_results.append(await drive_chat(bot, name, args.users, args.messages, args.think_time, stats,
+                                                    setup_user=select_model))
+            else:
+                all_results.append(await drive_chat(bot, name, args.users, args.messages, args.think_time, stats))
+    finally:
+        heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+        for extension in extensions.values():
+            await bot.unload_extension("Cogs." + extension)
+        residency = cogs["ollama"].residency.stats()
+        resilience = bot.resilience.stats()
+        pools = bot.http_clients.stats()
+        workers = cogs["image"].comfy.stats()
+        await close_http_clients(bot)
+        for stub in (ollama, gemini, *comfys):
+            await stub.stop()
+        state_dir.cleanup()
+
+    print(f"users {args.users} x messages {args.messages}, LLM latency {args.latency}s @ {args.token_rate} tok/s, "
+          f"Discord latency {args.discord_latency}s")
+    print(f"{'scenario':<8}{'done':>7}{'req/s':>9}{'first p50':>10}{'first p99':>10}"
+          f"{'done p50':>10}{'done p99':>10}{'errors':>8}")
+    for results in all_results:
+        print(results.row())
+    for name, scheduler in getattr(bot, "schedulers", {}).items():
+        info = scheduler.stats()
+        if not info["completed"] and not info["rejected"]:
+            continue
+        print(f"scheduler {name}: completed {info['completed']}, rejected {info['rejected']}, "
+              f"reordered {info['reordered']}, wait p50 {info['wait_p50']:.2f}s / p99 {info['wait_p99']:.2f}s")
+    if "ollama" in scenarios and args.model_load:
+        print(f"ollama models: {ollama.loads} loads in stub, bot saw {residency['loads']} loads / "
+              f"{residency['swaps']} swaps")
+    if args.outage:
+        print(f"resilience: {resilience['failovers']} failovers; " + ", ".join(
+            f"{name} breaker {info['state']} (opened {info['opened']}, rejected {info['rejected']}, "
+            f"retries {info['retries']})" for name, info in resilience.items() if name != "failovers"))
+    print(f"stub peak concurrency: ollama {ollama.max_active}, gemini {gemini.max_active}; "
+          f"comfyui prompts {sum(c.prompts_run for c in comfys)} for {sum(c.images_made for c in comfys)} images")
+    if len(workers) > 1:
+        print("comfyui workers: " + ", ".join(f"{address} {info['images']} images / {info['completed']} jobs"
+                                              for address, info in workers.items()))
+    print("http pools: " + ", ".join(f"{name} {info['in_use'] + info['idle']}/{info['limit']} open"
+                                     for name, info in pools.items()))
+    print(f"discord calls: {stats.sends} sends, {stats.edits} edits, {stats.deletes} deletes")
+    memory = f"memory: max RSS {_max_rss_mb():.1f} MB (+{_max_rss_mb() - rss_before:.1f} MB during run)"
+    if heap_peak is not None:
+        memory += f", Python heap peak {heap_peak / (1024 * 1024):.1f} MB"
+    print(memory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""
+로깅 오버헤드 벤치마크.
+
+응답 본문을 찍는 기존 print와 utils.log의 큐 기반 로거를 같은 느린 출력(터미널이나 파이프가 밀린 상황)에
+연결해, 이벤트 루프에서 로그 호출 한 번에 걸리는 시간과 루프 지연(다른 작업이 밀린 정도)을 비교합니다.
+꺼진 레벨(debug)을 호출할 때의 비용도 함께 잽니다.
+
+    python -m bench.logging_overhead --events 2000 --sink-delay 0.2
+"""
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import time
+
+from utils.log import get_logger, setup_logging, stop_logging
+
+
+class SlowSink(io.TextIOBase):
+    """write()마다 delay 초씩 막히는 출력."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+async def _lag_probe(stop: asyncio.Event, lags: list, interval: float = 0.001):
+    """interval마다 깨어나 예정보다 얼마나 늦었는지 기록합니다."""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run(emit, events: int, payload: str):
+    """emit(i, payload)를 events번 호출하며 호출 시간과 루프 지연을 잽니다."""
+    stop, lags, costs = asyncio.Event(), [], []
+    probe = asyncio.create_task(_lag_probe(stop, lags))
+    started = time.perf_counter()
+    for i in range(events):
+        t = time.perf_counter()
+        emit(i, payload)
+        costs.append(time.perf_counter() - t)
+        # 실제 핸들러처럼 중간중간 다른 작업에 양보합니다.
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return {
+        "per_call_us": statistics.mean(costs) * 1e6,
+        "p99_call_us": sorted(costs)[int(len(costs) * 0.99) - 1] * 1e6,
+        "max_lag_ms": max(lags, default=0.0) * 1e3,
+        "loop_seconds": elapsed,
+    }
+
+
+def report(name, result, extra=""):
+    print(f"{name:<14} {result['per_call_us']:>10.1f} us/call  p99 {result['p99_call_us']:>9.1f} us  "
+          f"max loop lag {result['max_lag_ms']:>8.1f} ms  loop {result['loop_seconds']:.2f}s{extra}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--sink-delay", type=float, default=0.2, help="출력 write() 한 번에 막히는 시간 (ms)")
+    parser.add_argument("--payload", type=int, default=2000, help="로그에 싣는 응답 길이 (문자)")
+    args = parser.parse_args()
+    payload = "가" * args.payload
+    delay = args.sink_delay / 1000
+
+    sink = SlowSink(delay)
+    report("print", await run(lambda i, text: print(f"Bot:{text}", file=sink), args.events, payload))
+
+    sink = SlowSink(delay)
+    handler = setup_logging(stream=sink)
+    log = get_logger("bench")
+    result = await run(lambda i, text: log.info("chat.reply", user=i, response=text), args.events, payload)
+    drain = time.perf_counter()
+    stop_logging(handler)
+    report("queued logger", result, f"  (drain {time.perf_counter() - drain:.2f}s off-loop, "
+                                    f"{sink.lines} lines, {handler.dropped} dropped)")
+
+    # 꺼진 레벨은 레코드를 만들지 않으므로 출력과 무관하게 거의 비용이 없어야 합니다.
+    logging.getLogger("llamabot").setLevel(logging.INFO)
+    report("disabled debug", await run(lambda i, text: log.debug("chat.chunk", user=i, text=text), args.events, payload))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,434 @@
+import asyncio
+import json
+import struct
+import time
+import uuid
+import zlib
+
+from aiohttp import web
+
+
+def tiny_png(width: int = 8, height: int = 8) -> bytes:
+    """Pillow 없이 만든 단색 PNG."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    raw = b"".join(b"\x00" + b"\x80\x80\x80" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+class StubServer:
+    """
+    aiohttp 앱을 127.0.0.1의 임의 포트에 띄우는 공통 부분.
+    fail_status를 정하면 모든 POST 요청에 그 상태 코드로 답해 장애(429, 503 등)를 흉내 냅니다.
+    """
+
+    def __init__(self):
+        self.app = web.Application(middlewares=[self._faults])
+        self._runner = None
+        self.address = None
+        self.fail_status = None
+        self.failed = 0
+
+    @web.middleware
+    async def _faults(self, request, handler):
+        if self.fail_status is not None and request.method == "POST":
+            self.failed += 1
+            return web.json_response({"error": {"code": self.fail_status, "message": "stub outage"}},
+                                     status=self.fail_status)
+        return await handler(request)
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.address = f"127.0.0.1:{port}"
+        return self.address
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class StubComfyUI(StubServer):
+    """
+    ComfyUI의 /prompt, /ws, /view, /queue, /history, /interrupt, /system_stats를 흉내 내는 서버.
+
+    GPU 비용 모델: 프롬프트마다 prompt_overhead초, KSampler 한 번마다
+    steps * (step_base + step_per_image * batch_size)초. 배치가 커질수록 이미지당 비용이 줄어듭니다.
+    """
+
+    def __init__(self, prompt_overhead: float = 0.2, step_base: float = 0.01, step_per_image: float = 0.004,
+                 step_scale: float = 1.0, image_bytes: bytes = None):
+        super().__init__()
+        self.prompt_overhead = prompt_overhead
+        self.step_base = step_base
+        self.step_per_image = step_per_image
+        self.step_scale = step_scale
+        self.image_bytes = image_bytes or tiny_png()
+        self.sockets = {}      # client_id -> WebSocketResponse
+        self.pending = []      # [number, prompt_id, workflow, client_id]
+        self.running = None
+        self.history = {}
+        self.number = 0
+        self.prompts_run = 0
+        self.images_made = 0
+        self._wakeup = asyncio.Event()
+        self._interrupt = False
+        self._worker = None
+        self.app.add_routes([
+            web.post("/prompt", self.post_prompt),
+            web.get("/ws", self.websocket),
+            web.get("/view", self.view),
+            web.get("/queue", self.get_queue),
+            web.post("/queue", self.post_queue),
+            web.get("/history/{prompt_id}", self.get_history),
+            web.post("/interrupt", self.interrupt),
+            web.get("/system_stats", self.system_stats),
+        ])
+
+    async def start(self) -> str:
+        address = await super().start()
+        self._worker = asyncio.create_task(self._work())
+        return address
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        await super().stop()
+
+    async def _send(self, client_id, event_type, data):
+        ws = self.sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps({"type": event_type, "data": data}))
+
+    async def _work(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            self.running = self.pending.pop(0)
+            number, prompt_id, workflow, client_id = self.running
+            self._interrupt = False
+            await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+            await asyncio.sleep(self.prompt_overhead)
+            outputs = {}
+            interrupted = False
+            for node_id, node in workflow.items():
+                if node["class_type"] != "KSampler":
+                    continue
+                inputs = node["inputs"]
+                batch = workflow[inputs["latent_image"][0]]["inputs"].get("batch_size", 1)
+                steps = max(1, int(inputs["steps"] * self.step_scale))
+                await self._send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+                for step in range(1, steps + 1):
+                    if self._interrupt:
+                        interrupted = True
+                        break
+                    await asyncio.sleep(self.step_base + self.step_per_image * batch)
+                    await self._send(client_id, "progress", {"value": step, "max": steps, "prompt_id": prompt_id, "node": node_id})
+                if interrupted:
+                    break
+            if interrupted:
+                await self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id})
+            else:
+                for node_id, node in workflow.items():
+                    if node["class_type"] != "SaveImage":
+                        continue
+                    decode = workflow[node["inputs"]["images"][0]]
+                    sampler = workflow[decode["inputs"]["samples"][0]]
+                    batch = workflow[sampler["inputs"]["latent_image"][0]]["inputs"].get("batch_size", 1)
+                    images = [{"filename": f"{prompt_id}_{node_id}_{i}.png", "subfolder": "", "type": "output"}
+                              for i in range(batch)]
+                    outputs[node_id] = {"images": images}
+                    self.images_made += batch
+                    await self._send(client_id, "executed", {"node": node_id, "output": outputs[node_id], "prompt_id": prompt_id})
+                self.history[prompt_id] = {"outputs": outputs, "status": {"status_str": "success", "completed": True}}
+                await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+            await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+            self.prompts_run += 1
+            self.running = None
+
+    async def post_prompt(self, request):
+        body = await request.json()
+        prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+        self.number += 1
+        self.pending.append([self.number, prompt_id, body["prompt"], body.get("client_id")])
+        self._wakeup.set()
+        return web.json_response({"prompt_id": prompt_id, "number": self.number, "node_errors": {}})
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId", "")
+        self.sockets[client_id] = ws
+        await ws.send_str(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(self.pending)}}}}))
+        async for _ in ws:
+            pass
+        self.sockets.pop(client_id, None)
+        return ws
+
+    async def view(self, request):
+        return web.Response(body=self.image_bytes, content_type="image/png")
+
+    def _queue_entries(self, items):
+        return [[number, prompt_id, {}, {}, []] for number, prompt_id, _, _ in items]
+
+    async def get_queue(self, request):
+        running = [self.running] if self.running else []
+        return web.json_response({
+            "queue_running": self._queue_entries(running),
+            "queue_pending": self._queue_entries(self.pending),
+        })
+
+    async def post_queue(self, request):
+        body = await request.json()
+        delete = set(body.get("delete", []))
+        self.pending = [item for item in self.pending if item[1] not in delete]
+        return web.Response()
+
+    async def get_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry else {})
+
+    async def interrupt(self, request):
+        self._interrupt = True
+        return web.Response()
+
+    async def system_stats(self, request):
+        return web.json_response({"system": {"os": "stub"}, "devices": [{"name": "stub", "vram_total": 0, "vram_free": 0}]})
+
+
+class _TokenStream:
+    """첫 토큰까지 latency초, 이후 tokens_per_second 속도로 tokens개를 만드는 LLM 비용 모델."""
+
+    def __init__(self, latency: float, tokens_per_second: float, tokens: int):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, chunk_tokens: int = 1):
+        """(조각 텍스트, 조각 토큰 수)를 생성 속도에 맞춰 돌려줍니다."""
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            for start in range(0, self.tokens, chunk_tokens):
+                count = min(chunk_tokens, self.tokens - start)
+                await asyncio.sleep(count / self.tokens_per_second)
+                yield "tok " * count, count
+        finally:
+            self.active -= 1
+
+
+class StubOllama(StubServer, _TokenStream):
+    """
+    Ollama의 /api/tags, /api/show, /api/chat(NDJSON 스트림 또는 stream=false), /api/ps,
+    /api/generate(모델 불러오기만)를 흉내 내는 서버.
+
+    GPU 모델 적재: 동시에 max_loaded개 모델만 올라가 있을 수 있고, 올라가 있지 않은 모델은 load_seconds 동안
+    불러옵니다. 자리가 없으면 실행 중인 요청이 없는 모델 중 가장 오래 쓰지 않은 것을 내리며, 모두 사용 중이면
+    끝날 때까지 기다립니다. keep_alive(초, "5m" 같은 기간, -1)가 지나면 모델을 내립니다.
+    """
+
+    def __init__(self, latency: float = 0.2, tokens_per_second: float = 50.0, tokens: int = 64,
+                 models=("gemma3:12b-it-qat",), capabilities=("completion", "vision"),
+                 load_seconds: float = 0.0, max_loaded: int = 1):
+        StubServer.__init__(self)
+        _TokenStream.__init__(self, latency, tokens_per_second, tokens)
+        self.models = list(models)
+        self.capabilities = list(capabilities)
+        self.load_seconds = load_seconds
+        self.max_loaded = max_loaded
+        self.loaded = {}        # 모델 -> 만료 시각 (None이면 계속 유지), 오래 쓰지 않은 순
+        self.running = {}       # 모델 -> 실행 중인 요청 수
+        self.loads = 0
+        self._gpu = asyncio.Condition()
+        self.app.add_routes([
+            web.get("/api/tags", self.tags),
+            web.post("/api/show", self.show),
+            web.post("/api/chat", self.chat),
+            web.get("/api/ps", self.ps),
+            web.post("/api/generate", self.generate_endpoint),
+        ])
+
+    @staticmethod
+    def _keep_alive_seconds(value):
+        if value is None:
+            return 300.0
+        if isinstance(value, (int, float)):
+            return None if value < 0 else float(value)
+        units = {"s": 1, "m": 60, "h": 3600}
+        return float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+
+    def _expire(self):
+        now = time.monotonic()
+        for model, expires in list(self.loaded.items()):
+            if expires is not None and expires <= now and not self.running.get(model):
+                del self.loaded[model]
+
+    async def _acquire_model(self, model, keep_alive) -> float:
+        """모델을 올리고 실행 중 요청 수를 늘립니다. 불러오는 데 걸린 시간(초)을 반환합니다."""
+        async with self._gpu:
+            load = 0.0
+            while True:
+                self._expire()
+                if model in self.loaded:
+                    break
+                idle = [name for name in self.loaded if not self.running.get(name)]
+                if len(self.loaded) < self.max_loaded or idle:
+                    if len(self.loaded) >= self.max_loaded:
+                        del self.loaded[idle[0]]
+                    # GPU가 모델을 불러오는 동안에는 다른 모델도 불러올 수 없습니다.
+                    await asyncio.sleep(self.load_seconds)
+                    self.loads += 1
+                    load = self.load_seconds
+                    break
+                await self._gpu.wait()
+            keep = self._keep_alive_seconds(keep_alive)
+            self.loaded.pop(model, None)
+            self.loaded[model] = None if keep is None else time.monotonic() + keep
+            self.running[model] = self.running.get(model, 0) + 1
+            return load
+
+    async def _release_model(self, model):
+        async with self._gpu:
+            self.running[model] -= 1
+            self._gpu.notify_all()
+
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": name, "digest": f"sha256:{i:064x}"}
+                                             for i, name in enumerate(self.models)]})
+
+    async def show(self, request):
+        return web.json_response({"capabilities": self.capabilities})
+
+    async def ps(self, request):
+        self._expire()
+        return web.json_response({"models": [{"name": name, "model": name} for name in self.loaded]})
+
+    async def generate_endpoint(self, request):
+        body = await request.json()
+        model = body.get("model", "")
+        load = await self._acquire_model(model, body.get("keep_alive"))
+        await self._release_model(model)
+        return web.json_response({"model": model, "response": "", "done": True, "done_reason": "load",
+                                  "load_duration": int(load * 1e9)})
+
+    async def chat(self, request):
+        body = await request.json()
+        model = body.get("model", "")
+        load = await self._acquire_model(model, body.get("keep_alive"))
+        try:
+            return await self._chat(request, body, model, load)
+        finally:
+            await self._release_model(model)
+
+    async def _chat(self, request, body, model, load):
+        started = time.perf_counter()
+        if not body.get("stream", True):
+            text = "".join([chunk async for chunk, _ in self.generate(self.tokens)])
+            return web.json_response({"model": model, "message": {"role": "assistant", "content": text}, "done": True,
+                                      "load_duration": int(load * 1e9)})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        first = None
+        async for chunk, _ in self.generate():
+            first = first or time.perf_counter()
+            line = {"model": model, "message": {"role": "assistant", "content": chunk}, "done": False}
+            await response.write(json.dumps(line).encode("utf-8") + b"\n")
+        done = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                "eval_count": self.tokens, "eval_duration": int((time.perf_counter() - (first or started)) * 1e9),
+                "load_duration": int(load * 1e9)}
+        await response.write(json.dumps(done).encode("utf-8") + b"\n")
+        await response.write_eof()
+        return response
+
+
+class StubGemini(StubServer, _TokenStream):
+    """
+    Gemini의 models/{model}:generateContent, :streamGenerateContent(alt=sse),
+    cachedContents 생성/연장/삭제를 흉내 내는 서버. 주소 뒤에 /v1beta를 붙여 GEMINI_API_BASE로 씁니다.
+    """
+
+    def __init__(self, latency: float = 0.3, tokens_per_second: float = 150.0, tokens: int = 64,
+                 chunk_tokens: int = 8):
+        StubServer.__init__(self)
+        _TokenStream.__init__(self, latency, tokens_per_second, tokens)
+        self.chunk_tokens = chunk_tokens
+        self.caches = {}  # 이름 -> 토큰 수
+        self.app.add_routes([
+            web.get("/v1beta/models/{model}", self.get_model),
+            web.post("/v1beta/models/{action}", self.model_action),
+            web.post("/v1beta/cachedContents", self.create_cache),
+            web.patch("/v1beta/cachedContents/{cache_id}", self.update_cache),
+            web.delete("/v1beta/cachedContents/{cache_id}", self.delete_cache),
+        ])
+
+    @staticmethod
+    def _prompt_tokens(body) -> int:
+        return len(json.dumps(body)) // 4
+
+    def _usage(self, body, candidates: int) -> dict:
+        cached = self.caches.get(body.get("cachedContent"), 0)
+        return {"promptTokenCount": self._prompt_tokens(body) + cached, "cachedContentTokenCount": cached,
+                "candidatesTokenCount": candidates}
+
+    async def get_model(self, request):
+        return web.json_response({"name": f"models/{request.match_info['model']}"})
+
+    async def model_action(self, request):
+        body = await request.json()
+        if body.get("cachedContent") and body["cachedContent"] not in self.caches:
+            return web.json_response({"error": {"code": 404, "message": "cache not found"}}, status=404)
+        action = request.match_info["action"].rsplit(":", 1)[-1]
+        if action == "generateContent":
+            text = "".join([chunk async for chunk, _ in self.generate(self.tokens)])
+            return web.json_response({
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                "usageMetadata": self._usage(body, self.tokens),
+            })
+        if action != "streamGenerateContent":
+            return web.json_response({"error": {"code": 404, "message": "unknown action"}}, status=404)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        produced = 0
+        async for chunk, count in self.generate(self.chunk_tokens):
+            produced += count
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": chunk}]}}]}
+            if produced >= self.tokens:
+                event["candidates"][0]["finishReason"] = "STOP"
+                event["usageMetadata"] = self._usage(body, produced)
+            await response.write(b"data: " + json.dumps(event).encode("utf-8") + b"\r\n\r\n")
+        await response.write_eof()
+        return response
+
+    async def create_cache(self, request):
+        body = await request.json()
+        name = f"cachedContents/{uuid.uuid4().hex}"
+        self.caches[name] = self._prompt_tokens(body)
+        return web.json_response({"name": name, "usageMetadata": {"totalTokenCount": self.caches[name]}})
+
+    async def update_cache(self, request):
+        name = f"cachedContents/{request.match_info['cache_id']}"
+        if name not in self.caches:
+            return web.json_response({"error": {"code": 404, "message": "cache not found"}}, status=404)
+        return web.json_response({"name": name})
+
+    async def delete_cache(self, request):
+        self.caches.pop(f"cachedContents/{request.match_info['cache_id']}", None)
+        return web.json_response({})
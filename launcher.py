@@ -0,0 +1,123 @@
+"""
+봇을 여러 워커 프로세스로 실행합니다.
+
+샤드 범위를 워커마다 나눠 main.py를 띄우고, 종료된 워커는 다시 시작합니다.
+워커끼리는 로컬 제어 채널(ControlHub)로 /load, /unload 요청을 주고받고,
+사용자 상태는 같은 SQLite 파일(STATE_SHARED=1)을 통해 공유합니다.
+
+    python launcher.py --workers 4            # Discord 권장 샤드 수를 4개 프로세스에 나눔
+    python launcher.py --workers 2 --shards 8
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from utils.cluster import ControlHub
+from utils.log import get_logger, setup_logging
+
+log = get_logger("launcher")
+
+# 워커가 이보다 오래 살아 있다가 종료되면 재시작 지연을 처음 값으로 되돌립니다.
+HEALTHY_UPTIME = 300.0
+
+
+async def recommended_shards(token: str) -> int:
+    """Discord가 권장하는 샤드 수 (GET /gateway/bot)."""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers=headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["shards"]
+
+
+def shard_ranges(shard_count: int, workers: int) -> list:
+    """샤드 0..shard_count-1을 워커 수만큼 연속된 구간으로 나눕니다."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def supervise(worker: int, workers: int, shard_ids: list, shard_count: int, control_url: str,
+                    stopping: asyncio.Event):
+    """워커 프로세스 하나를 실행하고, 비정상 종료하면 점점 늦춰가며 다시 띄웁니다."""
+    env = dict(
+        os.environ,
+        WORKER_ID=str(worker),
+        CLUSTER_WORKERS=str(workers),
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=",".join(map(str, shard_ids)),
+        CLUSTER_CONTROL_URL=control_url,
+        STATE_SHARED="1",
+    )
+    delay = 1.0
+    while not stopping.is_set():
+        log.info("worker.start", worker=worker, shards=f"{shard_ids[0]}-{shard_ids[-1]}", shard_count=shard_count)
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(sys.executable, "main.py", env=env)
+        waiter = asyncio.create_task(process.wait())
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait({waiter, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(waiter, 30)
+                except asyncio.TimeoutError:
+                    process.kill()
+            return
+        stop.cancel()
+        if time.monotonic() - started >= HEALTHY_UPTIME:
+            delay = 1.0
+        log.warning("worker.exited", worker=worker, code=process.returncode, restart_in=delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60.0)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, default=0, help="전체 샤드 수 (0이면 Discord 권장값)")
+    parser.add_argument("--control-port", type=int, default=int(os.getenv("CLUSTER_CONTROL_PORT", "8765")))
+    args = parser.parse_args()
+    setup_logging()
+
+    shard_count = args.shards or await recommended_shards(os.environ["discord_token"])
+    ranges = shard_ranges(shard_count, args.workers)
+
+    hub = ControlHub()
+    runner = web.AppRunner(hub.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.control_port).start()
+    control_url = f"ws://127.0.0.1:{args.control_port}/ws"
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    log.info("cluster.start", shard_count=shard_count, workers=len(ranges))
+    try:
+        await asyncio.gather(*(
+            supervise(worker, len(ranges), shard_ids, shard_count, control_url, stopping)
+            for worker, shard_ids in enumerate(ranges)
+        ))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,26 +1,130 @@
 import discord
 import asyncio
-import os, json
+import os, json, time
 from discord import app_commands
 from discord.ext import commands, tasks
+from utils.cluster import ClusterClient, ClusterError, is_primary_worker, shard_options, worker_id
+from utils.command_sync import sync_command_tree
+from utils.extensions import autoload_extensions
+from utils.http import close_http_clients, get_http_clients
+from utils.intents import client_options, missing_intents
+from utils.log import get_logger, setup_logging
+from utils.metrics import start_metrics_server
+from utils.router import get_router
 
-intents = discord.Intents.all()
-intents.message_content = True #requires privileged intents settings from developer portal
+# print 대신 큐 기반 JSON 로거를 씁니다. 출력은 별도 스레드가 맡으므로 이벤트 루프가 막히지 않습니다.
+setup_logging()
+log = get_logger("bot")
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-token = os.environ["discord_token"]
+# 시작할 때 함께 불러올 확장 (AUTOLOAD_COGS)
+AUTOLOAD = autoload_extensions()
+
+
+class LLaMABot(commands.AutoShardedBot):
+    """
+    시작 작업을 setup_hook에서 한 번만 처리하는 봇.
+    확장은 동시에 불러오고, 커맨드 트리는 바뀌었을 때만 동기화합니다.
+    on_ready는 게이트웨이 재연결 때마다 다시 호출되므로 여기서는 무거운 작업을 하지 않습니다.
+
+    launcher.py로 실행하면 맡은 샤드 범위(SHARD_COUNT, SHARD_IDS)만 연결하고,
+    제어 채널(CLUSTER_CONTROL_URL)로 다른 워커와 확장 로드/언로드를 맞춥니다.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.started_at = time.perf_counter()
+        self.ready_logged = False
+        self.cluster = None
+        self.metrics_runner = None
+
+    async def load_extensions(self, names):
+        """확장을 동시에 불러오고, 실패한 확장은 기록만 하고 건너뜁니다."""
+        async def load_one(name):
+            started = time.perf_counter()
+            try:
+                await self.load_extension("Cogs." + name)
+            except Exception as e:
+                log.error("extension.load_failed", extension=name, error=f"{type(e).__name__}: {e}")
+            else:
+                log.info("extension.loaded", extension=name, seconds=round(time.perf_counter() - started, 3))
+
+        await asyncio.gather(*(load_one(name) for name in names))
 
-@bot.event
-async def on_ready():
-    print("Logged in ")
-    print("===============\n")
+    async def apply_extension_action(self, action: str, name: str):
+        """이 프로세스에서 확장을 load/unload/reload합니다. 실패하면 예외를 그대로 올립니다."""
+        if action == "load":
+            await self.load_extension("Cogs." + name)
+        elif action == "unload":
+            await self.unload_extension("Cogs." + name)
+        elif action == "reload":
+            await self.reload_extension("Cogs." + name)
+        else:
+            raise ValueError(f"알 수 없는 작업: {action}")
 
-    await bot.tree.sync()
+    async def broadcast_extension_action(self, action: str, name: str) -> dict:
+        """다른 워커에도 같은 작업을 요청합니다. 단일 프로세스 실행이면 빈 dict를 반환합니다."""
+        if self.cluster is None:
+            return {}
+        try:
+            return await self.cluster.broadcast(action, name)
+        except (ClusterError, asyncio.TimeoutError) as e:
+            return {"?": str(e) or type(e).__name__}
+
+    async def setup_hook(self):
+        # Cog들이 빌려 쓸 HTTP 세션 관리자를 이벤트 루프 안에서 먼저 만듭니다.
+        get_http_clients(self)
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics_port:
+            # 워커가 여럿이면 워커마다 포트를 하나씩 띄워 씁니다.
+            host, port = os.getenv("METRICS_HOST", "127.0.0.1"), metrics_port + worker_id()
+            self.metrics_runner = await start_metrics_server(port, host)
+            log.info("metrics.listening", url=f"http://{host}:{port}/metrics")
+        control_url = os.getenv("CLUSTER_CONTROL_URL")
+        if control_url:
+            self.cluster = ClusterClient(control_url, worker_id(), self.apply_extension_action)
+            await self.cluster.start()
+        await self.load_extensions(AUTOLOAD)
+        loaded = time.perf_counter()
+        # 워커가 여럿이면 같은 커맨드 트리를 한 워커만 동기화합니다.
+        synced = is_primary_worker() and await sync_command_tree(self.tree)
+        log.info("startup.setup_done", extensions_seconds=round(loaded - self.started_at, 3),
+                 command_sync=bool(synced), sync_seconds=round(time.perf_counter() - loaded, 3))
+
+    async def close(self):
+        if self.cluster is not None:
+            await self.cluster.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+        # 확장이 모두 내려간 뒤(컨텍스트 캐시 삭제 등 마지막 요청 이후)에 세션을 닫습니다.
+        await close_http_clients(self)
+
+    async def on_ready(self):
+        if self.ready_logged:
+            log.info("gateway.reconnected")
+            return
+        self.ready_logged = True
+        log.info("startup.ready", seconds=round(time.perf_counter() - self.started_at, 3),
+                 shards=sorted(self.shards), shard_count=self.shard_count,
+                 guilds=len(self.guilds))
+
+
+# 상태 표시는 IDENTIFY에 실어 보내므로 재연결해도 다시 설정할 필요가 없습니다.
+# 인텐트와 멤버/메시지 캐시는 불러올 확장이 선언한 만큼만 켭니다 (message_content는 개발자 포털에서 권한 필요).
+bot = LLaMABot(command_prefix="!", status=discord.Status.idle, activity=discord.Game("Loading..."),
+               **client_options(AUTOLOAD), **shard_options())
+token = os.environ["discord_token"]
+# 봇 멘션을 한 번만 받아서 사용자가 고른 채팅 백엔드(Cog) 하나에만 넘깁니다.
+router = get_router(bot)
 
-    for i in bot.guilds:
-        print(i)
-    await bot.change_presence(status=discord.Status.idle,
-                              activity=discord.Game("Loading..."))
+def describe_workers(results: dict) -> str:
+    """다른 워커의 실행 결과를 한 줄로 요약합니다."""
+    if not results:
+        return ""
+    failed = {worker: error for worker, error in results.items() if error}
+    if not failed:
+        return f" (all {len(results) + 1} workers)"
+    return " (failed on " + ", ".join(f"worker {worker}: {error}" for worker, error in failed.items()) + ")"
 
 @bot.tree.command(name="load", description="Load Extention")
 @app_commands.describe(extention="extention")
@@ -34,14 +138,20 @@ async def load(interaction: discord.Interaction, extention:str):
     
     await interaction.response.defer()
     try:
-        print("loading "+extention)
-        await bot.load_extension("Cogs."+extention)
+        log.info("extension.load_requested", extension=extention, user=interaction.user.id)
+        await bot.apply_extension_action("load", extention)
     except Exception as e:
         await interaction.followup.send(f'**`ERROR:`** {type(e).__name__} - {e}', ephemeral=True)
     else:
-        await interaction.followup.send('**`SUCCESS`**', ephemeral=True)
+        workers = describe_workers(await bot.broadcast_extension_action("load", extention))
+        missing = missing_intents(bot, extention)
+        if missing:
+            # 인텐트는 연결할 때 정해지므로 AUTOLOAD_COGS나 INTENTS_EXTRA에 추가하고 재시작해야 합니다.
+            await interaction.followup.send(f'**`SUCCESS`**{workers} (missing intents: {", ".join(missing)})', ephemeral=True)
+        else:
+            await interaction.followup.send(f'**`SUCCESS`**{workers}', ephemeral=True)
 
-    await bot.tree.sync()
+    await sync_command_tree(bot.tree)
 
 @bot.tree.command(name="unload", description="Unload Extention")
 @app_commands.describe(extention="extention")
@@ -59,12 +169,72 @@ async def unload(interaction: discord.Interaction, extention:str):
 
     await interaction.response.defer()
     try:
-        await bot.unload_extension("Cogs."+extention)
+        await bot.apply_extension_action("unload", extention)
     except Exception as e:
         await interaction.followup.send(f'**`ERROR:`** {type(e).__name__} - {e}', ephemeral=True)
     else:
-        await interaction.followup.send('**`SUCCESS`**', ephemeral=True)
+        workers = describe_workers(await bot.broadcast_extension_action("unload", extention))
+        await interaction.followup.send(f'**`SUCCESS`**{workers}', ephemeral=True)
 
-    await bot.tree.sync()
+    await sync_command_tree(bot.tree)
+
+@bot.tree.command(name="chat_backend", description="멘션에 답할 채팅 백엔드를 선택합니다.")
+@app_commands.describe(backend="backend")
+async def chat_backend(interaction: discord.Interaction, backend: str):
+    """Command which selects the chat backend for the user."""
+
+    try:
+        await router.set_backend(interaction.user.id, backend)
+    except KeyError:
+        await interaction.response.send_message(
+            f"사용할 수 없는 백엔드입니다. 가능한 백엔드: {', '.join(router.backends()) or '없음'}", ephemeral=True)
+        return
+    await interaction.response.send_message(f"채팅 백엔드가 '{backend}'(으)로 설정되었습니다.", ephemeral=True)
+
+@chat_backend.autocomplete("backend")
+async def chat_backend_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=name, value=name)
+        for name in router.backends() if current.lower() in name.lower()
+    ]
+
+# 페르소나와 대화 기록은 백엔드마다 따로 있으므로, 커맨드는 하나만 두고 사용자가 고른 백엔드로 넘깁니다.
+@bot.tree.command(name="select_persona", description="페르소나(캐릭터)를 선택하고 대화 기록을 초기화합니다.")
+@app_commands.describe(persona="사용할 페르소나를 선택하세요.")
+async def select_persona(interaction: discord.Interaction, persona: str):
+    """Command which selects the persona on the user's chat backend."""
+
+    backend, controls = await router.controls_for(interaction.user.id)
+    if controls is None:
+        await interaction.response.send_message("사용할 수 있는 채팅 백엔드가 없습니다.", ephemeral=True)
+        return
+    if persona not in controls.personas:
+        await interaction.response.send_message(
+            f"존재하지 않는 페르소나입니다. 사용 가능한 페르소나: {', '.join(controls.personas.keys())}", ephemeral=True)
+        return
+    await controls.set_persona(interaction.user.id, persona)
+    await interaction.response.send_message(
+        f"페르소나가 `{persona}`로 설정되고 대화 기록이 초기화되었습니다. ({backend})", ephemeral=True)
+
+@select_persona.autocomplete("persona")
+async def select_persona_autocomplete(interaction: discord.Interaction, current: str):
+    _, controls = await router.controls_for(interaction.user.id)
+    return [
+        app_commands.Choice(name=key, value=key)
+        for key in (controls.personas if controls is not None else ())
+        if current.lower() in key.lower()
+    ]
+
+@bot.tree.command(name="reset", description="대화 기록을 초기화합니다.")
+async def reset_conversation(interaction: discord.Interaction):
+    """Command which resets the conversation on the user's chat backend."""
+
+    backend, controls = await router.controls_for(interaction.user.id)
+    if controls is None:
+        await interaction.response.send_message("사용할 수 있는 채팅 백엔드가 없습니다.", ephemeral=True)
+        return
+    await controls.reset_user(interaction.user.id)
+    await interaction.response.send_message(f"대화 기록이 초기화되었습니다. ({backend})", ephemeral=True)
 
-bot.run(token)
\ No newline at end of file
+# discord.py 로그도 setup_logging()이 붙인 핸들러로 나가므로 기본 핸들러는 붙이지 않습니다.
+bot.run(token, log_handler=None)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import asyncio
+import unittest
+
+from utils.conversation import ConversationGate
+
+
+class ConversationGateTest(unittest.IsolatedAsyncioTestCase):
+    async def test_pending_items_run_after_failed_turn(self):
+        """첫 턴이 예외로 끝나도 그동안 모인 메시지는 다음 턴으로 처리되어야 합니다."""
+        gate = ConversationGate(coalesce=True)
+        started = asyncio.Event()
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(items):
+            handled.append(items)
+            if items == ["first"]:
+                started.set()
+                await release.wait()
+                raise RuntimeError("boom")
+
+        first = asyncio.create_task(gate.run(1, "first", handler))
+        await started.wait()
+        self.assertFalse(await gate.run(1, "second", handler))
+        self.assertFalse(await gate.run(1, "third", handler))
+        release.set()
+        with self.assertRaises(RuntimeError):
+            await first
+        self.assertEqual(handled, [["first"], ["second", "third"]])
+        self.assertFalse(gate.busy(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
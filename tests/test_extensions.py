@@ -0,0 +1,74 @@
+import os
+import unittest
+from unittest import mock
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from bench.stubs import StubComfyUI
+from utils.extensions import DEFAULT_EXTENSIONS, autoload_extensions
+from utils.http import close_http_clients
+from utils.router import get_router
+
+# 네트워크 없이 Cog를 불러올 수 있도록 연결되지 않는 주소와 메모리 저장소를 씁니다.
+# ComfyUI는 웹소켓 연결을 기다리므로 스텁 서버를 띄웁니다 (asyncSetUp).
+TEST_ENV = {
+    "GEMINI_KEY": "test",
+    "GEMINI_PREWARM": "0",
+    "GEMINI_API_BASE": "http://127.0.0.1:9/v1beta",
+    "OLLAMA_URL": "http://127.0.0.1:9",
+    "OLLAMA_PS_INTERVAL": "0",
+    "COMFYUI_CACHE_MAX_MB": "0",
+    "STATE_STORE": "memory",
+}
+
+# main.py가 Cog보다 먼저 트리에 올리는 커맨드
+MAIN_COMMANDS = ("load", "unload", "chat_backend", "select_persona", "reset")
+
+
+class ExtensionLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.comfy = StubComfyUI()
+        self.env = mock.patch.dict(os.environ, TEST_ENV, COMFYUI_SERVER_ADDRESS=await self.comfy.start())
+        self.env.start()
+        self.bot = commands.Bot(command_prefix="!", intents=discord.Intents.none())
+
+    async def asyncTearDown(self):
+        for name in list(self.bot.extensions):
+            await self.bot.unload_extension(name)
+        await close_http_clients(self.bot)
+        await self.comfy.stop()
+        self.env.stop()
+
+    async def test_default_autoload_extensions_load_together(self):
+        """기본 AUTOLOAD_COGS는 main.py처럼 load_extension으로 한 봇에 모두 불러와져야 합니다."""
+        for name in MAIN_COMMANDS:
+            self.bot.tree.add_command(app_commands.Command(name=name, description=name, callback=_noop))
+        with mock.patch.dict(os.environ, {"AUTOLOAD_COGS": DEFAULT_EXTENSIONS}):
+            names = autoload_extensions()
+        for name in names:
+            await self.bot.load_extension("Cogs." + name)
+        self.assertEqual(sorted(self.bot.extensions), sorted("Cogs." + name for name in names))
+        self.assertEqual(sorted(get_router(self.bot).backends()), ["gemini", "ollama"])
+        self.assertEqual(sorted(get_router(self.bot).controls), ["gemini", "ollama"])
+
+    async def test_failed_load_releases_shared_state(self):
+        """커맨드 등록에서 실패한 Cog는 상태 저장소 참조와 라우터 등록을 남기지 않아야 합니다."""
+        @app_commands.command(name="select_model", description="conflict")
+        async def conflict(interaction: discord.Interaction):
+            pass
+
+        self.bot.tree.add_command(conflict)
+        with self.assertRaises(commands.ExtensionFailed):
+            await self.bot.load_extension("Cogs.ChatOllama")
+        self.assertIsNone(getattr(self.bot, "state_store", None))
+        self.assertEqual(get_router(self.bot).backends(), [])
+
+
+async def _noop(interaction: discord.Interaction):
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
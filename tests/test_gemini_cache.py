@@ -0,0 +1,48 @@
+import time
+import unittest
+
+from utils.gemini_cache import GeminiContextCache
+
+
+class _Response:
+    def __init__(self, status):
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return "error"
+
+
+class _Session:
+    def __init__(self, status):
+        self.status = status
+
+    def post(self, url, json):
+        return _Response(self.status)
+
+
+class GeminiContextCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def retry_after(self, status) -> float:
+        cache = GeminiContextCache(_Session(status), "http://gemini", "key", "model", estimate_tokens=len,
+                                   ttl=900, retry_backoff=60)
+        self.assertIsNone(await cache._create("digest", "system", []))
+        return cache._rejected["digest"] - time.monotonic()
+
+    async def test_rejected_request_is_not_retried_for_ttl(self):
+        """캐싱 자체를 거부한 응답(400/403)은 TTL 동안 다시 시도하지 않아야 합니다."""
+        for status in (400, 403):
+            self.assertGreater(await self.retry_after(status), 60)
+
+    async def test_transient_failure_is_retried_after_backoff(self):
+        """한도 초과(429)나 서버 오류(5xx)는 짧게 쉬었다가 다시 시도해야 합니다."""
+        for status in (429, 500, 503):
+            self.assertLessEqual(await self.retry_after(status), 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from utils.image_cache import STALE_TMP_SECONDS, SUFFIX, ImageCache
+
+
+class ImageCacheScanTest(unittest.IsolatedAsyncioTestCase):
+    async def test_scan_keeps_temp_files_of_running_workers(self):
+        """다른 워커가 쓰는 중인 임시 파일은 지우지 않고, 끝난 프로세스나 오래된 임시 파일만 지워야 합니다."""
+        finished = subprocess.Popen([sys.executable, "-c", "pass"])
+        finished.wait()
+        with tempfile.TemporaryDirectory() as directory:
+            def touch(name, age=0.0):
+                path = os.path.join(directory, name)
+                open(path, "wb").close()
+                if age:
+                    stamp = time.time() - age
+                    os.utime(path, (stamp, stamp))
+                return path
+
+            running = touch(f"a{SUFFIX}.{os.getpid()}.tmp")
+            dead = touch(f"b{SUFFIX}.{finished.pid}.tmp")
+            stale = touch(f"c{SUFFIX}.{os.getpid()}.tmp", age=STALE_TMP_SECONDS + 60)
+            await ImageCache(directory).load()
+            self.assertTrue(os.path.exists(running))
+            self.assertFalse(os.path.exists(dead))
+            self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == "__main__":
+    unittest.main()
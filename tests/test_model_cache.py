@@ -0,0 +1,45 @@
+import unittest
+
+from utils.model_cache import ModelInfoCache
+
+
+class ModelInfoCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_capabilities_does_not_count_model_list_lookup(self):
+        """capabilities() 한 번은 적중 또는 실패 한 번으로만 세어야 합니다."""
+        async def fetch_models():
+            return {"a": "d1"}
+
+        async def fetch_capabilities(model):
+            return ["completion"]
+
+        cache = ModelInfoCache(fetch_models, fetch_capabilities)
+        await cache.capabilities("a")
+        await cache.capabilities("a")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    async def test_failed_model_list_is_not_refetched_within_failure_ttl(self):
+        """Ollama가 내려가 있는 동안 턴마다 /api/tags를 다시 요청하면 안 됩니다."""
+        calls = []
+
+        async def fetch_models():
+            calls.append("tags")
+            raise ConnectionError("down")
+
+        async def fetch_capabilities(model):
+            return ["completion"]
+
+        cache = ModelInfoCache(fetch_models, fetch_capabilities, failure_ttl=60)
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                await cache.models()
+            self.assertEqual(await cache.capabilities("a"), ["completion"])
+        self.assertEqual(calls, ["tags"])
+
+        cache.failure_ttl = 0
+        with self.assertRaises(ConnectionError):
+            await cache.models()
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils.scheduler import FairScheduler, get_scheduler
+
+
+class FairSchedulerCancelTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_during_on_queued_does_not_leak_slot(self):
+        """대기 안내(on_queued)를 보내는 도중 취소된 요청이 나중에 슬롯을 받아 붙잡고 있으면 안 됩니다."""
+        scheduler = FairScheduler("test", max_in_flight=1)
+        await scheduler.acquire(1)
+        notice_started = asyncio.Event()
+
+        async def slow_notice(ahead):
+            notice_started.set()
+            await asyncio.sleep(3600)
+
+        task = asyncio.create_task(scheduler.acquire(2, on_queued=slow_notice))
+        await notice_started.wait()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        scheduler.release(1)
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+        self.assertEqual(scheduler.stats()["queued"], 0)
+        self.assertEqual(scheduler._active, {})
+        await asyncio.wait_for(scheduler.acquire(3), timeout=1)
+
+    async def test_cancel_after_grant_releases_slot(self):
+        """슬롯을 받은 직후(on_queued 도중) 취소되면 슬롯을 돌려줍니다."""
+        scheduler = FairScheduler("test", max_in_flight=1)
+        await scheduler.acquire(1)
+        release_now = asyncio.Event()
+
+        async def notice(ahead):
+            release_now.set()
+            await asyncio.sleep(3600)
+
+        task = asyncio.create_task(scheduler.acquire(2, on_queued=notice))
+        await release_now.wait()
+        scheduler.release(1)  # 안내를 보내는 동안 사용자 2가 슬롯을 받습니다.
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+        await asyncio.wait_for(scheduler.acquire(3), timeout=1)
+
+
+class GetSchedulerTest(unittest.TestCase):
+    def test_max_in_flight_is_split_between_workers(self):
+        """launcher.py로 워커를 여럿 띄우면 동시 요청 한도를 워커 수로 나눠야 합니다 (최소 1)."""
+        with mock.patch.dict(os.environ, {"CLUSTER_WORKERS": "2", "SCHED_TEST_MAX_IN_FLIGHT": "4"}):
+            self.assertEqual(get_scheduler(SimpleNamespace(), "test").max_in_flight, 2)
+        with mock.patch.dict(os.environ, {"CLUSTER_WORKERS": "4"}):
+            self.assertEqual(get_scheduler(SimpleNamespace(), "test", max_in_flight=2).max_in_flight, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
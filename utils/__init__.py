@@ -0,0 +1,6 @@
+"""
+여러 Cog가 함께 사용하는 공용 헬퍼 모음.
+
+Cogs/ 아래의 모듈은 `/load`로 불러오는 확장(extension)이므로,
+확장이 아닌 공용 코드는 이 패키지에 둡니다.
+"""
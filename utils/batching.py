@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+from utils.log import get_logger
+
+log = get_logger("batching")
+
+
+class MicroBatcher:
+    """
+    짧은 시간(window) 동안 들어온 요청을 key별로 모아 한 번에 처리합니다.
+
+    key가 같은 요청이 max_batch개 모이면 기다리지 않고 바로 처리합니다.
+    eager=True이면 최근 window 안에 같은 key의 요청이 없던 요청은 기다리지 않고 바로 처리하고,
+    같은 key가 이어서 들어올 때만 모읍니다. 합쳐질 상대가 없는 요청까지 window만큼 늦추지 않기 위해서입니다.
+    run_batch(key, items)는 각 항목의 결과를 직접 전달(예: future 설정)해야 합니다.
+    """
+
+    def __init__(self, run_batch, window: float = 0.5, max_batch: int = 4, eager: bool = False):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.eager = eager
+        self._buffers = {}  # key -> [item]
+        self._timers = {}   # key -> asyncio.Task
+        self._recent = {}   # key -> 마지막으로 요청이 들어온 시각 (eager일 때만)
+        self._running = set()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, item):
+        alone = self.eager and not self._seen_recently(key)
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append(item)
+        if alone or len(buffer) >= self.max_batch or self.window <= 0:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    def _seen_recently(self, key) -> bool:
+        now = time.monotonic()
+        for other in [other for other, at in self._recent.items() if now - at > self.window]:
+            del self._recent[other]
+        seen = key in self._recent
+        self._recent[key] = now
+        return seen
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        self._timers.pop(key, None)
+        self._flush(key)
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        items = self._buffers.pop(key, None)
+        if not items:
+            return
+        self.batches += 1
+        self.items += len(items)
+        task = asyncio.create_task(self._run(key, items))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, items):
+        try:
+            await self.run_batch(key, items)
+        except Exception:
+            log.exception("batch.failed", key=str(key), items=len(items))
+
+    async def close(self):
+        """대기 중인 요청을 바로 처리하고 진행 중인 배치가 끝나기를 기다립니다."""
+        for key in list(self._buffers):
+            self._flush(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+from utils.log import get_logger
+
+log = get_logger("cluster")
+
+
+class ClusterError(Exception):
+    """제어 채널에 연결되어 있지 않거나 브로드캐스트가 실패했을 때 발생합니다."""
+
+
+def shard_options() -> dict:
+    """
+    launcher.py가 넘긴 샤드 범위(SHARD_COUNT, SHARD_IDS)를 AutoShardedBot 인자로 바꿉니다.
+    설정이 없으면 빈 dict를 반환하며, 이때는 Discord가 권장하는 샤드 수를 모두 이 프로세스가 맡습니다.
+    """
+    count = os.getenv("SHARD_COUNT")
+    if not count:
+        return {}
+    options = {"shard_count": int(count)}
+    ids = os.getenv("SHARD_IDS", "")
+    if ids:
+        options["shard_ids"] = [int(part) for part in ids.split(",") if part.strip()]
+    return options
+
+
+def _spawn(tasks: set, coro):
+    """
+    백그라운드 태스크를 tasks에 붙잡아 두어 실행 중에 가비지 컬렉션되지 않게 하고,
+    끝나면 빼면서 처리되지 않은 예외를 로그로 남깁니다.
+    """
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(lambda t: _done(tasks, t))
+
+
+def _done(tasks: set, task):
+    tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("task.failed", error=f"{type(task.exception()).__name__} - {task.exception()}")
+
+
+def worker_id() -> int:
+    return int(os.getenv("WORKER_ID", "0"))
+
+
+def worker_count() -> int:
+    """launcher.py가 띄운 워커 프로세스 수 (CLUSTER_WORKERS). 단독 실행이면 1입니다."""
+    return max(1, int(os.getenv("CLUSTER_WORKERS", "1")))
+
+
+def is_primary_worker() -> bool:
+    """커맨드 트리 동기화처럼 한 프로세스만 하면 되는 작업을 맡는 워커인지 여부."""
+    return worker_id() == 0
+
+
+class ClusterClient:
+    """
+    워커 프로세스 쪽 제어 채널. launcher.py의 ControlHub에 웹소켓으로 연결해 (끊기면 재연결)
+    다른 워커가 보낸 확장 로드/언로드 요청을 실행하고, 이 워커의 요청을 다른 워커 모두에 보냅니다.
+    """
+
+    def __init__(self, url: str, worker: int, handler):
+        self.url = url
+        self.worker = worker
+        self.handler = handler  # async (action, extension) -> None, 실패하면 예외
+        self.session = None
+        self._ws = None
+        self._pending = {}  # 요청 ID -> Future
+        self._task = None
+        self._tasks = set()  # 실행 중인 _run 태스크
+
+    async def start(self):
+        if self._task is None:
+            self.session = aiohttp.ClientSession()
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _loop(self):
+        delay = 1.0
+        while True:
+            try:
+                async with self.session.ws_connect(self.url, heartbeat=30) as ws:
+                    await ws.send_json({"op": "hello", "worker": self.worker})
+                    self._ws = ws
+                    delay = 1.0
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._dispatch(json.loads(msg.data))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except (aiohttp.ClientError, OSError) as e:
+                log.warning("control.connect_failed", url=self.url, error=str(e))
+            self._ws = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ClusterError("제어 채널 연결이 끊겼습니다."))
+            self._pending.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _dispatch(self, message):
+        op = message.get("op")
+        if op == "run":
+            _spawn(self._tasks, self._run(message))
+        elif op == "broadcast_result":
+            future = self._pending.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result({int(worker): error for worker, error in message["results"].items()})
+
+    async def _run(self, message):
+        error = None
+        try:
+            await self.handler(message["action"], message["extension"])
+        except Exception as e:
+            error = f"{type(e).__name__} - {e}"
+        if self._ws is not None:
+            await self._ws.send_json({"op": "result", "id": message["id"], "worker": self.worker, "error": error})
+
+    async def broadcast(self, action: str, extension: str, timeout: float = 60.0) -> dict:
+        """
+        다른 모든 워커에서 action(load/unload/reload)을 실행하고 {워커: 오류 또는 None}을 반환합니다.
+        """
+        if self._ws is None:
+            raise ClusterError("클러스터 제어 채널에 연결되어 있지 않습니다.")
+        request_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        await self._ws.send_json({"op": "broadcast", "id": request_id, "action": action, "extension": extension})
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+
+class ControlHub:
+    """
+    launcher.py 쪽 제어 채널. 워커들의 웹소켓 연결을 받아, 한 워커의 브로드캐스트 요청을
+    나머지 워커에 전달하고 결과를 모아 요청한 워커에 돌려줍니다.
+    """
+
+    def __init__(self, timeout: float = 50.0):
+        self.timeout = timeout
+        self.workers = {}      # 워커 ID -> WebSocketResponse
+        self._collecting = {}  # 요청 ID -> (결과 dict, 남은 워커 set, Future)
+        self._tasks = set()    # 실행 중인 _broadcast 태스크
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/ws", self._handle)
+        return app
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        worker = None
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                op = message.get("op")
+                if op == "hello":
+                    worker = int(message["worker"])
+                    self.workers[worker] = ws
+                elif op == "broadcast":
+                    _spawn(self._tasks, self._broadcast(worker, ws, message))
+                elif op == "result":
+                    self._record(message["id"], int(message["worker"]), message["error"])
+        finally:
+            if worker is not None and self.workers.get(worker) is ws:
+                del self.workers[worker]
+                for request_id in list(self._collecting):
+                    self._record(request_id, worker, "worker disconnected")
+        return ws
+
+    def _record(self, request_id, worker, error):
+        entry = self._collecting.get(request_id)
+        if entry is None:
+            return
+        results, remaining, future = entry
+        if worker in remaining:
+            remaining.discard(worker)
+            results[worker] = error
+        if not remaining and not future.done():
+            future.set_result(results)
+
+    async def _broadcast(self, origin, origin_ws, message):
+        targets = {worker: ws for worker, ws in self.workers.items() if worker != origin}
+        results = {}
+        future = asyncio.get_running_loop().create_future()
+        self._collecting[message["id"]] = (results, set(targets), future)
+        if not targets:
+            future.set_result(results)
+        run = {"op": "run", "id": message["id"], "action": message["action"], "extension": message["extension"]}
+        for worker, ws in targets.items():
+            try:
+                await ws.send_json(run)
+            except (ConnectionResetError, RuntimeError):
+                self._record(message["id"], worker, "worker disconnected")
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            for worker in targets:
+                results.setdefault(worker, "timeout")
+        finally:
+            self._collecting.pop(message["id"], None)
+        if not origin_ws.closed:
+            await origin_ws.send_json({"op": "broadcast_result", "id": message["id"],
+                                       "results": {str(worker): error for worker, error in results.items()}})
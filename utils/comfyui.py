@@ -0,0 +1,503 @@
+import asyncio
+import inspect
+import json
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+import aiohttp
+
+from utils.log import get_logger
+from utils.metrics import COMFYUI_WORKER_HEALTHY, COMFYUI_WORKER_IMAGES, COMFYUI_WORKER_LOAD, PAYLOAD_BYTES, REGISTRY
+
+log = get_logger("comfyui")
+
+
+class ComfyUIError(Exception):
+    """ComfyUI가 작업을 거부하거나 실행 중 오류를 보고했을 때 발생합니다."""
+
+
+class GenerationCancelled(ComfyUIError):
+    """사용자가 작업을 취소했을 때 발생합니다."""
+
+
+class ComfyJob:
+    """ComfyUI에 제출한 하나의 프롬프트(작업)."""
+
+    def __init__(self, prompt_id: str, on_event=None):
+        self.prompt_id = prompt_id
+        self.on_event = on_event  # (type, data) -> None | awaitable
+        self.server_address = None  # 작업을 실행하는 서버 (결과 이미지는 이 서버의 /view에서 받습니다)
+        self.outputs = {}         # node id -> output
+        self.cancelled = False
+        self.created_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def images(self) -> list:
+        """모든 출력 노드의 이미지 정보를 노드 순서대로 모읍니다."""
+        return [image for node in sorted(self.outputs) for image in self.outputs[node].get("images", [])]
+
+
+class ComfyUIClient:
+    """
+    ComfyUI 서버 하나와의 연결.
+
+    웹소켓 하나를 계속 유지하면서 (끊기면 재연결) 들어오는 메시지를 prompt_id별 작업으로
+    나눠 줍니다. 작업은 웹소켓이 연결된 상태에서 prompt_id를 먼저 등록한 뒤 제출하므로,
+    완료 이벤트가 등록보다 먼저 도착해 유실되는 일이 없습니다.
+    """
+
+    ORPHAN_LIMIT = 64
+
+    def __init__(self, session: aiohttp.ClientSession, server_address: str, client_id: str = None):
+        self.session = session
+        self.server_address = server_address
+        self.client_id = client_id or str(uuid.uuid4())
+        self.jobs = {}                 # prompt_id -> ComfyJob
+        self._orphans = OrderedDict()  # 아직 등록되지 않은 prompt_id의 이벤트
+        self._connected = asyncio.Event()
+        self._task = None
+        self._tasks = set()            # /history 복구 등 웹소켓 루프 밖에서 도는 작업
+        self.reconnects = 0
+
+    @property
+    def http_url(self) -> str:
+        return f"http://{self.server_address}"
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def fail_all(self, error: Exception):
+        """진행 중인 작업을 모두 error로 끝냅니다 (서버가 죽어 결과를 받을 수 없을 때)."""
+        for job in list(self.jobs.values()):
+            self._fail(job, error)
+
+    async def system_stats(self) -> dict:
+        async with self.session.get(f"{self.http_url}/system_stats") as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def start(self, timeout: float = 5.0):
+        """웹소켓 루프를 시작하고 첫 연결을 잠시 기다립니다 (실패해도 백그라운드에서 재시도)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._ws_loop())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("ws.connect_timeout", server=self.server_address)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            if not job.future.done():
+                job.future.set_exception(ComfyUIError("ComfyUI 연결이 종료되었습니다."))
+        self.jobs.clear()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ---- 웹소켓 ----
+
+    async def _ws_loop(self):
+        ws_url = f"ws://{self.server_address}/ws?clientId={self.client_id}"
+        delay = 1.0
+        while True:
+            try:
+                async with self.session.ws_connect(ws_url, heartbeat=30, max_msg_size=0) as ws:
+                    self._connected.set()
+                    delay = 1.0
+                    # 끊겨 있던 동안 끝난 작업이 있으면 /history로 결과를 복구합니다.
+                    self._spawn(self._recover_pending())
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            try:
+                                await self._dispatch(json.loads(msg.data))
+                            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                                log.warning("ws.invalid_message", server=self.server_address, error=str(e))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except (aiohttp.ClientError, OSError) as e:
+                log.error("ws.connect_failed", server=self.server_address, error=str(e))
+            self._connected.clear()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def _dispatch(self, message):
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return  # status 등 특정 작업과 무관한 메시지
+
+        job = self.jobs.get(prompt_id)
+        if job is None:
+            # 서버가 다른 prompt_id를 발급한 경우를 대비해 잠시 보관합니다.
+            self._orphans.setdefault(prompt_id, []).append(message)
+            while len(self._orphans) > self.ORPHAN_LIMIT:
+                self._orphans.popitem(last=False)
+            return
+
+        if job.on_event is not None:
+            try:
+                result = job.on_event(event_type, data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                log.exception("event.callback_failed", event=event_type)
+
+        if event_type == "executed":
+            job.outputs[data["node"]] = data.get("output") or {}
+        elif event_type == "execution_success" or (event_type == "executing" and data.get("node") is None):
+            if job.outputs:
+                self._finish(job)
+            else:
+                # 결과가 모두 캐시된 경우 executed 이벤트가 오지 않으므로 /history에서 가져옵니다.
+                # 느린 /history 응답이 다른 작업의 진행 이벤트를 막지 않도록 웹소켓 루프 밖에서 기다립니다.
+                # 작업은 먼저 빼 두어 뒤따르는 완료 이벤트로 다시 조회하지 않게 합니다.
+                self.jobs.pop(job.prompt_id, None)
+                self._spawn(self._finish_from_history(job))
+        elif event_type == "execution_error":
+            self._fail(job, ComfyUIError(f"{data.get('exception_type')}: {data.get('exception_message')}"))
+        elif event_type == "execution_interrupted":
+            self._fail(job, GenerationCancelled("작업이 취소되었습니다.") if job.cancelled else ComfyUIError("작업이 중단되었습니다."))
+
+    def _finish(self, job):
+        self.jobs.pop(job.prompt_id, None)
+        if not job.future.done():
+            job.future.set_result(job)
+
+    def _fail(self, job, error):
+        self.jobs.pop(job.prompt_id, None)
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    async def _fetch_history(self, prompt_id):
+        try:
+            async with self.session.get(f"{self.http_url}/history/{prompt_id}") as resp:
+                if resp.status != 200:
+                    return None
+                return (await resp.json()).get(prompt_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError):
+            return None
+
+    async def _finish_from_history(self, job):
+        try:
+            entry = await self._fetch_history(job.prompt_id)
+        except asyncio.CancelledError:
+            self._fail(job, ComfyUIError("ComfyUI 연결이 종료되었습니다."))
+            raise
+        job.outputs.update((entry or {}).get("outputs", {}))
+        self._finish(job)
+
+    async def _recover_pending(self):
+        for job in list(self.jobs.values()):
+            entry = await self._fetch_history(job.prompt_id)
+            if not entry:
+                continue  # 아직 실행 중이거나 대기 중입니다.
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                self._fail(job, ComfyUIError("ComfyUI 작업이 실패했습니다."))
+            elif status.get("completed", True):
+                job.outputs.update(entry.get("outputs", {}))
+                self._finish(job)
+
+    # ---- 큐 ----
+
+    async def get_queue(self):
+        """(실행 중, 대기 중) 항목 목록을 반환합니다. 각 항목은 [번호, prompt_id, ...] 형식입니다."""
+        async with self.session.get(f"{self.http_url}/queue") as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return data.get("queue_running", []), data.get("queue_pending", [])
+
+    async def queue_position(self, prompt_id: str):
+        """실행 중이면 0, 대기 중이면 1부터 시작하는 순번, 큐에 없으면 None."""
+        running, pending = await self.get_queue()
+        if any(item[1] == prompt_id for item in running):
+            return 0
+        for position, item in enumerate(sorted(pending, key=lambda item: item[0]), start=1):
+            if item[1] == prompt_id:
+                return position
+        return None
+
+    async def cancel(self, job: ComfyJob):
+        """실행 중인 작업은 중단(/interrupt)하고, 대기 중인 작업은 큐에서 제거합니다."""
+        job.cancelled = True
+        running, _ = await self.get_queue()
+        if any(item[1] == job.prompt_id for item in running):
+            # 최신 ComfyUI는 prompt_id를 지정한 중단을 지원합니다. (이전 버전은 현재 작업을 중단)
+            async with self.session.post(f"{self.http_url}/interrupt", json={"prompt_id": job.prompt_id}) as resp:
+                resp.raise_for_status()
+            # 완료 처리는 execution_interrupted 이벤트에서 합니다.
+        else:
+            async with self.session.post(f"{self.http_url}/queue", json={"delete": [job.prompt_id]}) as resp:
+                resp.raise_for_status()
+            self._fail(job, GenerationCancelled("작업이 취소되었습니다."))
+
+    # ---- 작업 ----
+
+    async def submit(self, workflow: dict, on_event=None) -> ComfyJob:
+        """워크플로우를 큐에 넣고 ComfyJob을 반환합니다. 결과는 wait()로 기다립니다."""
+        if not self._connected.is_set():
+            try:
+                await asyncio.wait_for(self._connected.wait(), 5.0)
+            except asyncio.TimeoutError:
+                pass  # 재연결 후 /history 복구에 맡깁니다.
+
+        job = ComfyJob(str(uuid.uuid4()), on_event)
+        job.server_address = self.server_address
+        self.jobs[job.prompt_id] = job
+        payload = {"prompt": workflow, "client_id": self.client_id, "prompt_id": job.prompt_id}
+        body = json.dumps(payload).encode("utf-8")
+        PAYLOAD_BYTES.observe(len(body), backend="comfyui", direction="sent")
+        try:
+            async with self.session.post(f"{self.http_url}/prompt", data=body,
+                                         headers={"Content-Type": "application/json"}) as resp:
+                if resp.status != 200:
+                    error_text = await resp.text()
+                    raise ComfyUIError(f"ComfyUI API 에러: {resp.status} - {error_text}")
+                queue_data = await resp.json()
+        except BaseException:
+            self.jobs.pop(job.prompt_id, None)
+            raise
+
+        prompt_id = queue_data["prompt_id"]
+        if prompt_id != job.prompt_id:
+            # prompt_id 지정을 지원하지 않는 서버: 발급받은 ID로 다시 등록하고 먼저 온 이벤트를 재생합니다.
+            del self.jobs[job.prompt_id]
+            job.prompt_id = prompt_id
+            self.jobs[prompt_id] = job
+            for message in self._orphans.pop(prompt_id, []):
+                await self._dispatch(message)
+        return job
+
+    async def wait(self, job: ComfyJob) -> ComfyJob:
+        try:
+            return await job.future
+        finally:
+            self.jobs.pop(job.prompt_id, None)
+
+    async def queue_prompt(self, workflow: dict, on_event=None) -> list:
+        """워크플로우를 실행하고 생성된 이미지 정보 목록을 반환합니다."""
+        job = await self.submit(workflow, on_event)
+        return (await self.wait(job)).images()
+
+
+class ComfyWorker:
+    """풀에 속한 ComfyUI 서버 하나의 상태 (부하, 마지막으로 쓴 체크포인트, 헬스 체크 결과, 처리량)."""
+
+    def __init__(self, client: ComfyUIClient):
+        self.client = client
+        self.healthy = True
+        self.failures = 0        # 연속 헬스 체크 실패 횟수
+        self.in_flight = 0       # 이 봇이 보내 아직 끝나지 않은 작업 수
+        self.queue_depth = 0     # 마지막 /queue 조회 결과 (다른 클라이언트 작업 포함)
+        self.checkpoint = None   # 마지막으로 실행한 체크포인트 (VRAM에 올라가 있을 가능성이 높음)
+        self.completed = 0
+        self.failed = 0
+        self.images = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def address(self) -> str:
+        return self.client.server_address
+
+    @property
+    def mean_job_seconds(self):
+        return self.busy_seconds / self.completed if self.completed else None
+
+    @property
+    def load(self) -> int:
+        # /queue는 주기적으로만 갱신되므로, 그 사이에 보낸 작업은 로컬 카운트로 반영합니다.
+        return max(self.in_flight, self.queue_depth)
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "connected": self.client.connected,
+            "load": self.load,
+            "checkpoint": self.checkpoint,
+            "completed": self.completed,
+            "failed": self.failed,
+            "images": self.images,
+            "mean_job_seconds": self.mean_job_seconds,
+        }
+
+
+class ComfyUIPool:
+    """
+    여러 ComfyUI 서버에 작업을 나눠 보내는 풀. ComfyUIClient와 같은 submit/wait/cancel/queue_position을 제공합니다.
+
+    - 작업은 건강한 서버 중 부하(실행+대기 작업 수)가 가장 적은 곳으로 보내며, 요청한 체크포인트를
+      마지막으로 실행한 서버에는 checkpoint_penalty만큼 유리하게 쳐서 모델 교체를 줄입니다.
+    - health_interval마다 /system_stats와 /queue를 확인하고, max_failures번 연속 실패한 서버는
+      새 작업을 받지 않습니다. 웹소켓까지 끊겼다면 그 서버의 작업은 결과를 받을 수 없으므로 실패 처리합니다.
+      헬스 체크가 다시 성공하면 풀에 복귀합니다.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, server_addresses, client_id: str = None,
+                 health_interval: float = 5.0, max_failures: int = 3, checkpoint_penalty: float = 1.0):
+        client_id = client_id or str(uuid.uuid4())
+        self.workers = [ComfyWorker(ComfyUIClient(session, address, client_id)) for address in server_addresses]
+        if not self.workers:
+            raise ValueError("ComfyUI 서버 주소가 없습니다.")
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.checkpoint_penalty = checkpoint_penalty
+        self._job_workers = {}  # prompt_id -> ComfyWorker
+        self._health_task = None
+        _pools.add(self)
+
+    @property
+    def server_address(self) -> str:
+        return self.workers[0].address
+
+    async def start(self, timeout: float = 5.0):
+        await asyncio.gather(*(worker.client.start(timeout) for worker in self.workers))
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        await asyncio.gather(*(worker.client.close() for worker in self.workers))
+
+    # ---- 헬스 체크 ----
+
+    async def _check(self, worker: ComfyWorker):
+        try:
+            await worker.client.system_stats()
+            running, pending = await worker.client.get_queue()
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+            worker.failures += 1
+            if worker.healthy and worker.failures >= self.max_failures:
+                worker.healthy = False
+                log.warning("worker.unhealthy", worker=worker.address, error=str(e) or type(e).__name__)
+            if not worker.healthy and not worker.client.connected:
+                worker.client.fail_all(ComfyUIError(f"ComfyUI 서버({worker.address})에 연결할 수 없습니다."))
+            return
+        worker.queue_depth = len(running) + len(pending)
+        worker.failures = 0
+        if not worker.healthy:
+            worker.healthy = True
+            log.info("worker.recovered", worker=worker.address)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(worker) for worker in self.workers))
+            await asyncio.sleep(self.health_interval)
+
+    # ---- 작업 배정 ----
+
+    @staticmethod
+    def _checkpoint(workflow: dict):
+        for node in workflow.values():
+            if node.get("class_type") == "CheckpointLoaderSimple":
+                return node.get("inputs", {}).get("ckpt_name")
+        return None
+
+    def pick(self, checkpoint=None) -> ComfyWorker:
+        """새 작업을 보낼 서버. 건강한 서버가 없으면 ComfyUIError를 냅니다."""
+        candidates = [worker for worker in self.workers if worker.healthy and worker.client.connected] \
+            or [worker for worker in self.workers if worker.healthy]
+        if not candidates:
+            raise ComfyUIError("사용 가능한 ComfyUI 서버가 없습니다.")
+
+        def cost(worker):
+            switch = 0.0 if checkpoint is None or worker.checkpoint in (None, checkpoint) else self.checkpoint_penalty
+            # 부하가 같으면 작업을 더 빨리 끝내 온 서버를 고릅니다.
+            return worker.load + switch, worker.mean_job_seconds or 0.0
+
+        return min(candidates, key=cost)
+
+    async def submit(self, workflow: dict, on_event=None) -> ComfyJob:
+        checkpoint = self._checkpoint(workflow)
+        worker = self.pick(checkpoint)
+        worker.in_flight += 1
+        try:
+            job = await worker.client.submit(workflow, on_event)
+        except BaseException:
+            worker.in_flight -= 1
+            raise
+        worker.checkpoint = checkpoint or worker.checkpoint
+        self._job_workers[job.prompt_id] = worker
+        return job
+
+    def _worker(self, job_or_prompt_id) -> ComfyWorker:
+        prompt_id = getattr(job_or_prompt_id, "prompt_id", job_or_prompt_id)
+        worker = self._job_workers.get(prompt_id)
+        if worker is None:
+            raise ComfyUIError("알 수 없는 작업입니다.")
+        return worker
+
+    async def wait(self, job: ComfyJob) -> ComfyJob:
+        worker = self._worker(job)
+        try:
+            result = await worker.client.wait(job)
+        except GenerationCancelled:
+            raise
+        except BaseException:
+            worker.failed += 1
+            raise
+        else:
+            worker.completed += 1
+            worker.images += len(result.images())
+            worker.busy_seconds += time.monotonic() - job.created_at
+            COMFYUI_WORKER_IMAGES.inc(len(result.images()), worker=worker.address)
+            return result
+        finally:
+            worker.in_flight -= 1
+            self._job_workers.pop(job.prompt_id, None)
+
+    async def cancel(self, job: ComfyJob):
+        """작업을 취소합니다. 이미 끝났거나 모르는 작업이면 아무것도 하지 않습니다."""
+        worker = self._job_workers.get(job.prompt_id)
+        if worker is not None:
+            await worker.client.cancel(job)
+
+    async def queue_position(self, prompt_id: str):
+        worker = self._job_workers.get(prompt_id)
+        if worker is None:
+            return None
+        return await worker.client.queue_position(prompt_id)
+
+    async def queue_prompt(self, workflow: dict, on_event=None) -> list:
+        job = await self.submit(workflow, on_event)
+        return (await self.wait(job)).images()
+
+    def stats(self) -> dict:
+        return {worker.address: worker.stats() for worker in self.workers}
+
+
+_pools = weakref.WeakSet()
+
+
+def _collect_worker_metrics():
+    for pool in list(_pools):
+        for worker in pool.workers:
+            COMFYUI_WORKER_LOAD.set(worker.load, worker=worker.address)
+            COMFYUI_WORKER_HEALTHY.set(1 if worker.healthy else 0, worker=worker.address)
+
+
+REGISTRY.add_collector(_collect_worker_metrics)
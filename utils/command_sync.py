@@ -0,0 +1,38 @@
+import hashlib
+import json
+import os
+
+from utils.log import get_logger
+
+log = get_logger("command_sync")
+
+
+def command_tree_hash(tree) -> str:
+    """등록된 전역 슬래시 커맨드를 Discord에 보낼 형태로 직렬화해 해시합니다."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: c["name"])
+    data = json.dumps([tree.client.application_id, payload], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+async def sync_command_tree(tree, path: str = None, force: bool = False) -> bool:
+    """
+    커맨드 트리가 마지막으로 동기화한 것과 다를 때만 tree.sync()를 호출합니다.
+    마지막 해시는 path(COMMAND_SYNC_STATE)에 저장합니다. 동기화했으면 True를 반환합니다.
+    """
+    path = path or os.getenv("COMMAND_SYNC_STATE", ".command_tree_hash")
+    digest = command_tree_hash(tree)
+    if not force:
+        try:
+            with open(path, encoding="utf-8") as f:
+                if f.read().strip() == digest:
+                    return False
+        except OSError:
+            pass
+
+    await tree.sync()
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(digest)
+    except OSError as e:
+        log.warning("hash.save_failed", path=path, error=str(e))
+    return True
@@ -0,0 +1,83 @@
+import asyncio
+
+import discord
+
+from utils.log import get_logger
+
+log = get_logger("conversation")
+
+
+class ConversationGate:
+    """
+    대화(사용자)별로 턴을 하나씩 직렬화합니다.
+
+    coalesce=True이면 생성이 진행 중일 때 들어온 메시지는 따로 처리하지 않고 모아 두었다가,
+    현재 턴이 끝나면 하나의 다음 턴으로 합쳐서 handler에 넘깁니다.
+    앞 턴이 예외로 끝나도 모아 둔 메시지(이미 📝로 받았다고 알린 메시지)는 버리지 않고 처리합니다.
+    """
+
+    def __init__(self, coalesce: bool = False):
+        self.coalesce = coalesce
+        self._locks = {}    # key -> asyncio.Lock
+        self._users = {}    # key -> 잠금을 쓰거나 기다리는 코루틴 수
+        self._pending = {}  # key -> 합쳐질 항목 목록
+        self.coalesced = 0
+
+    def busy(self, key) -> bool:
+        return key in self._locks and self._locks[key].locked()
+
+    async def run(self, key, item, handler) -> bool:
+        """
+        handler([item, ...])를 key마다 하나씩 실행합니다.
+        다음 턴에 합쳐지도록 보류되었으면 False를 반환합니다.
+        """
+        if self.coalesce and self.busy(key):
+            self._pending.setdefault(key, []).append(item)
+            self.coalesced += 1
+            return False
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                error = None
+                try:
+                    await handler([item])
+                except Exception as e:
+                    error = e
+                # 처리하는 동안 모인 메시지는 하나의 턴으로 합쳐서 이어서 처리합니다.
+                while self._pending.get(key):
+                    items = self._pending.pop(key)
+                    try:
+                        await handler(items)
+                    except Exception:
+                        # 합쳐진 메시지를 보낸 호출은 이미 끝났으므로 여기서 기록만 합니다.
+                        log.exception("turn.failed", key=str(key), items=len(items))
+                if error is not None:
+                    raise error
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+                self._pending.pop(key, None)
+        return True
+
+
+def merge_turn_items(items):
+    """
+    (메시지, 프롬프트, 이미지) 목록을 하나로 합칩니다.
+    답장은 마지막 메시지에 보내고, 프롬프트는 줄바꿈으로 잇고, 이미지는 마지막 것을 씁니다.
+    """
+    message = items[-1][0]
+    prompt = "\n".join(prompt for _, prompt, _ in items if prompt)
+    images = [image for _, _, image in items if image is not None]
+    return message, prompt, images[-1] if images else None
+
+
+async def acknowledge_coalesced(message):
+    """다음 턴으로 합쳐진 메시지에 반응을 달아 받았다는 것을 알립니다."""
+    try:
+        await message.add_reaction("📝")
+    except discord.HTTPException:
+        pass
@@ -0,0 +1,9 @@
+import os
+
+# 시작할 때 함께 불러올 확장 (Cogs 아래 모듈 이름, 쉼표로 구분)
+DEFAULT_EXTENSIONS = "ChatOllama,ChatGemini,ImageGen"
+
+
+def autoload_extensions() -> list:
+    """시작할 때 불러올 확장 이름 목록 (AUTOLOAD_COGS, 빈 문자열이면 없음)."""
+    return [name.strip() for name in os.getenv("AUTOLOAD_COGS", DEFAULT_EXTENSIONS).split(",") if name.strip()]
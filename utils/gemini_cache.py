@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from utils.log import get_logger
+
+log = get_logger("gemini_cache")
+
+
+class _CacheEntry:
+    __slots__ = ("name", "digest", "prefix_len", "expire_at", "tokens")
+
+    def __init__(self, name, digest, prefix_len, expire_at, tokens):
+        self.name = name
+        self.digest = digest
+        self.prefix_len = prefix_len
+        self.expire_at = expire_at
+        self.tokens = tokens
+
+
+class GeminiContextCache:
+    """
+    Gemini cachedContents로 페르소나(system_instruction)와 대화 앞부분을 캐싱합니다.
+
+    - 대화별 항목: system_instruction + messages[:prefix_len]. 대화가 충분히 길어지면 새로 만듭니다.
+    - 페르소나 항목: system_instruction만. 여러 사용자가 공유합니다.
+    - 항목 생성/연장/삭제는 백그라운드에서 하므로 응답 지연에 더해지지 않습니다.
+    - 모델 최소 토큰 수에 못 미치거나 API가 캐싱을 거부하면(400/403) TTL 동안 시도하지 않고 인라인으로 보냅니다.
+      한도 초과(429)나 서버 오류(5xx)는 일시적이므로 retry_backoff초 뒤에 다시 시도합니다.
+    - 대화별 항목은 최대 max_conversations개까지만 두고, 가장 오래 쓰이지 않은 항목부터 삭제합니다.
+    """
+
+    def __init__(self, session, api_base: str, api_key: str, model: str, estimate_tokens,
+                 ttl: int = 900, min_tokens: int = 1024, refresh_margin: int = 120, max_conversations: int = 1000,
+                 retry_backoff: float = 60.0):
+        self.session = session
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.estimate_tokens = estimate_tokens  # (message) -> int
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.refresh_margin = refresh_margin
+        self.max_conversations = max_conversations
+        self.retry_backoff = retry_backoff
+        self._conversations = OrderedDict()  # key -> _CacheEntry (최근에 쓴 순서)
+        self._personas = {}       # digest -> _CacheEntry
+        self._rejected = {}       # digest -> 다시 시도할 시각
+        self._tasks = {}          # 진행 중인 생성 작업 (digest -> Task)
+        self.requests = 0
+        self.cached_tokens = 0
+        self.prompt_tokens = 0
+
+    # ---- 내부 헬퍼 ----
+
+    @staticmethod
+    def _digest(system_text, messages) -> str:
+        data = json.dumps([system_text, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _valid(self, entry) -> bool:
+        return entry is not None and entry.expire_at > time.monotonic()
+
+    def _spawn(self, digest, coro):
+        if digest in self._tasks:
+            coro.close()
+            return
+        task = asyncio.create_task(coro)
+        self._tasks[digest] = task
+        task.add_done_callback(lambda _: self._tasks.pop(digest, None))
+
+    async def _create(self, digest, system_text, messages):
+        body = {
+            "model": f"models/{self.model}",
+            "systemInstruction": {"parts": [{"text": system_text}]},
+            "ttl": f"{self.ttl}s",
+        }
+        if messages:
+            body["contents"] = messages
+        url = f"{self.api_base}/cachedContents?key={self.api_key}"
+        try:
+            async with self.session.post(url, json=body) as resp:
+                if resp.status in (400, 403):
+                    # 최소 토큰 미달, 모델 미지원 등. 같은 내용으로는 TTL 동안 다시 시도하지 않습니다.
+                    log.warning("create.rejected", status=resp.status, body=await resp.text())
+                    self._rejected[digest] = time.monotonic() + self.ttl
+                    return None
+                if resp.status != 200:
+                    # 429, 5xx 등 일시적인 실패는 잠깐만 쉬었다가 다시 시도합니다.
+                    log.warning("create.unavailable", status=resp.status, retry_in=self.retry_backoff)
+                    self._rejected[digest] = time.monotonic() + self.retry_backoff
+                    return None
+                data = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("create.failed", error=str(e) or type(e).__name__)
+            return None
+        tokens = data.get("usageMetadata", {}).get("totalTokenCount", 0)
+        return _CacheEntry(data["name"], digest, len(messages), time.monotonic() + self.ttl, tokens)
+
+    async def _create_conversation(self, key, digest, system_text, messages):
+        entry = await self._create(digest, system_text, messages)
+        if entry is None:
+            return
+        old = self._conversations.pop(key, None)
+        self._conversations[key] = entry
+        stale = [old] if old is not None else []
+        while len(self._conversations) > self.max_conversations:
+            stale.append(self._conversations.popitem(last=False)[1])
+        for evicted in stale:
+            await self._delete(evicted.name)
+
+    async def _create_persona(self, digest, system_text):
+        entry = await self._create(digest, system_text, [])
+        if entry is not None:
+            self._personas[digest] = entry
+
+    async def _refresh(self, entry):
+        url = f"{self.api_base}/{entry.name}?updateMask=ttl&key={self.api_key}"
+        try:
+            async with self.session.patch(url, json={"ttl": f"{self.ttl}s"}) as resp:
+                if resp.status == 200:
+                    entry.expire_at = time.monotonic() + self.ttl
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("refresh.failed", error=str(e) or type(e).__name__)
+
+    async def _delete(self, name):
+        try:
+            async with self.session.delete(f"{self.api_base}/{name}?key={self.api_key}"):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass  # TTL이 지나면 서버에서 어차피 삭제됩니다.
+
+    def _keep_alive(self, entry):
+        if entry.expire_at - time.monotonic() < self.refresh_margin:
+            self._spawn(f"refresh:{entry.name}", self._refresh(entry))
+
+    def _schedule_conversation(self, key, system_text, messages):
+        tokens = sum(self.estimate_tokens(m) for m in messages) + len(system_text) // 2
+        if tokens < self.min_tokens:
+            return
+        now = time.monotonic()
+        for rejected in [d for d, retry_at in self._rejected.items() if retry_at <= now]:
+            del self._rejected[rejected]
+        digest = self._digest(system_text, messages)
+        if self._rejected.get(digest, 0) > now:
+            return
+        self._spawn(digest, self._create_conversation(key, digest, system_text, list(messages)))
+
+    # ---- 진입점 ----
+
+    def prepare(self, key, system_text, messages):
+        """
+        이번 요청에 쓸 (cachedContent 이름 또는 None, 캐시에 포함된 메시지 수)를 반환합니다.
+        필요하면 다음 턴을 위한 캐시 생성/연장을 백그라운드로 예약합니다.
+        """
+        entry = self._conversations.get(key)
+        if self._valid(entry) and entry.prefix_len <= len(messages) \
+                and self._digest(system_text, messages[:entry.prefix_len]) == entry.digest:
+            self._conversations.move_to_end(key)
+            self._keep_alive(entry)
+            # 캐시 이후에 쌓인 기록이 다시 최소 토큰 수를 넘으면 더 긴 앞부분으로 교체합니다.
+            tail = sum(self.estimate_tokens(m) for m in messages[entry.prefix_len:])
+            if tail >= self.min_tokens:
+                self._schedule_conversation(key, system_text, messages)
+            return entry.name, entry.prefix_len
+
+        if entry is not None:
+            # 대화가 초기화/압축되었거나 만료되었습니다.
+            del self._conversations[key]
+            self._spawn(f"delete:{entry.name}", self._delete(entry.name))
+        self._schedule_conversation(key, system_text, messages)
+
+        persona_digest = self._digest(system_text, [])
+        persona = self._personas.get(persona_digest)
+        if self._valid(persona):
+            self._keep_alive(persona)
+            return persona.name, 0
+        if len(system_text) // 2 >= self.min_tokens and self._rejected.get(persona_digest, 0) <= time.monotonic():
+            self._spawn(persona_digest, self._create_persona(persona_digest, system_text))
+        return None, 0
+
+    def invalidate(self, name):
+        """API가 캐시 사용을 거부했을 때 해당 항목을 버립니다."""
+        for entries in (self._conversations, self._personas):
+            for key, entry in list(entries.items()):
+                if entry.name == name:
+                    del entries[key]
+
+    def record(self, usage: dict) -> dict:
+        """응답의 usageMetadata를 누적하고 이번 요청의 (캐시/신규) 토큰 수를 반환합니다."""
+        prompt = usage.get("promptTokenCount", 0)
+        cached = usage.get("cachedContentTokenCount", 0)
+        self.requests += 1
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        return {"cached": cached, "fresh": prompt - cached}
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "entries": len(self._conversations) + len(self._personas),
+        }
+
+    async def close(self):
+        """진행 중인 작업을 멈추고 만든 캐시 항목을 삭제합니다."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        entries = list(self._conversations.values()) + list(self._personas.values())
+        self._conversations.clear()
+        self._personas.clear()
+        await asyncio.gather(*(self._delete(entry.name) for entry in entries), return_exceptions=True)
@@ -0,0 +1,202 @@
+import asyncio
+
+from utils.log import get_logger
+
+log = get_logger("history")
+
+
+SUMMARY_PREFIX = "[이전 대화 요약]\n"
+SUMMARY_INSTRUCTION = (
+    "다음은 사용자와 어시스턴트가 나눈 이전 대화입니다. "
+    "이후 대화를 이어가는 데 필요한 사실, 약속, 사용자 정보만 간결하게 한국어로 요약하세요. "
+    "이전 요약이 주어지면 그 내용을 합쳐서 하나의 요약으로 만드세요."
+)
+IMAGE_PLACEHOLDER = "(이전 이미지 생략)"
+
+
+def parse_model_budgets(value: str) -> dict:
+    """"모델=토큰,모델=토큰" 형식의 문자열을 {모델: 토큰} 사전으로 변환합니다."""
+    budgets = {}
+    for item in (value or "").split(","):
+        name, sep, tokens = item.strip().rpartition("=")
+        if sep and name and tokens.strip().isdigit():
+            budgets[name] = int(tokens)
+    return budgets
+
+
+class HistoryManager:
+    """
+    대화 기록(state["messages"])을 토큰 예산 안으로 유지합니다.
+
+    - fmt="ollama": {"role", "content", "images"} 형식. 맨 앞의 system 메시지(페르소나)는 고정합니다.
+    - fmt="gemini": {"role", "parts"} 형식. 페르소나는 system_instruction으로 따로 전달됩니다.
+
+    예산을 넘으면 오래된 턴부터 잘라내고, 잘라낸 턴은 백그라운드에서 summarizer로
+    요약해 state["summary"]에 누적합니다. 오래된 턴의 이미지 데이터는 제거합니다.
+    """
+
+    def __init__(self, fmt: str, token_budget: int = 6000, model_budgets: dict = None,
+                 image_turns: int = 2, min_recent: int = 4, summarizer=None,
+                 chars_per_token: float = 2.0, image_tokens: int = 258, on_update=None):
+        # summarizer: async (model, previous_summary, transcript) -> str
+        # on_update: (key, state) -> None, 백그라운드 요약이 상태를 바꿨을 때 호출됩니다.
+        self.fmt = fmt
+        self.token_budget = token_budget
+        self.model_budgets = model_budgets or {}
+        self.image_turns = image_turns
+        self.min_recent = min_recent
+        self.summarizer = summarizer
+        self.on_update = on_update
+        # 한국어는 영어보다 글자당 토큰 수가 많으므로 보수적으로 잡습니다.
+        self.chars_per_token = chars_per_token
+        self.image_tokens = image_tokens
+        self._tasks = {}  # key -> 요약 작업
+
+    # ---- 메시지 형식별 접근자 ----
+
+    def _text(self, message) -> str:
+        if self.fmt == "ollama":
+            return message.get("content", "")
+        return "".join(part.get("text", "") for part in message.get("parts", []))
+
+    def _image_count(self, message) -> int:
+        if self.fmt == "ollama":
+            return len(message.get("images", ()))
+        return sum(1 for part in message.get("parts", []) if "inline_data" in part)
+
+    def _strip_images(self, message):
+        if self.fmt == "ollama":
+            message.pop("images", None)
+        else:
+            message["parts"] = [
+                {"text": IMAGE_PLACEHOLDER} if "inline_data" in part else part
+                for part in message["parts"]
+            ]
+
+    def _pinned(self, messages) -> int:
+        """앞에서부터 고정할 메시지 수 (페르소나/요약 system 메시지)."""
+        count = 0
+        for message in messages:
+            if message.get("role") != "system":
+                break
+            count += 1
+        return count
+
+    # ---- 토큰 추정 ----
+
+    def estimate_tokens(self, message) -> int:
+        # 문자열 길이는 O(1)이므로 매 턴 다시 계산해도 부담이 없습니다.
+        text_tokens = int(len(self._text(message)) / self.chars_per_token)
+        return text_tokens + self._image_count(message) * self.image_tokens + 4
+
+    def budget_for(self, model) -> int:
+        return self.model_budgets.get(model, self.token_budget)
+
+    # ---- 요약 ----
+
+    def system_text(self, persona: str, state) -> str:
+        """Gemini의 system_instruction에 쓸 페르소나 + 요약 텍스트."""
+        summary = state.get("summary")
+        return f"{persona}\n\n{SUMMARY_PREFIX}{summary}" if summary else persona
+
+    def _apply_summary(self, state):
+        """Ollama 형식에서는 요약을 페르소나 바로 뒤의 system 메시지로 유지합니다."""
+        if self.fmt != "ollama":
+            return
+        messages = state["messages"]
+        summary = state.get("summary")
+        index = 1 if messages and messages[0].get("role") == "system" else 0
+        has_summary = (
+            len(messages) > index
+            and messages[index].get("role") == "system"
+            and messages[index].get("content", "").startswith(SUMMARY_PREFIX)
+        )
+        if summary:
+            summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+            if has_summary:
+                messages[index] = summary_message
+            else:
+                messages.insert(index, summary_message)
+        elif has_summary:
+            del messages[index]
+
+    def _transcript(self, messages) -> str:
+        return "\n".join(f"{m.get('role')}: {self._text(m)}" for m in messages)
+
+    async def _summarize_loop(self, key, state, model):
+        epoch = state.get("history_epoch", 0)
+        while state.get("summary_pending"):
+            pending = state["summary_pending"]
+            state["summary_pending"] = []
+            try:
+                summary = await self.summarizer(model, state.get("summary", ""), "\n".join(pending))
+            except Exception as e:
+                log.warning("summary.failed", model=model, error=str(e))
+                # 다음 압축 때 다시 시도하되, 쌓인 원문이 끝없이 커지지 않도록 자릅니다.
+                limit = int(self.budget_for(model) * self.chars_per_token)
+                state["summary_pending"] = ["\n".join(pending + state["summary_pending"])[-limit:]]
+                return
+            if state.get("history_epoch", 0) != epoch:
+                return  # 요약하는 동안 대화가 초기화되었습니다.
+            if summary:
+                state["summary"] = summary.strip()
+                self._apply_summary(state)
+                if self.on_update is not None:
+                    self.on_update(key, state)
+
+    def _schedule_summary(self, key, state, model):
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return  # 진행 중인 작업이 새로 쌓인 내용까지 이어서 요약합니다.
+        task = asyncio.create_task(self._summarize_loop(key, state, model))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+
+    # ---- 진입점 ----
+
+    def reset(self, state, messages=None):
+        """대화 기록과 요약을 초기화합니다."""
+        state["messages"] = messages if messages is not None else []
+        state["summary"] = ""
+        state["summary_pending"] = []
+        state["history_epoch"] = state.get("history_epoch", 0) + 1
+
+    def prepare(self, state, model, key=None):
+        """
+        요청을 보내기 전에 호출합니다. 오래된 이미지를 지우고, 예산을 넘으면
+        오래된 턴을 잘라 백그라운드 요약 대상으로 넘깁니다.
+        """
+        messages = state["messages"]
+
+        # 최근 image_turns개의 사용자 턴을 제외한 나머지에서 이미지 데이터를 제거합니다.
+        user_turns = 0
+        for message in reversed(messages):
+            if message.get("role") != "user":
+                continue
+            user_turns += 1
+            if user_turns > self.image_turns and self._image_count(message):
+                self._strip_images(message)
+
+        budget = self.budget_for(model)
+        total = sum(self.estimate_tokens(m) for m in messages)
+        if total <= budget:
+            return
+
+        # 매 턴 압축하지 않도록 예산의 3/4까지 줄입니다.
+        target = budget * 3 // 4
+        pinned = self._pinned(messages)
+        cut = pinned
+        while total > target and len(messages) - cut > self.min_recent:
+            total -= self.estimate_tokens(messages[cut])
+            cut += 1
+        # 남은 기록이 항상 사용자 턴으로 시작하도록 맞춥니다 (Gemini는 필수).
+        while cut < len(messages) - 1 and messages[cut].get("role") != "user":
+            cut += 1
+        if cut == pinned:
+            return
+
+        dropped = messages[pinned:cut]
+        del messages[pinned:cut]
+        if self.summarizer is not None:
+            state.setdefault("summary_pending", []).append(self._transcript(dropped))
+            self._schedule_summary(key if key is not None else id(state), state, model)
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+import weakref
+
+import aiohttp
+
+from utils.log import get_logger
+from utils.metrics import HTTP_CONNECTIONS, HTTP_POOL_CONNECTIONS, HTTP_POOL_WAIT, HTTP_POOL_WAITERS, REGISTRY
+
+log = get_logger("http")
+
+# 백엔드별 기본값. 시간은 초이며 total=0은 전체 시간 제한 없음(긴 스트리밍 응답)을 뜻합니다.
+#  - connect: TCP/TLS 연결, read: 응답 조각 사이 최대 간격, total: 요청 전체
+#  - Ollama는 모델을 불러오는 동안 첫 토큰까지 오래 걸릴 수 있어 read를 넉넉히 둡니다.
+#  - ComfyUI 웹소켓은 따로 heartbeat로 관리하므로 total을 두지 않습니다.
+BACKEND_DEFAULTS = {
+    "ollama": {"pool_size": 8, "connect": 5.0, "read": 300.0, "total": 0.0, "keepalive": 30.0},
+    "gemini": {"pool_size": 16, "connect": 10.0, "read": 60.0, "total": 300.0, "keepalive": 60.0},
+    "comfyui": {"pool_size": 8, "connect": 5.0, "read": 120.0, "total": 0.0, "keepalive": 30.0},
+}
+DEFAULT_OPTIONS = {"pool_size": 8, "connect": 10.0, "read": 60.0, "total": 300.0, "keepalive": 30.0}
+
+_managers = weakref.WeakSet()
+
+
+def backend_options(backend: str) -> dict:
+    """
+    기본값에 HTTP_<BACKEND>_POOL_SIZE, _CONNECT_TIMEOUT, _READ_TIMEOUT, _TOTAL_TIMEOUT, _KEEPALIVE
+    환경 변수를 덮어쓴 설정.
+    """
+    options = dict(BACKEND_DEFAULTS.get(backend, DEFAULT_OPTIONS))
+    prefix = "HTTP_" + "".join(c if c.isalnum() else "_" for c in backend.upper())
+    for key, env in (("pool_size", "POOL_SIZE"), ("connect", "CONNECT_TIMEOUT"), ("read", "READ_TIMEOUT"),
+                     ("total", "TOTAL_TIMEOUT"), ("keepalive", "KEEPALIVE")):
+        value = os.getenv(f"{prefix}_{env}")
+        if value:
+            options[key] = type(options[key])(value)
+    return options
+
+
+def _trace_config(backend: str) -> aiohttp.TraceConfig:
+    """풀 대기 시간과 새 연결/재사용 연결 수를 메트릭으로 남깁니다."""
+    async def on_queued_start(session, context, params):
+        context.queued_at = time.perf_counter()
+
+    async def on_queued_end(session, context, params):
+        HTTP_POOL_WAIT.observe(time.perf_counter() - context.queued_at, backend=backend)
+
+    async def on_create_end(session, context, params):
+        HTTP_CONNECTIONS.inc(backend=backend, kind="new")
+
+    async def on_reuse(session, context, params):
+        HTTP_CONNECTIONS.inc(backend=backend, kind="reused")
+
+    config = aiohttp.TraceConfig()
+    config.on_connection_queued_start.append(on_queued_start)
+    config.on_connection_queued_end.append(on_queued_end)
+    config.on_connection_create_end.append(on_create_end)
+    config.on_connection_reuseconn.append(on_reuse)
+    return config
+
+
+class HttpClients:
+    """
+    백엔드(ollama, gemini, comfyui)마다 하나의 ClientSession을 만들어 여러 Cog가 빌려 쓰게 합니다.
+
+    세션마다 연결 풀(호스트당 pool_size개), keep-alive, DNS 캐시, 백엔드별 타임아웃을 두므로
+    멈춘 스트림이나 다운로드가 연결을 영원히 붙잡지 않습니다. Cog는 세션을 닫지 않고,
+    봇이 종료될 때 close()가 한 번에 닫습니다.
+    """
+
+    def __init__(self, dns_cache_ttl: int = 300):
+        self.dns_cache_ttl = dns_cache_ttl
+        self._sessions = {}  # 백엔드 이름 -> ClientSession
+        _managers.add(self)
+
+    def session(self, backend: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(backend)
+        if session is None or session.closed:
+            session = self._sessions[backend] = self._create(backend)
+        return session
+
+    def _create(self, backend: str) -> aiohttp.ClientSession:
+        options = backend_options(backend)
+        # 한도는 호스트마다 둡니다 (ComfyUI처럼 같은 백엔드 서버가 여럿일 수 있음).
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=options["pool_size"],
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=options["keepalive"],
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=options["total"] or None,
+            sock_connect=options["connect"],
+            sock_read=options["read"] or None,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[_trace_config(backend)])
+
+    async def warm(self, backend: str, url: str):
+        """
+        연결(TLS 포함)을 미리 하나 열어 풀에 넣어 둡니다. 첫 사용자 요청이 핸드셰이크를 기다리지 않게 하며,
+        실패해도 무시합니다.
+        """
+        try:
+            async with self.session(backend).get(url) as resp:
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("warm.failed", backend=backend, error=str(e) or type(e).__name__)
+
+    def stats(self) -> dict:
+        """백엔드별 연결 풀 상태 (사용 중, 유휴, 대기 중인 요청, 호스트당 한도)."""
+        result = {}
+        for backend, session in self._sessions.items():
+            connector = session.connector
+            if connector is None or session.closed:
+                continue
+            result[backend] = {
+                "in_use": len(getattr(connector, "_acquired", ())),
+                "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+                "waiters": sum(len(waiters) for waiters in getattr(connector, "_waiters", {}).values()),
+                "limit": connector.limit_per_host,
+            }
+        return result
+
+    async def close(self):
+        sessions, self._sessions = list(self._sessions.values()), {}
+        await asyncio.gather(*(session.close() for session in sessions))
+
+
+def _collect_pool_metrics():
+    for manager in list(_managers):
+        for backend, info in manager.stats().items():
+            for state in ("in_use", "idle", "limit"):
+                HTTP_POOL_CONNECTIONS.set(info[state], backend=backend, state=state)
+            HTTP_POOL_WAITERS.set(info["waiters"], backend=backend)
+
+
+REGISTRY.add_collector(_collect_pool_metrics)
+
+
+def get_http_clients(bot) -> HttpClients:
+    """봇에 하나뿐인 HTTP 클라이언트 관리자를 가져옵니다 (HTTP_DNS_CACHE_TTL)."""
+    clients = getattr(bot, "http_clients", None)
+    if clients is None:
+        clients = bot.http_clients = HttpClients(dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", "300")))
+    return clients
+
+
+async def close_http_clients(bot):
+    """봇 종료 시 모든 세션을 닫습니다. Cog가 모두 내려간 뒤에 호출해야 합니다."""
+    clients = getattr(bot, "http_clients", None)
+    if clients is not None:
+        bot.http_clients = None
+        await clients.close()
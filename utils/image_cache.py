@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from utils.log import get_logger
+from utils.metrics import IMAGE_CACHE_REQUESTS
+
+log = get_logger("image_cache")
+
+SUFFIX = ".img"
+# 쓴 프로세스가 살아 있는지 알 수 없는 임시 파일도 이만큼 지나면 중단된 것으로 보고 지웁니다.
+STALE_TMP_SECONDS = 3600
+
+
+class ImageCache:
+    """
+    생성된 이미지를 디스크에 저장하는 LRU 캐시.
+
+    - 키는 (템플릿 해시, 매개변수, 프롬프트, seed)의 sha256이라 같은 조합을 다시 요청하면 생성 없이 바로 돌려줍니다.
+    - 전체 크기가 max_bytes를 넘으면 가장 오래 쓰지 않은 파일부터 지웁니다. 사용 순서는 파일 mtime으로 남겨
+      재시작 후에도 이어집니다.
+    - 파일 읽기/쓰기는 스레드에서 실행해 이벤트 루프를 막지 않으며, 임시 파일에 쓴 뒤 이름을 바꿔 원자적으로 저장합니다.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> 파일 크기 (오래 쓰지 않은 순)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        """JSON으로 직렬화할 수 있는 값들로 캐시 키를 만듭니다."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(SUFFIX)], stat.st_size))
+            elif entry.name.endswith(".tmp") and _abandoned(entry):
+                try:
+                    os.unlink(entry.path)  # 쓰다가 중단된 파일
+                except FileNotFoundError:
+                    pass  # 다른 워커가 먼저 지웠습니다.
+        return sorted(entries)
+
+    async def load(self):
+        """디렉터리의 기존 파일을 읽어 LRU 순서를 복원하고, 한도를 넘으면 정리합니다."""
+        for _, key, size in await asyncio.to_thread(self._scan):
+            self._entries[key] = size
+            self.total_bytes += size
+        await self._evict()
+        log.info("image_cache.loaded", directory=self.directory, entries=len(self._entries), bytes=self.total_bytes)
+
+    def _read(self, key: str):
+        path = self._path(key)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # 재시작 후에도 LRU 순서가 유지되도록 합니다.
+        return data
+
+    async def get(self, key: str):
+        """저장된 이미지 바이트 또는 None."""
+        if key not in self._entries:
+            self.misses += 1
+            IMAGE_CACHE_REQUESTS.inc(result="miss")
+            return None
+        try:
+            data = await asyncio.to_thread(self._read, key)
+        except OSError as e:
+            log.warning("image_cache.read_failed", key=key, error=str(e))
+            self._forget(key)
+            self.misses += 1
+            IMAGE_CACHE_REQUESTS.inc(result="miss")
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        IMAGE_CACHE_REQUESTS.inc(result="hit")
+        return data
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    async def put(self, key: str, data: bytes):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        try:
+            await asyncio.to_thread(self._write, key, data)
+        except OSError as e:
+            log.warning("image_cache.write_failed", key=key, error=str(e))
+            return
+        self._forget(key)
+        self._entries[key] = len(data)
+        self.total_bytes += len(data)
+        await self._evict()
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    async def _evict(self):
+        victims = []
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            victims.append(self._path(key))
+        if victims:
+            await asyncio.to_thread(_unlink_all, victims)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def _unlink_all(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _abandoned(entry) -> bool:
+    """
+    {path}.{pid}.tmp 임시 파일을 쓰던 프로세스가 끝났는지 여부.
+    워커 여럿이 같은 디렉터리를 쓰므로 다른 워커가 쓰는 중인 파일은 남겨 둡니다.
+    """
+    try:
+        if time.time() - entry.stat().st_mtime > STALE_TMP_SECONDS:
+            return True
+        pid = int(entry.name[:-len(".tmp")].rsplit(".", 1)[-1])
+    except (OSError, ValueError):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass  # 권한이 없어도 프로세스는 살아 있습니다.
+    return False
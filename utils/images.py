@@ -0,0 +1,171 @@
+import asyncio
+import base64
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# 모델에 그대로 보내도 되는 형식
+PASSTHROUGH_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+class ImageRejected(Exception):
+    """첨부 이미지를 처리할 수 없을 때 발생합니다. 메시지는 사용자에게 그대로 보여줍니다."""
+
+
+class ProcessedImage:
+    __slots__ = ("data", "mime_type", "digest", "size")
+
+    def __init__(self, data: str, mime_type: str, digest: str, size: int):
+        self.data = data            # base64 문자열
+        self.mime_type = mime_type  # 실제 인코딩된 형식
+        self.digest = digest        # 원본 sha256
+        self.size = size            # 인코딩된 바이트 수
+
+
+class ImagePipeline:
+    """
+    첨부 이미지를 모델에 보내기 좋은 크기로 줄이고 다시 인코딩합니다.
+
+    - 다운로드 전에 Discord 첨부파일 메타데이터(size, content_type)로 크기 제한을 확인합니다.
+    - 디코딩/축소/인코딩은 스레드 풀에서 실행해 이벤트 루프를 막지 않습니다.
+    - 같은 내용의 이미지는 sha256으로 식별해 한 번만 처리합니다.
+    """
+
+    def __init__(self, max_download_bytes: int = 20 * 1024 * 1024, max_side: int = 1024,
+                 passthrough_bytes: int = 512 * 1024, quality: int = 85, cache_size: int = 128,
+                 max_workers: int = 2):
+        self.max_download_bytes = max_download_bytes
+        self.max_side = max_side
+        self.passthrough_bytes = passthrough_bytes
+        self.quality = quality
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (digest, max_side) -> ProcessedImage
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-pipeline")
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(self, raw: bytes, max_side: int):
+        """스레드 풀에서 실행됩니다. (인코딩된 바이트, MIME 타입)을 반환합니다."""
+        try:
+            with Image.open(BytesIO(raw)) as img:
+                mime_type = Image.MIME.get(img.format)
+                if (mime_type in PASSTHROUGH_MIME_TYPES and len(raw) <= self.passthrough_bytes
+                        and max(img.size) <= max_side and not getattr(img, "is_animated", False)):
+                    return raw, mime_type
+
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+                if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                    # 투명 영역은 흰 배경으로 채웁니다.
+                    img = img.convert("RGBA")
+                    background = Image.new("RGB", img.size, (255, 255, 255))
+                    background.paste(img, mask=img.getchannel("A"))
+                    img = background
+                elif img.mode != "RGB":
+                    img = img.convert("RGB")
+
+                out = BytesIO()
+                img.save(out, format="JPEG", quality=self.quality, optimize=True)
+                return out.getvalue(), "image/jpeg"
+        except Image.DecompressionBombError:
+            raise ImageRejected("이미지 해상도가 너무 큽니다.")
+        except (UnidentifiedImageError, OSError):
+            raise ImageRejected("이미지를 읽을 수 없습니다.")
+
+    def _process(self, raw: bytes, max_side: int) -> ProcessedImage:
+        digest = hashlib.sha256(raw).hexdigest()
+        cached = self._cache.get((digest, max_side))
+        if cached is not None:
+            return cached
+        data, mime_type = self._encode(raw, max_side)
+        return ProcessedImage(base64.b64encode(data).decode("ascii"), mime_type, digest, len(data))
+
+    async def process(self, attachment, max_side: int = None) -> ProcessedImage:
+        """
+        Discord 첨부파일을 처리합니다. 이미지가 아니면 None을 반환하고,
+        처리할 수 없으면 ImageRejected를 발생시킵니다.
+        """
+        if not (attachment.content_type or "").startswith("image/"):
+            return None
+        if attachment.size > self.max_download_bytes:
+            limit = self.max_download_bytes // (1024 * 1024)
+            raise ImageRejected(f"첨부 이미지가 너무 큽니다. (최대 {limit}MB)")
+
+        max_side = max_side or self.max_side
+        raw = await attachment.read()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, self._process, raw, max_side)
+
+        key = (result.digest, max_side)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+
+# 생성 이미지를 Discord에 올릴 때 쓸 수 있는 형식: 이름 -> (Pillow 형식, 확장자)
+OUTPUT_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg"), "png": ("PNG", "png")}
+
+
+class OutputEncoder:
+    """
+    ComfyUI가 만든 PNG를 업로드용 형식(WebP, 고품질 JPEG, 또는 원본 PNG)으로 바꿉니다.
+
+    - 입력은 읽기/seek가 되는 파일 객체(임시 파일, mmap)라 원본 전체를 bytes로 들고 있지 않아도 됩니다.
+    - 디코딩/인코딩은 스레드 풀에서 실행합니다. Pillow는 이 작업 동안 GIL을 놓으므로 스레드로도 병렬로 돌며,
+      max_workers가 동시에 메모리에 펼쳐지는 이미지 수의 상한이 됩니다.
+    - png는 다시 인코딩하지 않고 원본 바이트를 그대로 돌려줍니다.
+    """
+
+    def __init__(self, output_format: str = "webp", quality: int = 90, max_workers: int = 2):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"지원하지 않는 출력 형식입니다: {output_format} ({', '.join(OUTPUT_FORMATS)})")
+        self.format = output_format
+        self.quality = quality
+        self.extension = OUTPUT_FORMATS[output_format][1]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-output")
+
+    def _encode(self, source) -> bytes:
+        source.seek(0)
+        if self.format == "png":
+            return source.read()
+        with Image.open(source) as img:
+            if self.format == "jpeg" and img.mode != "RGB":
+                img = img.convert("RGB")
+            elif img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            out = BytesIO()
+            if self.format == "jpeg":
+                # 생성 이미지의 색 경계가 뭉개지지 않도록 크로마 서브샘플링을 끕니다.
+                img.save(out, format="JPEG", quality=self.quality, subsampling=0, optimize=True)
+            else:
+                img.save(out, format="WEBP", quality=self.quality, method=2)
+            return out.getvalue()
+
+    async def encode(self, source) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._encode, source)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def get_image_pipeline(bot) -> ImagePipeline:
+    """봇에 하나뿐인 이미지 파이프라인을 가져옵니다 (IMAGE_MAX_SIDE, IMAGE_MAX_DOWNLOAD_MB)."""
+    pipeline = getattr(bot, "image_pipeline", None)
+    if pipeline is None:
+        pipeline = bot.image_pipeline = ImagePipeline(
+            max_download_bytes=int(os.getenv("IMAGE_MAX_DOWNLOAD_MB", "20")) * 1024 * 1024,
+            max_side=int(os.getenv("IMAGE_MAX_SIDE", "1024")),
+        )
+    return pipeline
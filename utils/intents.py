@@ -0,0 +1,68 @@
+import importlib
+import os
+
+import discord
+
+from utils.log import get_logger
+
+log = get_logger("intents")
+
+
+# 슬래시 커맨드와 채널/길드 캐시에는 항상 필요합니다.
+BASE_INTENTS = ("guilds",)
+
+
+def declared_intents(extensions) -> set:
+    """
+    Cogs.<이름> 모듈의 REQUIRED_INTENTS를 모읍니다.
+    불러올 수 없는 확장은 건너뜁니다 (실제 로드 때 오류가 기록됩니다).
+    """
+    names = set()
+    for extension in extensions:
+        try:
+            module = importlib.import_module("Cogs." + extension)
+        except Exception as e:
+            log.error("declared.import_failed", extension=extension, error=f"{type(e).__name__}: {e}")
+            continue
+        names.update(getattr(module, "REQUIRED_INTENTS", ()))
+    return names
+
+
+def build_intents(names) -> discord.Intents:
+    intents = discord.Intents.none()
+    for name in names:
+        if name not in discord.Intents.VALID_FLAGS:
+            raise ValueError(f"알 수 없는 인텐트: {name}")
+        setattr(intents, name, True)
+    return intents
+
+
+def missing_intents(bot, extension: str) -> list:
+    """확장이 필요로 하지만 현재 연결에서 켜져 있지 않은 인텐트 목록."""
+    return sorted(name for name in declared_intents([extension]) if not getattr(bot.intents, name))
+
+
+def client_options(extensions, profile: str = None) -> dict:
+    """
+    봇 생성자에 넘길 인텐트/캐시 설정을 만듭니다 (INTENTS_PROFILE, INTENTS_EXTRA, MESSAGE_CACHE_SIZE).
+
+    - full: 예전처럼 모든 인텐트와 기본 멤버/메시지 캐시를 사용합니다.
+    - lean: 불러올 확장이 선언한 인텐트만 켜고, 멤버 캐시와 시작 시 멤버 청크 요청을 끄고,
+      메시지 캐시 크기를 제한합니다.
+    """
+    profile = profile or os.getenv("INTENTS_PROFILE", "lean")
+    if profile == "full":
+        return {"intents": discord.Intents.all()}
+    if profile != "lean":
+        raise ValueError(f"알 수 없는 INTENTS_PROFILE: {profile}")
+
+    extra = [name.strip() for name in os.getenv("INTENTS_EXTRA", "").split(",") if name.strip()]
+    intents = build_intents(set(BASE_INTENTS) | declared_intents(extensions) | set(extra))
+    max_messages = int(os.getenv("MESSAGE_CACHE_SIZE", "100"))
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": False,
+        # discord.py는 0 이하를 기본값(1000)으로 바꾸므로 끌 때는 None을 넘깁니다.
+        "max_messages": max_messages if max_messages > 0 else None,
+    }
@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+ROOT_LOGGER = "llamabot"
+
+
+def truncate(value, limit: int):
+    """긴 문자열은 앞부분만 남기고 잘린 길이를 표시합니다."""
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}…(+{len(value) - limit} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """레코드를 한 줄짜리 JSON으로 만듭니다. 필드 값 중 긴 문자열은 max_chars로 자릅니다."""
+
+    def __init__(self, max_chars: int = 500):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = truncate(value, self.max_chars)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """사람이 읽기 쉬운 key=value 형식 (LOG_FORMAT=text)."""
+
+    def __init__(self, max_chars: int = 500):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        fields = " ".join(f"{key}={truncate(value, self.max_chars)!r}"
+                          for key, value in getattr(record, "fields", {}).items())
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} " \
+               f"{record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """이벤트 이름별 비율(LOG_SAMPLE="chat.prompt=0.1,...")만큼만 남깁니다. WARNING 이상은 항상 남깁니다."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.msg)
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    이벤트 루프 쪽에서는 레코드를 큐에 넣기만 하고, 포맷과 출력은 리스너 스레드가 합니다.
+    큐가 가득 차면 기다리지 않고 레코드를 버린 뒤 버린 개수를 셉니다.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 기본 구현은 여기서 포맷까지 하므로, 예외 정보만 문자열로 바꿔 두고 나머지는 리스너에 맡깁니다.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """
+    log.info("chat.reply", user=..., chars=...)처럼 이벤트 이름과 필드로 기록하는 얇은 래퍼.
+    레벨이 꺼져 있으면 레코드를 만들지 않습니다.
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def _log(self, level, event, fields, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """llamabot.<name> 로거를 가져옵니다."""
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def _parse_rates(value: str) -> dict:
+    rates = {}
+    for part in value.split(","):
+        if "=" in part:
+            event, rate = part.split("=", 1)
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(stream=None) -> NonBlockingQueueHandler:
+    """
+    llamabot 로거에 큐 기반 핸들러를 붙이고 리스너 스레드를 시작합니다.
+    (LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_MAX_FIELD_CHARS, LOG_SAMPLE)
+    """
+    max_chars = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+    formatter = TextFormatter(max_chars) if os.getenv("LOG_FORMAT", "json") == "text" else JsonFormatter(max_chars)
+    log_file = os.getenv("LOG_FILE")
+    output = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(formatter)
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    rates = _parse_rates(os.getenv("LOG_SAMPLE", ""))
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    handler.listener = listener
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(handler)
+    root.propagate = False
+    # discord.py 로그도 같은 경로로 내보냅니다.
+    logging.getLogger("discord").addHandler(handler)
+    logging.getLogger("discord").setLevel(logging.INFO)
+    return handler
+
+
+def stop_logging(handler: NonBlockingQueueHandler):
+    """핸들러를 떼고 큐에 남은 레코드를 모두 출력한 뒤 리스너 스레드를 멈춥니다."""
+    for name in (ROOT_LOGGER, "discord"):
+        logging.getLogger(name).removeHandler(handler)
+    atexit.unregister(handler.listener.stop)
+    handler.listener.stop()
@@ -0,0 +1,277 @@
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from utils.log import get_logger
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+
+log = get_logger("metrics")
+
+# 요청마다 한 줄짜리 JSON 트레이스를 로그로 남길지 여부
+TRACE_REQUESTS = os.getenv("METRICS_TRACE", "0") == "1"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 레이블 값 튜플 -> 값
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key in sorted(self._values):
+            lines.extend(self._render_value(key, self._values[key]))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # 버킷별 개수 (마지막 칸은 +Inf), 합계
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, entry):
+        counts, total = entry
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            bucket_labels = _labels(self.labelnames, key, ['le="' + le + '"'])
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []  # render() 직전에 호출해 Gauge 값을 채우는 함수
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"이미 등록된 메트릭입니다: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.register(Histogram(
+    "llm_time_to_first_token_seconds", "Time from sending a chat request to the first streamed token.",
+    ("backend", "model")))
+LLM_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "llm_tokens_per_second", "Generation speed reported by (or measured for) the backend.",
+    ("backend", "model"), RATE_BUCKETS))
+BACKEND_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "backend_request_duration_seconds", "Duration of requests to Ollama, Gemini and ComfyUI.",
+    ("backend", "op")))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "queue_wait_seconds", "Time a request waited in a scheduler or batch queue before running.",
+    ("queue",)))
+SCHEDULER_SERVICE_TIME = REGISTRY.register(Histogram(
+    "scheduler_service_seconds", "Time a request held a chat scheduler slot (from grant to release).",
+    ("queue",)))
+PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "payload_bytes", "Request and response body sizes.", ("backend", "direction"), BYTES_BUCKETS))
+DISCORD_API_DURATION = REGISTRY.register(Histogram(
+    "discord_api_duration_seconds", "Duration of Discord message sends and edits.", ("op",)))
+ERRORS = REGISTRY.register(Counter(
+    "errors_total", "Errors by component and exception type.", ("component", "type")))
+COMFYUI_WORKER_LOAD = REGISTRY.register(Gauge(
+    "comfyui_worker_load", "Jobs running or queued on each ComfyUI worker (local in-flight or remote queue).",
+    ("worker",)))
+COMFYUI_WORKER_HEALTHY = REGISTRY.register(Gauge(
+    "comfyui_worker_healthy", "1 if the ComfyUI worker passes health checks and receives new jobs.", ("worker",)))
+COMFYUI_WORKER_IMAGES = REGISTRY.register(Counter(
+    "comfyui_worker_images_total", "Images generated per ComfyUI worker.", ("worker",)))
+OLLAMA_MODEL_EVENTS = REGISTRY.register(Counter(
+    "ollama_model_events_total", "Ollama model residency events (load, unload, preload).", ("model", "event")))
+OLLAMA_MODEL_SWAPS = REGISTRY.register(Counter(
+    "ollama_model_swaps_total", "Cold loads of a model right after a different model was used."))
+OLLAMA_MODEL_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "ollama_model_load_seconds", "load_duration reported by Ollama per request.", ("model",)))
+BACKEND_BREAKER_STATE = REGISTRY.register(Gauge(
+    "backend_breaker_state", "Circuit breaker state per chat backend (0 closed, 1 half-open, 2 open).", ("backend",)))
+BACKEND_RETRIES = REGISTRY.register(Counter(
+    "backend_retries_total", "Requests retried after a transient failure, by backend and reason.",
+    ("backend", "reason")))
+CHAT_FAILOVERS = REGISTRY.register(Counter(
+    "chat_failovers_total", "Chat turns sent to another backend after a failure, by result (ok, failed).",
+    ("source", "target", "result")))
+IMAGE_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "image_cache_requests_total", "Generated-image cache lookups by result (hit, miss).", ("result",)))
+HTTP_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    "http_pool_connections", "Connections in each backend HTTP pool by state (in_use, idle, limit).",
+    ("backend", "state")))
+HTTP_POOL_WAITERS = REGISTRY.register(Gauge(
+    "http_pool_waiters", "Requests waiting for a free connection in each backend HTTP pool.", ("backend",)))
+HTTP_POOL_WAIT = REGISTRY.register(Histogram(
+    "http_pool_wait_seconds", "Time requests waited for a connection because the pool was full.", ("backend",)))
+HTTP_CONNECTIONS = REGISTRY.register(Counter(
+    "http_connections_total", "Connections used per backend, new or reused from the keep-alive pool.",
+    ("backend", "kind")))
+
+
+def record_error(component: str, error):
+    """오류 횟수를 셉니다. error는 예외 객체 또는 종류를 나타내는 문자열입니다."""
+    ERRORS.inc(component=component, type=error if isinstance(error, str) else type(error).__name__)
+
+
+class RequestTrace:
+    """
+    백엔드 요청 하나의 계측. 첫 토큰 시간, 토큰 속도, 주고받은 바이트, 오류를 모았다가
+    finish()에서 히스토그램에 기록하고, METRICS_TRACE=1이면 request.trace 로그로 남깁니다.
+    """
+
+    def __init__(self, backend: str, op: str, model: str = ""):
+        self.backend = backend
+        self.op = op
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.tokens = None
+        self.tokens_per_second = None
+        self.error = None
+
+    def sent(self, nbytes: int):
+        self.bytes_out += nbytes
+
+    def received(self, nbytes: int):
+        self.bytes_in += nbytes
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def generated(self, tokens: int, seconds: float = None):
+        """
+        생성된 토큰 수를 기록합니다. seconds가 없으면 첫 토큰부터 지금까지의 시간으로 속도를 계산합니다.
+        """
+        if seconds is None:
+            seconds = time.perf_counter() - (self.first_token_at or self.started)
+        self.tokens = tokens
+        if tokens and seconds > 0:
+            self.tokens_per_second = tokens / seconds
+
+    def failed(self, error):
+        self.error = error if isinstance(error, str) else type(error).__name__
+
+    def finish(self):
+        duration = time.perf_counter() - self.started
+        BACKEND_REQUEST_DURATION.observe(duration, backend=self.backend, op=self.op)
+        if self.bytes_out:
+            PAYLOAD_BYTES.observe(self.bytes_out, backend=self.backend, direction="sent")
+        if self.bytes_in:
+            PAYLOAD_BYTES.observe(self.bytes_in, backend=self.backend, direction="received")
+        ttft = None
+        if self.first_token_at is not None:
+            ttft = self.first_token_at - self.started
+            LLM_TIME_TO_FIRST_TOKEN.observe(ttft, backend=self.backend, model=self.model)
+        if self.tokens_per_second is not None:
+            LLM_TOKENS_PER_SECOND.observe(self.tokens_per_second, backend=self.backend, model=self.model)
+        if self.error is not None:
+            record_error(self.backend, self.error)
+        if TRACE_REQUESTS:
+            log.info(
+                "request.trace", trace=f"{self.backend}.{self.op}", model=self.model, duration=round(duration, 4),
+                ttft=None if ttft is None else round(ttft, 4), tokens=self.tokens,
+                tokens_per_second=None if self.tokens_per_second is None else round(self.tokens_per_second, 2),
+                bytes_out=self.bytes_out, bytes_in=self.bytes_in, error=self.error,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and self.error is None:
+            self.failed(exc)
+        self.finish()
+        return False
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    """GET /metrics로 Prometheus 텍스트 형식을 제공하는 서버를 시작합니다."""
+    async def metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
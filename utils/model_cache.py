@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+
+class ModelInfoCache:
+    """
+    Ollama 모델 목록(/api/tags)과 capabilities(/api/show)를 TTL 기반으로 캐싱합니다.
+
+    - 모델 목록을 새로 받았을 때 digest가 바뀐(또는 사라진) 모델의 capabilities는 무효화합니다.
+    - 같은 키에 대한 동시 조회는 하나의 요청(in-flight)을 공유합니다.
+    - 조회 실패는 호출자에게 예외로 전달하고, failure_ttl 동안은 다시 요청하지 않고 같은 예외를 올립니다.
+      Ollama가 내려가 있을 때 턴마다 /api/tags 왕복을 기다리지 않기 위해서입니다.
+    """
+
+    def __init__(self, fetch_models, fetch_capabilities, ttl: float = 300.0, failure_ttl: float = 10.0):
+        # fetch_models: async () -> {모델 이름: digest}
+        # fetch_capabilities: async (model) -> list
+        self._fetch_models = fetch_models
+        self._fetch_capabilities = fetch_capabilities
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._models = None          # {name: digest}
+        self._models_at = 0.0
+        self._capabilities = {}      # {name: (digest, fetched_at, capabilities)}
+        self._inflight = {}          # {key: asyncio.Task}
+        self._failures = {}          # {key: (failed_at, exception)}
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, fetched_at: float) -> bool:
+        return time.monotonic() - fetched_at < self.ttl
+
+    async def _single_flight(self, key, factory):
+        """같은 key의 요청이 진행 중이면 그 결과를 함께 기다립니다. 최근에 실패한 key는 바로 실패합니다."""
+        failure = self._failures.get(key)
+        if failure is not None:
+            if time.monotonic() - failure[0] < self.failure_ttl:
+                raise failure[1].with_traceback(None)
+            del self._failures[key]
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._settle(key, done))
+        # 먼저 기다리던 호출자가 취소되어도 공유 요청은 계속 진행되도록 shield 합니다.
+        return await asyncio.shield(task)
+
+    def _settle(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self._failures[key] = (time.monotonic(), task.exception())
+
+    async def _refresh_models(self) -> dict:
+        models = await self._fetch_models()
+        # digest가 바뀌었거나 삭제된 모델의 capabilities는 버립니다.
+        for name in list(self._capabilities):
+            if models.get(name) != self._capabilities[name][0]:
+                del self._capabilities[name]
+        self._models = models
+        self._models_at = time.monotonic()
+        return models
+
+    async def models(self) -> dict:
+        """{모델 이름: digest} 사전을 반환합니다."""
+        if self._models is not None and self._fresh(self._models_at):
+            self.hits += 1
+            return self._models
+        self.misses += 1
+        return await self._single_flight("tags", self._refresh_models)
+
+    async def capabilities(self, model: str) -> list:
+        """모델의 capabilities 목록을 반환합니다."""
+        # 모델 목록은 digest 비교에만 쓰므로 models()를 거치지 않아 적중/실패 횟수를 따로 세지 않습니다.
+        models = self._models
+        if models is None or not self._fresh(self._models_at):
+            try:
+                models = await self._single_flight("tags", self._refresh_models)
+            except Exception:
+                # 모델 목록 갱신에 실패해도 캐시된 capabilities는 계속 사용합니다.
+                models = self._models or {}
+
+        entry = self._capabilities.get(model)
+        if entry is not None and self._fresh(entry[1]) and models.get(model, entry[0]) == entry[0]:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+
+        async def load():
+            capabilities = await self._fetch_capabilities(model)
+            self._capabilities[model] = (models.get(model), time.monotonic(), capabilities)
+            return capabilities
+
+        return await self._single_flight(("show", model), load)
+
+    async def warm(self):
+        """모델 목록과 모든 모델의 capabilities를 미리 불러옵니다."""
+        models = await self.models()
+        await asyncio.gather(*(self.capabilities(name) for name in models), return_exceptions=True)
+
+    def invalidate(self, model: str = None):
+        if model is None:
+            self._models = None
+            self._capabilities.clear()
+            self._failures.clear()
+        else:
+            self._capabilities.pop(model, None)
+            self._failures.pop(("show", model), None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "models": len(self._models or {}),
+            "capabilities": len(self._capabilities),
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import fnmatch
+import time
+
+import aiohttp
+
+from utils.log import get_logger
+from utils.metrics import OLLAMA_MODEL_EVENTS, OLLAMA_MODEL_LOAD_SECONDS, OLLAMA_MODEL_SWAPS
+
+log = get_logger("residency")
+
+# load_duration이 이보다 길면 모델을 새로 불러온(콜드 로드) 것으로 봅니다.
+COLD_LOAD_SECONDS = 0.5
+
+
+def keep_alive_value(value: str):
+    """환경 변수 문자열을 Ollama keep_alive 값으로 바꿉니다. 숫자는 초(-1은 계속 유지), 나머지는 "30m" 같은 기간입니다."""
+    if value is None or not value.strip():
+        return None
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parse_keep_alive_tiers(value: str) -> list:
+    """"gemma3:*=30m,*:70b=2m" 형식을 [(패턴, keep_alive)] 목록으로 바꿉니다. 먼저 맞는 패턴이 이깁니다."""
+    tiers = []
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        pattern, _, keep_alive = entry.rpartition("=")
+        if not pattern:
+            log.warning("keep_alive.invalid_tier", entry=entry)
+            continue
+        tiers.append((pattern.strip(), keep_alive_value(keep_alive)))
+    return tiers
+
+
+class ModelResidency:
+    """
+    Ollama에 올라가 있는(resident) 모델을 관리해 사용자가 서로 다른 모델을 번갈아 쓸 때의 로드/언로드 반복을 줄입니다.
+
+    - poll_interval마다 /api/ps로 올라가 있는 모델을 확인하고, 사라진 모델은 unload로 기록합니다.
+    - 요청마다 보낼 keep_alive를 모델 이름 패턴(tier)별로 정합니다. 고정(pinned) 모델은 -1(계속 유지)입니다.
+    - 사용자가 모델을 고르면 빈 /api/generate 요청으로 미리 불러옵니다.
+    - 응답의 load_duration으로 콜드 로드를 세고, 직전에 쓰던 모델과 다른 모델을 불러왔으면 교체(swap)로 셉니다.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str, tiers=(), default_keep_alive: str = None,
+                 pinned: str = None, poll_interval: float = 15.0):
+        self.session = session
+        self.base_url = base_url  # .../api
+        self.tiers = list(tiers)
+        self.default_keep_alive = default_keep_alive
+        self.pinned = pinned
+        self.poll_interval = poll_interval
+        self.loaded = {}          # 모델 이름 -> /api/ps 항목
+        self.last_model = None    # 마지막으로 응답을 받은 모델
+        self.loads = 0
+        self.unloads = 0
+        self.swaps = 0
+        self._preloads = {}       # 모델 -> asyncio.Task
+        self._poller = None
+
+    def keep_alive(self, model: str):
+        """요청에 넣을 keep_alive 값. 설정이 없으면 None(서버 기본값)입니다."""
+        if model == self.pinned:
+            return -1
+        for pattern, keep_alive in self.tiers:
+            if fnmatch.fnmatchcase(model, pattern):
+                return keep_alive
+        return self.default_keep_alive
+
+    def is_resident(self, model: str) -> bool:
+        return model in self.loaded
+
+    async def start(self):
+        await self.refresh()
+        if self.pinned:
+            self.preload(self.pinned)
+        if self.poll_interval > 0:
+            self._poller = asyncio.create_task(self._poll_loop())
+
+    async def close(self):
+        tasks = [task for task in (self._poller, *self._preloads.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._poller = None
+        self._preloads.clear()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.refresh()
+            # 고정 모델이 (다른 프로세스의 요청 등으로) 내려갔으면 다시 올립니다.
+            if self.pinned and self.pinned not in self.loaded:
+                self.preload(self.pinned)
+
+    async def refresh(self):
+        """/api/ps로 올라가 있는 모델 목록을 갱신합니다. 실패하면 이전 목록을 유지합니다."""
+        try:
+            async with self.session.get(f"{self.base_url}/ps") as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            log.warning("ps.failed", error=str(e) or type(e).__name__)
+            return
+        loaded = {entry["name"]: entry for entry in data.get("models", []) if entry.get("name")}
+        for model in self.loaded.keys() - loaded.keys():
+            self.unloads += 1
+            OLLAMA_MODEL_EVENTS.inc(model=model, event="unload")
+            log.info("model.unloaded", model=model)
+        self.loaded = loaded
+
+    def observed(self, model: str, load_seconds: float):
+        """응답의 load_duration(초)을 기록합니다. 콜드 로드였다면 로드/교체 횟수를 셉니다."""
+        OLLAMA_MODEL_LOAD_SECONDS.observe(load_seconds, model=model)
+        if load_seconds >= COLD_LOAD_SECONDS:
+            self.loads += 1
+            OLLAMA_MODEL_EVENTS.inc(model=model, event="load")
+            swapped = self.last_model is not None and self.last_model != model
+            if swapped:
+                self.swaps += 1
+                OLLAMA_MODEL_SWAPS.inc()
+            log.info("model.loaded", model=model, seconds=round(load_seconds, 3), previous=self.last_model, swap=swapped)
+        self.last_model = model
+        self.loaded.setdefault(model, {"name": model})
+
+    def preload(self, model: str):
+        """모델을 백그라운드에서 미리 불러옵니다. 같은 모델을 이미 불러오는 중이면 그 작업을 씁니다."""
+        task = self._preloads.get(model)
+        if task is None:
+            task = self._preloads[model] = asyncio.create_task(self._preload(model))
+            task.add_done_callback(lambda _: self._preloads.pop(model, None))
+        return task
+
+    async def _preload(self, model: str):
+        payload = {"model": model}
+        keep_alive = self.keep_alive(model)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        started = time.perf_counter()
+        try:
+            # 프롬프트 없이 /api/generate를 호출하면 모델만 메모리에 올립니다.
+            async with self.session.post(f"{self.base_url}/generate", json=payload) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            log.warning("model.preload_failed", model=model, error=str(e) or type(e).__name__)
+            return
+        OLLAMA_MODEL_EVENTS.inc(model=model, event="preload")
+        log.info("model.preloaded", model=model, seconds=round(time.perf_counter() - started, 3))
+        self.observed(model, data.get("load_duration", 0) / 1e9)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": sorted(self.loaded),
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "swaps": self.swaps,
+            "pinned": self.pinned,
+        }
@@ -0,0 +1,359 @@
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+
+from utils.log import get_logger
+from utils.metrics import BACKEND_BREAKER_STATE, BACKEND_RETRIES, CHAT_FAILOVERS
+
+log = get_logger("resilience")
+
+# 백엔드별 기본값. 시간은 초입니다. 요청 자체의 타임아웃은 utils.http(HTTP_<BACKEND>_*)가 맡습니다.
+#  - attempts: 첫 시도를 포함한 최대 시도 횟수, budget: 재시도 대기를 시작할 수 있는 첫 시도 이후 시간
+#  - threshold: 연속 실패가 이만큼 쌓이면 회로를 엽니다, reset: 열린 회로가 시험 요청을 하나 보내기까지의 시간
+#  - 로컬 Ollama는 내려가면 대개 한동안 돌아오지 않으므로 짧게 재시도하고 회로를 빨리 엽니다.
+GUARD_DEFAULTS = {
+    "ollama": {"attempts": 2, "base_delay": 0.25, "max_delay": 2.0, "budget": 5.0, "threshold": 3, "reset": 15.0},
+    "gemini": {"attempts": 3, "base_delay": 0.5, "max_delay": 8.0, "budget": 15.0, "threshold": 5, "reset": 30.0},
+}
+DEFAULT_GUARD = {"attempts": 3, "base_delay": 0.5, "max_delay": 4.0, "budget": 10.0, "threshold": 5, "reset": 30.0}
+
+# 같은 요청을 다시 보내도 되는 일시적인 HTTP 상태 코드
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# base64 앞부분으로 알아보는 이미지 형식 (Ollama 기록에는 MIME 형식이 남지 않습니다)
+_IMAGE_SIGNATURES = (("/9j/", "image/jpeg"), ("iVBORw0KGgo", "image/png"), ("UklGR", "image/webp"), ("R0lGOD", "image/gif"))
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class BackendUnavailable(Exception):
+    """회로가 열려 있어 백엔드에 요청을 보내지 않고 바로 실패할 때 발생합니다."""
+
+
+class BackendError(Exception):
+    """백엔드가 응답 대신 오류(차단 등)를 돌려주었을 때 발생합니다. 장애로 보지는 않습니다."""
+
+
+class FailoverPending(Exception):
+    """
+    장애로 실패해 다른 백엔드로 넘길 턴. 원래 백엔드의 스케줄러 슬롯을 쥔 채로 다른 백엔드의 슬롯을 기다리면
+    두 백엔드가 함께 장애일 때 서로를 기다릴 수 있으므로, 슬롯을 돌려준 뒤 Resilience.run_pending()으로 보냅니다.
+
+    messages는 공통 형식(Ollama) 메시지 목록, error는 다른 백엔드도 실패했을 때 보여줄 문구,
+    commit(reply)은 받은 답변을 원래 백엔드의 대화 기록에 남기는 함수입니다.
+    """
+
+    def __init__(self, source: str, messages, error: str, commit):
+        super().__init__(error)
+        self.source = source
+        self.messages = messages
+        self.error = error
+        self.commit = commit
+
+
+def is_outage(error) -> bool:
+    """백엔드가 건강하지 않다는 신호인 오류인지 (연결 실패, 타임아웃, 429, 5xx)."""
+    if isinstance(error, (BackendUnavailable, asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and (error.status == 429 or error.status >= 500)
+
+
+def is_retryable(error) -> bool:
+    """
+    다시 보내면 성공할 수 있는 일시적인 오류인지.
+    응답을 기다리다 난 타임아웃은 다시 기다려도 오래 걸릴 뿐이라 재시도하지 않고, 연결 타임아웃만 재시도합니다.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    if isinstance(error, aiohttp.ServerTimeoutError):
+        return isinstance(error, aiohttp.ConnectionTimeoutError)
+    return isinstance(error, aiohttp.ClientConnectionError)
+
+
+def _retry_after(error):
+    """429/503 응답의 Retry-After(초). 없거나 날짜 형식이면 None."""
+    headers = getattr(error, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def guard_options(name: str) -> dict:
+    """
+    기본값에 RESILIENCE_<NAME>_RETRY_ATTEMPTS, _RETRY_BASE_DELAY, _RETRY_MAX_DELAY, _RETRY_BUDGET,
+    _BREAKER_THRESHOLD, _BREAKER_RESET 환경 변수를 덮어쓴 설정.
+    """
+    options = dict(GUARD_DEFAULTS.get(name, DEFAULT_GUARD))
+    prefix = "RESILIENCE_" + "".join(c if c.isalnum() else "_" for c in name.upper())
+    for key, env in (("attempts", "RETRY_ATTEMPTS"), ("base_delay", "RETRY_BASE_DELAY"),
+                     ("max_delay", "RETRY_MAX_DELAY"), ("budget", "RETRY_BUDGET"),
+                     ("threshold", "BREAKER_THRESHOLD"), ("reset", "BREAKER_RESET")):
+        value = os.getenv(f"{prefix}_{env}")
+        if value:
+            options[key] = type(options[key])(value)
+    return options
+
+
+class CircuitBreaker:
+    """
+    연속 실패가 threshold번 쌓이면 회로를 열어(open) reset초 동안 요청을 보내지 않고 바로 실패시킵니다.
+    reset초가 지나면 반(half_open)만 열어 시험 요청 하나만 보내고, 성공하면 닫고(closed) 실패하면 다시 엽니다.
+    시험 요청이 취소되어 결과가 오지 않아도 reset초 뒤에는 다음 시험 요청을 허용합니다.
+    """
+
+    def __init__(self, name: str, threshold: int = 5, reset: float = 30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset = reset
+        self.state = "closed"
+        self.failures = 0         # 연속 실패 수
+        self.opened = 0           # 회로가 열린 횟수
+        self.rejected = 0         # 열려 있어서 바로 실패시킨 요청 수
+        self._opened_at = 0.0
+        self._probe_at = None     # 시험 요청을 보낸 시각
+        BACKEND_BREAKER_STATE.set(0, backend=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            log.info("breaker.state", backend=self.name, state=state, previous=self.state, failures=self.failures)
+            self.state = state
+            BACKEND_BREAKER_STATE.set(_STATE_VALUES[state], backend=self.name)
+
+    def allow(self) -> bool:
+        """지금 요청을 보내도 되는지. 반열림 상태에서는 시험 요청 하나만 허용합니다."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.reset:
+            self._set_state("half_open")
+        if self.state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.reset):
+            self._probe_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_at = None
+        self._set_state("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_at = None
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.opened += 1
+            self._opened_at = time.monotonic()
+            self._set_state("open")
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class BackendGuard:
+    """
+    백엔드 하나에 보내는 요청을 회로 차단기와 재시도로 감쌉니다.
+
+    재시도는 is_retryable인 오류만, 최대 attempts번까지, 지터를 준 지수 백오프(0 ~ base_delay * 2^n,
+    max_delay 이하)로 기다린 뒤 다시 보냅니다. 429/503의 Retry-After가 max_delay보다 길면 기다리지 않고 포기하며,
+    첫 시도 후 budget초가 지나면 더 재시도하지 않으므로 장애 중에도 응답 시간이 제한됩니다.
+    """
+
+    def __init__(self, name: str, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 4.0,
+                 budget: float = 10.0, threshold: int = 5, reset: float = 30.0):
+        self.name = name
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.breaker = CircuitBreaker(name, threshold, reset)
+        self.retries = 0
+
+    def _delay(self, attempt: int, error):
+        """attempt번째 재시도 전에 기다릴 시간. 재시도하지 않아야 하면 None."""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, func, retry_if=None):
+        """
+        func()를 실행해 결과를 돌려줍니다. 회로가 열려 있으면 BackendUnavailable을 발생시킵니다.
+        retry_if()가 거짓이면 (예: 응답 일부를 이미 사용자에게 보냈으면) 재시도하지 않습니다.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise BackendUnavailable(self.name)
+            try:
+                result = await func()
+            except Exception as e:
+                if not is_outage(e):
+                    # 요청 자체의 문제(400 등)는 백엔드가 살아 있다는 뜻입니다.
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                attempt += 1
+                delay = self._delay(attempt - 1, e) if is_retryable(e) else None
+                if (delay is None or attempt >= self.attempts or (retry_if is not None and not retry_if())
+                        or time.monotonic() + delay - started > self.budget or self.breaker.state == "open"):
+                    raise
+                self.retries += 1
+                reason = str(e.status) if isinstance(e, aiohttp.ClientResponseError) else type(e).__name__
+                BACKEND_RETRIES.inc(backend=self.name, reason=reason)
+                log.info("retry", backend=self.name, attempt=attempt, delay=round(delay, 3), reason=reason)
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {"retries": self.retries, **self.breaker.stats()}
+
+
+def sniff_image_mime(data: str) -> str:
+    """base64 이미지의 MIME 형식 (알 수 없으면 image/jpeg)."""
+    for prefix, mime_type in _IMAGE_SIGNATURES:
+        if data.startswith(prefix):
+            return mime_type
+    return "image/jpeg"
+
+
+def ollama_to_gemini(messages) -> tuple:
+    """
+    Ollama 메시지(role/content/images)를 Gemini 형식 (system_instruction 텍스트, contents(role/parts/inline_data))로
+    바꿉니다. system 메시지(페르소나, 요약)는 이어 붙여 system_instruction 텍스트가 됩니다.
+    """
+    system, contents = [], []
+    for message in messages:
+        role = message.get("role")
+        if role == "system":
+            if message.get("content"):
+                system.append(message["content"])
+            continue
+        parts = [{"text": message["content"]}] if message.get("content") else []
+        parts.extend({"inline_data": {"mime_type": sniff_image_mime(image), "data": image}}
+                     for image in message.get("images") or ())
+        if parts:
+            contents.append({"role": "model" if role == "assistant" else "user", "parts": parts})
+    return "\n\n".join(system), contents
+
+
+def gemini_to_ollama(contents, system_text: str = None) -> list:
+    """Gemini contents(role/parts/inline_data)와 system_instruction 텍스트를 Ollama 메시지 목록으로 바꿉니다."""
+    messages = [{"role": "system", "content": system_text}] if system_text else []
+    for content in contents:
+        parts = content.get("parts", [])
+        message = {
+            "role": "assistant" if content.get("role") == "model" else "user",
+            "content": "".join(part.get("text", "") for part in parts),
+        }
+        images = [(part.get("inline_data") or part.get("inlineData"))["data"]
+                  for part in parts if "inline_data" in part or "inlineData" in part]
+        if images:
+            message["images"] = images
+        messages.append(message)
+    return messages
+
+
+class Resilience:
+    """
+    채팅 백엔드별 BackendGuard와 장애 조치(failover) 대상을 모아 둡니다.
+
+    failover가 켜져 있으면 한 백엔드가 장애로 실패한 턴을 다른 백엔드로 보냅니다. 백엔드마다
+    complete(messages, on_chunk)와 그 백엔드의 스케줄러를 등록하며, messages는 공통 형식인 Ollama 메시지 목록
+    (system 포함, 마지막이 이번 사용자 메시지)입니다. 받은 쪽의 스케줄러 슬롯을 얻은 뒤 자기 형식으로 바꿔
+    보내고 답변 텍스트를 돌려주므로, 넘어온 턴도 받은 백엔드의 동시 요청 한도를 지킵니다.
+    """
+
+    def __init__(self, failover: bool = False):
+        self.failover_enabled = failover
+        self._guards = {}      # 백엔드 이름 -> BackendGuard
+        self._completers = {}  # 백엔드 이름 -> (async complete(messages, on_chunk), 스케줄러) (등록 순서 유지)
+        self.failovers = 0
+
+    def guard(self, name: str) -> BackendGuard:
+        if name not in self._guards:
+            self._guards[name] = BackendGuard(name, **guard_options(name))
+        return self._guards[name]
+
+    def register_failover(self, name: str, complete, scheduler=None):
+        self._completers[name] = (complete, scheduler)
+
+    def unregister_failover(self, name: str):
+        self._completers.pop(name, None)
+
+    def _targets(self, source: str) -> list:
+        """source 대신 받을 수 있는 (이름, complete, 스케줄러) 목록. 회로가 열린 백엔드는 뺍니다."""
+        if not self.failover_enabled:
+            return []
+        return [(target, complete, scheduler) for target, (complete, scheduler) in self._completers.items()
+                if target != source and self.guard(target).breaker.state != "open"]
+
+    def can_failover(self, source: str) -> bool:
+        return bool(self._targets(source))
+
+    async def failover(self, source: str, messages, on_chunk=None, user_id=None):
+        """
+        source에서 실패한 턴을 다른 백엔드로 보냅니다. (대상 이름, 답변)을 돌려주며,
+        failover가 꺼져 있거나 받을 수 있는 백엔드가 없거나 모두 실패하면 None입니다.
+        user_id는 대상 스케줄러의 사용자별 공정성에 쓰입니다. source의 슬롯을 쥔 채로 부르면 안 됩니다.
+        """
+        for target, complete, scheduler in self._targets(source):
+            streamed = False
+
+            def feed(text):
+                nonlocal streamed
+                streamed = True
+                if on_chunk is not None:
+                    on_chunk(text)
+
+            async def run():
+                return await self.guard(target).call(lambda: complete(messages, feed), retry_if=lambda: not streamed)
+
+            try:
+                if scheduler is None:
+                    reply = await run()
+                else:
+                    async with scheduler.slot(user_id):
+                        reply = await run()
+            except Exception as e:
+                # QueueFull, 장애, 차단 응답, 응답 디코딩 실패 등 무엇이든 이 대상으로는 실패한 것으로 봅니다.
+                CHAT_FAILOVERS.inc(source=source, target=target, result="failed")
+                log.warning("failover.failed", source=source, target=target, error=str(e) or type(e).__name__)
+                if streamed:
+                    return None  # 일부를 이미 보냈으므로 다른 백엔드로 이어 보내지 않습니다.
+                continue
+            self.failovers += 1
+            CHAT_FAILOVERS.inc(source=source, target=target, result="ok")
+            log.info("failover", source=source, target=target)
+            return target, reply
+        return None
+
+    async def run_pending(self, pending: FailoverPending, user_id=None, on_chunk=None) -> str:
+        """
+        FailoverPending의 턴을 다른 백엔드로 보내 답변을 원래 대화 기록에 남기고 돌려줍니다.
+        모두 실패하면 원래 오류 문구를 돌려줍니다.
+        """
+        result = await self.failover(pending.source, pending.messages, on_chunk, user_id)
+        if result is None:
+            return pending.error
+        pending.commit(result[1])
+        return result[1]
+
+    def stats(self) -> dict:
+        return {"failovers": self.failovers, **{name: guard.stats() for name, guard in self._guards.items()}}
+
+
+def get_resilience(bot) -> Resilience:
+    """봇에 하나뿐인 Resilience를 가져옵니다 (CHAT_FAILOVER)."""
+    resilience = getattr(bot, "resilience", None)
+    if resilience is None:
+        resilience = bot.resilience = Resilience(failover=os.getenv("CHAT_FAILOVER", "0") == "1")
+    return resilience
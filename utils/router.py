@@ -0,0 +1,142 @@
+import os
+import time
+
+from utils.log import get_logger
+
+log = get_logger("router")
+
+
+def _parse_ids(value: str) -> frozenset:
+    """"123,456" 형식의 ID 목록을 정수 집합으로 바꿉니다."""
+    return frozenset(int(part) for part in value.replace(" ", "").split(",") if part)
+
+
+class MessageRouter:
+    """
+    모든 채팅 Cog 앞에서 on_message를 한 번만 받아, 봇에게 온 메시지인지 가려내고
+    사용자별로 선택된 채팅 백엔드 하나에만 넘깁니다.
+
+    판별은 작성자, 멘션 ID, DM/채널 허용 목록만 보는 O(1) 검사라서,
+    봇과 상관없는 메시지로는 사용자 상태를 만들거나 응답을 보내지 않습니다.
+    /select_persona, /reset처럼 백엔드마다 따로 두면 이름이 겹치는 커맨드도 같은 선택을 따라 보냅니다.
+    사용자별 백엔드 선택은 채팅 Cog들이 공유하는 상태 저장소(bot.state_store)에 두므로
+    어느 워커 프로세스가 메시지를 받아도 같은 백엔드로 보냅니다. 저장소가 없으면 메모리에 둡니다.
+    """
+
+    def __init__(self, bot, default_backend: str = None, channel_allowlist=frozenset(), allow_dms: bool = False):
+        self.bot = bot
+        self.default_backend = default_backend
+        self.channel_allowlist = channel_allowlist
+        self.allow_dms = allow_dms
+        self.handlers = {}     # 백엔드 이름 -> async handler(message, prompt) (등록 순서 유지)
+        self.controls = {}     # 백엔드 이름 -> 페르소나/기록 초기화를 맡는 객체 (보통 채팅 Cog)
+        self.preferences = {}  # 사용자 ID -> 백엔드 이름 (상태 저장소가 없을 때만 사용)
+        self.seen = 0
+        self.routed = 0
+        self.first_reply_completed = None  # 시작 후 첫 메시지의 답장을 끝낼 때까지 걸린 시간 (초, 핸들러 종료 기준)
+
+    def register(self, name: str, handler, controls=None):
+        """
+        controls는 personas 사전과 async set_persona(user_id, persona), async reset_user(user_id)를
+        가진 객체입니다. 주면 공유 커맨드(/select_persona, /reset)가 이 백엔드로 넘어옵니다.
+        """
+        self.handlers[name] = handler
+        if controls is not None:
+            self.controls[name] = controls
+
+    def unregister(self, name: str):
+        self.handlers.pop(name, None)
+        self.controls.pop(name, None)
+
+    def backends(self) -> list:
+        return list(self.handlers)
+
+    async def preferred_backend(self, user_id):
+        store = getattr(self.bot, "state_store", None)
+        if store is None:
+            return self.preferences.get(user_id)
+        return (await store.get("router", user_id, dict)).get("backend")
+
+    async def backend_for(self, user_id):
+        """사용자의 메시지를 처리할 백엔드 이름 (등록된 백엔드가 없으면 None)."""
+        for name in (await self.preferred_backend(user_id), self.default_backend):
+            if name in self.handlers:
+                return name
+        return next(iter(self.handlers), None)
+
+    async def controls_for(self, user_id):
+        """사용자의 메시지를 처리할 백엔드의 (이름, controls). 커맨드를 받을 백엔드가 없으면 (이름, None)."""
+        name = await self.backend_for(user_id)
+        return name, self.controls.get(name)
+
+    async def set_backend(self, user_id, name: str):
+        if name not in self.handlers:
+            raise KeyError(name)
+        store = getattr(self.bot, "state_store", None)
+        if store is None:
+            self.preferences[user_id] = name
+            return
+        state = await store.get("router", user_id, dict)
+        state["backend"] = name
+        store.save("router", user_id, state)
+
+    def is_for_bot(self, message) -> bool:
+        """메시지가 봇을 부른 것인지 판별합니다. 메시지 내용은 보지 않습니다."""
+        if message.author.bot:
+            return False
+        if message.guild is None:
+            # DM은 허용된 경우 멘션 없이도 받습니다.
+            return self.allow_dms or self._mentions_bot(message)
+        if self.channel_allowlist:
+            channel = message.channel
+            if channel.id not in self.channel_allowlist \
+                    and getattr(channel, "parent_id", None) not in self.channel_allowlist:
+                return False
+        return self._mentions_bot(message)
+
+    def _mentions_bot(self, message) -> bool:
+        # @everyone/역할 멘션은 봇을 부른 것으로 보지 않습니다.
+        bot_id = self.bot.user.id
+        return any(user.id == bot_id for user in message.mentions)
+
+    def strip_mention(self, content: str) -> str:
+        bot_id = self.bot.user.id
+        return content.replace(f"<@{bot_id}>", "").replace(f"<@!{bot_id}>", "").strip()
+
+    async def on_message(self, message):
+        self.seen += 1
+        if not self.handlers or not self.is_for_bot(message):
+            return
+        name = await self.backend_for(message.author.id)
+        self.routed += 1
+        await self.handlers[name](message, self.strip_mention(message.content))
+        started_at = getattr(self.bot, "started_at", None)
+        if self.first_reply_completed is None and started_at is not None:
+            self.first_reply_completed = time.perf_counter() - started_at
+            log.info("startup.first_reply_completed", seconds=round(self.first_reply_completed, 3))
+
+    def stats(self) -> dict:
+        return {
+            "seen": self.seen,
+            "routed": self.routed,
+            "backends": self.backends(),
+            "default": self.default_backend,
+            "first_reply_completed": self.first_reply_completed,
+        }
+
+
+def get_router(bot) -> MessageRouter:
+    """
+    봇에 하나뿐인 메시지 라우터를 가져옵니다 (CHAT_DEFAULT_BACKEND, CHAT_CHANNEL_ALLOWLIST, CHAT_ALLOW_DMS).
+    처음 만들 때 on_message 리스너로 등록합니다.
+    """
+    router = getattr(bot, "message_router", None)
+    if router is None:
+        router = bot.message_router = MessageRouter(
+            bot,
+            default_backend=os.getenv("CHAT_DEFAULT_BACKEND", "ollama"),
+            channel_allowlist=_parse_ids(os.getenv("CHAT_CHANNEL_ALLOWLIST", "")),
+            allow_dms=os.getenv("CHAT_ALLOW_DMS", "0") == "1",
+        )
+        bot.add_listener(router.on_message, "on_message")
+    return router
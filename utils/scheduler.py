@@ -0,0 +1,263 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import discord
+
+from utils.cluster import worker_count
+from utils.metrics import QUEUE_WAIT, SCHEDULER_SERVICE_TIME, record_error
+
+
+class QueueFull(Exception):
+    """대기열이 가득 차서 요청을 받을 수 없을 때 발생합니다."""
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Waiter:
+    __slots__ = ("user_id", "key", "skips", "future", "enqueued_at")
+
+    def __init__(self, user_id, key=None):
+        self.user_id = user_id
+        self.key = key    # 같은 key(예: 모델)끼리 이어서 실행하면 유리한 요청의 key
+        self.skips = 0    # affinity 때문에 순서를 양보한 횟수
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """
+    백엔드 앞단의 공정 스케줄러.
+
+    - 동시에 실행되는 요청은 최대 max_in_flight개입니다.
+    - 사용자당 실행 중인 요청은 하나뿐이며, 대기 중인 사용자들 사이를 라운드 로빈으로 돕니다.
+    - 대기열이 max_queue를 넘으면 QueueFull을 발생시킵니다.
+    - affinity_skips > 0이면 실행 중이거나 마지막으로 실행한(또는 affinity(key)가 참인) key의 요청을
+      먼저 실행합니다. 한 요청이 양보하는 횟수는 affinity_skips번까지라 라운드 로빈 공정성은 유지됩니다.
+      (예: Ollama에 이미 올라가 있는 모델의 요청을 모아 실행해 모델 교체를 줄입니다.)
+    """
+
+    def __init__(self, name: str, max_in_flight: int = 1, max_queue: int = 20, samples: int = 512,
+                 affinity_skips: int = 0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.affinity_skips = affinity_skips
+        self.affinity = None   # (key) -> bool, key가 지금 실행하기 유리한지 (예: 모델이 올라가 있는지)
+        self._queues = {}      # user_id -> deque[_Waiter]
+        self._ring = deque()   # 대기 중인 사용자 (라운드 로빈 순서)
+        self._active = {}      # 실행 중인 사용자 -> key
+        self._last_key = None
+        self._in_flight = 0
+        self._queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.reordered = 0
+        self.wait_times = deque(maxlen=samples)
+        self.service_times = deque(maxlen=samples)
+
+    def _grant(self, waiter):
+        self._in_flight += 1
+        self._active[waiter.user_id] = waiter.key
+        self._last_key = waiter.key
+        wait = time.monotonic() - waiter.enqueued_at
+        self.wait_times.append(wait)
+        QUEUE_WAIT.observe(wait, queue=self.name)
+        waiter.future.set_result(None)
+
+    def _hot(self, key) -> bool:
+        if key is None:
+            return False
+        if key == self._last_key or key in self._active.values():
+            return True
+        return self.affinity is not None and self.affinity(key)
+
+    def _pick_affine(self):
+        """라운드 로빈 차례인 요청 대신 먼저 실행할 hot key 요청의 사용자. 없으면 None."""
+        candidates = [user_id for user_id in self._ring if user_id not in self._active]
+        if len(candidates) < 2:
+            return None
+        head = self._queues[candidates[0]][0]
+        if head.skips >= self.affinity_skips or self._hot(head.key):
+            return None
+        for index, user_id in enumerate(candidates[1:], 1):
+            if self._hot(self._queues[user_id][0].key):
+                for skipped in candidates[:index]:
+                    self._queues[skipped][0].skips += 1
+                return user_id
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight and self._ring:
+            user_id = self._pick_affine() if self.affinity_skips > 0 else None
+            if user_id is not None:
+                self.reordered += 1
+                self._ring.remove(user_id)
+                self._ring.append(user_id)
+            else:
+                for _ in range(len(self._ring)):
+                    user_id = self._ring[0]
+                    self._ring.rotate(-1)
+                    if user_id not in self._active:
+                        break
+                else:
+                    return  # 대기 중인 사용자가 모두 이미 실행 중입니다.
+            queue = self._queues[user_id]
+            waiter = queue.popleft()
+            self._queued -= 1
+            if not queue:
+                del self._queues[user_id]
+                self._ring.remove(user_id)
+            self._grant(waiter)
+
+    def _remove(self, waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.user_id]
+            self._ring.remove(waiter.user_id)
+
+    def position(self, waiter) -> int:
+        """라운드 로빈 순서로 계산한, 이 요청보다 먼저 처리될 대기 요청 수."""
+        queue = self._queues.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return 0
+        rounds = queue.index(waiter)
+        ahead = rounds
+        before = True
+        for user_id in self._ring:
+            if user_id == waiter.user_id:
+                before = False
+                continue
+            ahead += min(len(self._queues[user_id]), rounds + (1 if before else 0))
+        return ahead
+
+    async def acquire(self, user_id, on_queued=None, key=None):
+        """
+        실행 슬롯을 얻을 때까지 기다립니다.
+        바로 실행할 수 없으면 on_queued(앞선 대기 수)를 호출합니다. key는 affinity에 쓰입니다.
+        """
+        waiter = _Waiter(user_id, key)
+        if not self._ring and user_id not in self._active and self._in_flight < self.max_in_flight:
+            self._grant(waiter)
+            return
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            record_error(self.name, "QueueFull")
+            raise QueueFull(self.name)
+
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._ring.append(user_id)
+        self._queues[user_id].append(waiter)
+        self._queued += 1
+        self._dispatch()
+
+        try:
+            if not waiter.future.done() and on_queued is not None:
+                result = on_queued(self.position(waiter))
+                if inspect.isawaitable(result):
+                    await result
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(user_id)  # 슬롯을 받은 직후 취소되었습니다.
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self, user_id, service_time: float = None):
+        self._in_flight -= 1
+        self._active.pop(user_id, None)
+        self.completed += 1
+        if service_time is not None:
+            self.service_times.append(service_time)
+            SCHEDULER_SERVICE_TIME.observe(service_time, queue=self.name)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_queued=None, key=None):
+        await self.acquire(user_id, on_queued, key)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user_id, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "reordered": self.reordered,
+            "wait_p50": percentile(self.wait_times, 0.50),
+            "wait_p99": percentile(self.wait_times, 0.99),
+            "service_p50": percentile(self.service_times, 0.50),
+            "service_p99": percentile(self.service_times, 0.99),
+        }
+
+
+def get_scheduler(bot, name: str, max_in_flight: int = 1, max_queue: int = 20,
+                  affinity_skips: int = 0) -> FairScheduler:
+    """
+    백엔드 이름별로 하나의 스케줄러를 봇에 보관해 여러 Cog가 공유하게 합니다.
+    SCHED_<NAME>_MAX_IN_FLIGHT / SCHED_<NAME>_MAX_QUEUE / SCHED_<NAME>_AFFINITY_SKIPS 환경 변수로
+    기본값을 바꿀 수 있습니다.
+
+    스케줄러는 프로세스마다 하나씩 있으므로, launcher.py로 워커를 여럿 띄우면 max_in_flight를
+    워커 수로 나눠(최소 1) 백엔드가 받는 전체 동시 요청 수를 맞춥니다. 대기열과 사용자 간 공정성은
+    워커마다 따로 적용됩니다.
+    """
+    schedulers = getattr(bot, "schedulers", None)
+    if schedulers is None:
+        schedulers = bot.schedulers = {}
+    if name not in schedulers:
+        prefix = "SCHED_" + "".join(c if c.isalnum() else "_" for c in name.upper())
+        schedulers[name] = FairScheduler(
+            name,
+            max_in_flight=max(1, int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", str(max_in_flight))) // worker_count()),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", str(max_queue))),
+            affinity_skips=int(os.getenv(f"{prefix}_AFFINITY_SKIPS", str(affinity_skips))),
+        )
+    return schedulers[name]
+
+
+async def run_scheduled(scheduler: FairScheduler, message, func, key=None):
+    """
+    스케줄러 슬롯을 얻어 func()를 실행합니다. key는 스케줄러 affinity에 쓰입니다 (예: 모델 이름).
+    기다려야 하면 대기 순번을 알리고, 대기열이 가득 차면 바쁘다는 답장을 보냅니다.
+    """
+    notice = None
+
+    async def on_queued(ahead):
+        nonlocal notice
+        try:
+            notice = await message.channel.send(f"요청이 대기열에 추가되었습니다. (앞선 요청 {ahead}건)")
+        except discord.HTTPException:
+            pass
+
+    try:
+        async with scheduler.slot(message.author.id, on_queued=on_queued, key=key):
+            if notice is not None:
+                try:
+                    await notice.delete()
+                except discord.HTTPException:
+                    pass
+            return await func()
+    except QueueFull:
+        try:
+            await message.channel.send("지금은 요청이 많아 처리할 수 없습니다. 잠시 후 다시 시도해주세요.")
+        except discord.HTTPException:
+            pass
@@ -0,0 +1,326 @@
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.log import get_logger
+
+log = get_logger("state_store")
+
+
+def _approx_size(obj) -> int:
+    """상태 객체의 대략적인 메모리 크기(바이트). 문자열 길이 위주로 계산합니다."""
+    if isinstance(obj, str):
+        return len(obj) + 50
+    if isinstance(obj, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return 56 + sum(_approx_size(v) for v in obj)
+    return 28
+
+
+class StateStore(abc.ABC):
+    """
+    사용자 상태 저장소의 공통 인터페이스.
+
+    상태는 (namespace, key)로 구분되는 JSON 직렬화 가능한 dict입니다.
+    get()으로 받은 dict를 직접 수정한 뒤 save()로 변경을 알립니다.
+    get()과 save()를 구현하지 않은 하위 클래스는 인스턴스를 만들 때 TypeError가 납니다.
+    """
+
+    @abc.abstractmethod
+    async def get(self, namespace: str, key, factory) -> dict:
+        """(namespace, key)의 상태를 반환합니다. 없으면 factory()로 만들어 저장소에 넣습니다."""
+
+    @abc.abstractmethod
+    def save(self, namespace: str, key, state: dict):
+        """상태가 바뀌었음을 알립니다."""
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryLRUStore(StateStore):
+    """프로세스 메모리에만 두는 LRU 저장소. max_bytes를 넘으면 오래된 사용자부터 버립니다."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (namespace, key) -> state
+        self._sizes = {}
+        self._total = 0
+        self.evictions = 0
+
+    def _put(self, item, state):
+        self._total -= self._sizes.get(item, 0)
+        self._entries[item] = state
+        self._entries.move_to_end(item)
+        self._sizes[item] = _approx_size(state)
+        self._total += self._sizes[item]
+
+    def _pop_oldest(self):
+        item, state = self._entries.popitem(last=False)
+        self._total -= self._sizes.pop(item)
+        self.evictions += 1
+        return item, state
+
+    def _evict(self):
+        # 방금 사용한 사용자 하나는 항상 남겨둡니다.
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            self._pop_oldest()
+
+    async def get(self, namespace, key, factory):
+        item = (namespace, str(key))
+        state = self._entries.get(item)
+        if state is None:
+            state = factory()
+            self._put(item, state)
+            self._evict()
+        else:
+            self._entries.move_to_end(item)
+        return state
+
+    def save(self, namespace, key, state):
+        self._put((namespace, str(key)), state)
+        self._evict()
+
+    def stats(self):
+        return {"resident": len(self._entries), "bytes": self._total, "evictions": self.evictions}
+
+
+class SQLiteStateStore(MemoryLRUStore):
+    """
+    자주 쓰는 사용자는 메모리(LRU)에 두고, 나머지는 로컬 SQLite(WAL)에 보관합니다.
+
+    save()는 변경 표시만 하고, 백그라운드 작업이 flush_interval마다 모아서 씁니다.
+    SQLite 접근은 전용 스레드 하나에서만 수행하므로 이벤트 루프를 막지 않습니다.
+
+    shared=True이면 여러 워커 프로세스가 같은 파일을 쓰는 것으로 보고, 메모리에 있는 상태를
+    돌려주기 전에 updated_at을 확인해 다른 프로세스가 더 새로 쓴 상태면 그 자리에서 갱신합니다.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, flush_interval: float = 2.0,
+                 shared: bool = False):
+        super().__init__(max_bytes)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self._versions = {}  # (namespace, key) -> 마지막으로 읽거나 쓴 updated_at
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self._conn = None
+        self._dirty = set()
+        self._loading = {}  # (namespace, key) -> Future
+        self._flusher = None
+        self.loads = 0
+        self.writes = 0
+        self.refreshes = 0
+
+    # ---- 스토어 전용 스레드에서 실행되는 함수 ----
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # 다른 워커 프로세스가 쓰는 중이면 잠시 기다립니다.
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+        return self._conn
+
+    def _load(self, namespace, key):
+        """(상태, updated_at)을 반환합니다. 저장된 상태가 없으면 (None, 0)."""
+        row = self._connect().execute(
+            "SELECT data, updated_at FROM user_state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def _version(self, namespace, key):
+        row = self._connect().execute(
+            "SELECT updated_at FROM user_state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _write(self, rows):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_state (namespace, key, data, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ---- 이벤트 루프 쪽 ----
+
+    def _serialize(self, items):
+        # 상태 dict는 이벤트 루프에서 수정되므로 직렬화는 루프에서 하고, 쓰기만 스레드로 넘깁니다.
+        now = time.time()
+        rows = [(ns, key, json.dumps(self._entries[(ns, key)], ensure_ascii=False), now)
+                for ns, key in items if (ns, key) in self._entries]
+        for ns, key, _, _ in rows:
+            self._versions[(ns, key)] = now
+        return rows
+
+    async def _evict_async(self):
+        evicted = []
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            item = next(iter(self._entries))
+            if item in self._dirty:
+                evicted.extend(self._serialize([item]))
+                self._dirty.discard(item)
+            self._pop_oldest()
+            self._versions.pop(item, None)
+        if evicted:
+            await self._run(self._write, evicted)
+            self.writes += len(evicted)
+
+    def _evict(self):
+        # save()에서 호출되는 동기 버전. 실제 디스크 쓰기는 다음 flush에 맡깁니다.
+        if self._total > self.max_bytes:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("flush.failed", path=self.path)
+
+    async def get(self, namespace, key, factory):
+        item = (namespace, str(key))
+        state = self._entries.get(item)
+        if state is not None:
+            self._entries.move_to_end(item)
+            if self.shared and item not in self._dirty:
+                await self._revalidate(item, state)
+            return state
+
+        # 같은 사용자를 동시에 불러오면 디스크 조회를 한 번만 합니다.
+        future = self._loading.get(item)
+        if future is None:
+            future = asyncio.ensure_future(self._run(self._load, *item))
+            self._loading[item] = future
+            future.add_done_callback(lambda _: self._loading.pop(item, None))
+            self.loads += 1
+        state, version = await asyncio.shield(future)
+
+        if item in self._entries:  # 기다리는 동안 다른 코루틴이 먼저 넣었습니다.
+            return self._entries[item]
+        self._versions[item] = version
+        if state is None:
+            state = factory()
+            self._dirty.add(item)
+        self._put(item, state)
+        await self._evict_async()
+        self._ensure_flusher()
+        return state
+
+    async def _revalidate(self, item, state):
+        """다른 프로세스가 더 새로 쓴 상태가 있으면 같은 dict 객체를 그 내용으로 바꿉니다."""
+        version = await self._run(self._version, *item)
+        if version <= self._versions.get(item, 0) or item in self._dirty:
+            return
+        fresh, version = await self._run(self._load, *item)
+        if fresh is None or item in self._dirty:
+            return
+        # 진행 중인 턴이 들고 있는 참조도 새 내용을 보도록 객체는 그대로 두고 내용만 바꿉니다.
+        state.clear()
+        state.update(fresh)
+        self._put(item, state)
+        self._versions[item] = version
+        self.refreshes += 1
+
+    def save(self, namespace, key, state):
+        item = (namespace, str(key))
+        self._put(item, state)
+        self._dirty.add(item)
+        self._ensure_flusher()
+
+    async def flush(self):
+        if self._dirty:
+            items, self._dirty = self._dirty, set()
+            rows = self._serialize(items)
+            if rows:
+                await self._run(self._write, rows)
+                self.writes += len(rows)
+        await self._evict_async()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"dirty": len(self._dirty), "loads": self.loads, "writes": self.writes,
+                      "refreshes": self.refreshes})
+        return stats
+
+
+def create_state_store() -> StateStore:
+    """
+    환경 변수(STATE_STORE, STATE_DB_PATH, STATE_CACHE_MAX_BYTES, STATE_SHARED, STATE_FLUSH_INTERVAL)에
+    따라 저장소를 만듭니다. STATE_SHARED=1은 launcher.py가 여러 워커를 띄울 때 설정합니다.
+    """
+    kind = os.getenv("STATE_STORE", "sqlite")
+    max_bytes = int(os.getenv("STATE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    shared = os.getenv("STATE_SHARED", "0") == "1"
+    if kind == "memory":
+        if shared:
+            log.warning("memory_store.not_shared", detail="STATE_STORE=memory는 워커 프로세스끼리 상태를 공유하지 않습니다.")
+        return MemoryLRUStore(max_bytes)
+    if kind == "sqlite":
+        # 공유 모드에서는 다른 워커가 빨리 볼 수 있도록 더 자주 기록합니다.
+        flush_interval = float(os.getenv("STATE_FLUSH_INTERVAL", "0.5" if shared else "2.0"))
+        return SQLiteStateStore(os.getenv("STATE_DB_PATH", "state.db"), max_bytes, flush_interval, shared=shared)
+    raise ValueError(f"알 수 없는 STATE_STORE 값입니다: {kind}")
+
+
+def acquire_state_store(bot) -> StateStore:
+    """봇에 하나뿐인 상태 저장소를 가져옵니다. 모든 채팅 Cog가 같은 저장소를 공유합니다."""
+    store = getattr(bot, "state_store", None)
+    if store is None:
+        store = create_state_store()
+        bot.state_store = store
+        bot.state_store_users = 0
+    bot.state_store_users += 1
+    return store
+
+
+async def release_state_store(bot):
+    """저장소 사용을 마칩니다. 마지막 사용자가 반납하면 남은 변경을 기록하고 닫습니다."""
+    store = getattr(bot, "state_store", None)
+    if store is None:
+        return
+    bot.state_store_users -= 1
+    if bot.state_store_users <= 0:
+        bot.state_store = None
+        await store.close()
+    else:
+        await store.flush()
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import discord
+
+from utils.log import get_logger
+from utils.metrics import DISCORD_API_DURATION, record_error
+
+log = get_logger("streaming")
+
+
+class ProgressiveMessage:
+    """
+    생성 중인 텍스트를 임베드 메시지에 점진적으로 반영합니다.
+
+    - feed()로 들어온 조각은 모아 두었다가 채널당 interval 초에 한 번만 편집합니다.
+    - 텍스트가 임베드 description 한도를 넘으면 다음 메시지로 이어서 보냅니다.
+    - finish()는 전체 텍스트로 마지막 편집을 수행하고, 최종 텍스트보다 많이 보낸 페이지는 지웁니다.
+    - 응답을 받지 못하고 끝나면 abort()로 편집 루프를 멈추고 플레이스홀더를 오류 문구로 바꿉니다.
+    """
+
+    EMBED_DESCRIPTION_LIMIT = 4096
+
+    # 채널 ID -> 마지막 편집 시각. 같은 채널의 여러 스트림이 rate limit을 함께 지킵니다.
+    # interval보다 오래된 항목은 더 이상 기다릴 필요가 없으므로 편집할 때마다 지웁니다.
+    _last_edit = {}
+
+    def __init__(self, channel, title, interval: float = 1.0, limit: int = EMBED_DESCRIPTION_LIMIT, placeholder: str = "…"):
+        self.channel = channel
+        self.title = title
+        self.interval = interval
+        self.limit = limit
+        self.placeholder = placeholder
+        self.text = ""
+        self._messages = []   # 보낸 메시지 (페이지 순서)
+        self._rendered = []   # 각 메시지에 마지막으로 반영된 텍스트
+        self._dirty = asyncio.Event()
+        self._flusher = None
+
+    def _embed(self, text):
+        return discord.Embed(title=self.title, description=text or self.placeholder)
+
+    def _pages(self):
+        if not self.text:
+            return [""]
+        return [self.text[i:i + self.limit] for i in range(0, len(self.text), self.limit)]
+
+    async def _wait_for_channel(self):
+        key = getattr(self.channel, "id", id(self.channel))
+        delay = self._last_edit.get(key, 0.0) + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        expired = [other for other, at in self._last_edit.items() if now - at >= self.interval]
+        for other in expired:
+            del self._last_edit[other]
+        self._last_edit[key] = now
+
+    async def _render(self):
+        for index, page in enumerate(self._pages()):
+            if index < len(self._messages):
+                if self._rendered[index] == page:
+                    continue
+                with DISCORD_API_DURATION.time(op="edit"):
+                    await self._messages[index].edit(embed=self._embed(page))
+                self._rendered[index] = page
+            else:
+                # 한도를 넘은 부분은 새 메시지로 이어서 보냅니다.
+                with DISCORD_API_DURATION.time(op="send"):
+                    self._messages.append(await self.channel.send(embed=self._embed(page)))
+                self._rendered.append(page)
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            await self._wait_for_channel()
+            self._dirty.clear()
+            try:
+                await self._render()
+            except discord.HTTPException as e:
+                # 중간 편집 실패는 무시하고 다음 편집(또는 finish)에서 다시 반영합니다.
+                record_error("discord", e)
+                log.warning("edit.failed", channel=getattr(self.channel, "id", None), error=str(e))
+
+    async def start(self):
+        """플레이스홀더 임베드를 보내고 편집 루프를 시작합니다."""
+        with DISCORD_API_DURATION.time(op="send"):
+            self._messages.append(await self.channel.send(embed=self._embed("")))
+        self._rendered.append("")
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def feed(self, chunk: str):
+        if chunk:
+            self.text += chunk
+            self._dirty.set()
+
+    async def _stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+    async def finish(self, text: str = None):
+        """편집 루프를 멈추고 최종 텍스트로 메시지를 확정합니다."""
+        await self._stop()
+        if text is not None:
+            self.text = text
+        await self._render()
+        # 스트리밍 중에 한도를 넘어 보낸 페이지가 최종 텍스트에는 없으면 지웁니다.
+        pages = len(self._pages())
+        leftover = self._messages[pages:]
+        del self._messages[pages:], self._rendered[pages:]
+        for message in leftover:
+            try:
+                with DISCORD_API_DURATION.time(op="delete"):
+                    await message.delete()
+            except discord.HTTPException as e:
+                record_error("discord", e)
+                log.warning("delete.failed", channel=getattr(self.channel, "id", None), error=str(e))
+
+    async def abort(self, text: str = "응답을 생성하지 못했습니다."):
+        """
+        응답 없이 끝날 때(예외, 취소) 호출합니다. 편집 루프를 멈추고 보낸 메시지를 text로 바꿉니다.
+        편집에 실패해도 예외를 올리지 않습니다.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()  # 아래 편집이 또 취소되더라도 루프는 남지 않습니다.
+        try:
+            await self.finish(text)
+        except discord.HTTPException as e:
+            record_error("discord", e)
+            log.warning("edit.failed", channel=getattr(self.channel, "id", None), error=str(e))
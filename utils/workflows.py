@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+
+from utils.log import get_logger
+
+log = get_logger("workflows")
+
+# 모든 템플릿이 요청(체인)마다 채워야 하는 입력
+CHAIN_INPUTS = ("positive_prompt", "negative_prompt", "seed", "batch_size", "filename_prefix")
+PARAMETER_TYPES = {"int": int, "float": float, "str": str}
+# 체인 노드 ID는 체인 순번 * CHAIN_STRIDE만큼 띄워 번호를 붙입니다.
+CHAIN_STRIDE = 100
+
+
+class TemplateError(ValueError):
+    """템플릿 파일이 잘못되었거나, 요청한 프리셋/매개변수 값이 허용 범위를 벗어났을 때 발생합니다."""
+
+
+def _is_link(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+class WorkflowTemplate:
+    """
+    JSON 파일로 정의한 ComfyUI 워크플로우 템플릿.
+
+    파일에는 노드(nodes), 선언된 매개변수(parameters: 타입, 기본값, 범위, 값을 넣을 [노드, 입력] 목록),
+    요청마다 채우는 입력(inputs), 모든 요청이 공유하는 노드(shared), 결과 이미지 노드(output),
+    프리셋(presets)이 들어 있습니다. 불러올 때 한 번 검증하고 노드별 입력/링크를 미리 정리해 두므로
+    요청마다 하는 일은 얕은 복사와 값 채우기뿐입니다.
+    """
+
+    def __init__(self, spec: dict, source: str = "<memory>"):
+        self.source = source
+        # 노드/매개변수 정의가 바뀌면 캐시 키도 바뀌도록 내용 전체의 해시를 둡니다.
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+        try:
+            self._compile(spec)
+        except TemplateError as e:
+            raise TemplateError(f"{source}: {e}") from None
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise TemplateError(f"{source}: 템플릿 형식이 잘못되었습니다 ({type(e).__name__}: {e})") from None
+
+    def _compile(self, spec: dict):
+        self.name = spec["name"]
+        self.description = spec.get("description", "")
+        nodes = spec["nodes"]
+        shared = set(spec.get("shared", ()))
+        for node_id, node in nodes.items():
+            if not isinstance(node.get("class_type"), str) or not isinstance(node.get("inputs"), dict):
+                raise TemplateError(f"노드 {node_id}에 class_type/inputs가 없습니다.")
+            # 번호를 다시 매긴 체인 노드와 겹치지 않도록 숫자 ID는 CHAIN_STRIDE보다 작아야 합니다.
+            numeric = node_id.isdigit() and int(node_id) < CHAIN_STRIDE
+            if not numeric and (node_id not in shared or node_id.isdigit()):
+                raise TemplateError(f"노드 ID는 {CHAIN_STRIDE}보다 작은 숫자여야 합니다: {node_id}")
+            for key, value in node["inputs"].items():
+                if _is_link(value):
+                    if value[0] not in nodes:
+                        raise TemplateError(f"노드 {node_id}.{key}가 없는 노드 {value[0]}를 가리킵니다.")
+                    if node_id in shared and value[0] not in shared:
+                        raise TemplateError(f"공유 노드 {node_id}는 체인 노드 {value[0]}를 참조할 수 없습니다.")
+        missing = shared - set(nodes)
+        if missing:
+            raise TemplateError(f"shared에 없는 노드가 있습니다: {sorted(missing)}")
+
+        # (노드 ID, class_type, 고정 입력, [(입력 이름, 체인 노드 번호, 슬롯)]) — 체인 링크만 번호를 다시 매깁니다.
+        self._shared = []
+        self._chain = []
+        for node_id, node in nodes.items():
+            static = {key: value for key, value in node["inputs"].items()
+                      if not (_is_link(value) and value[0] not in shared)}
+            links = [(key, int(value[0]), value[1]) for key, value in node["inputs"].items()
+                     if _is_link(value) and value[0] not in shared]
+            entry = (node_id, node["class_type"], static, links)
+            (self._shared if node_id in shared else self._chain).append(entry)
+
+        def targets(bindings, what):
+            result = []
+            for node_id, key in bindings:
+                if node_id not in nodes or key not in nodes[node_id]["inputs"]:
+                    raise TemplateError(f"{what}의 대상 {node_id}.{key}가 워크플로우에 없습니다.")
+                result.append((node_id in shared, node_id, key))
+            return result
+
+        self.parameters = {}
+        self._parameter_targets = {}
+        for name, declared in spec.get("parameters", {}).items():
+            if declared.get("type") not in PARAMETER_TYPES:
+                raise TemplateError(f"매개변수 {name}의 type은 {sorted(PARAMETER_TYPES)} 중 하나여야 합니다.")
+            self.parameters[name] = dict(declared)
+            self._parameter_targets[name] = targets(declared["bind"], f"매개변수 {name}")
+            self.parameters[name]["default"] = self._coerce(name, declared["default"])
+
+        self._input_targets = {}
+        for name in CHAIN_INPUTS:
+            if name not in spec["inputs"]:
+                raise TemplateError(f"inputs에 {name}이(가) 없습니다.")
+            self._input_targets[name] = targets(spec["inputs"][name], f"입력 {name}")
+            if any(is_shared for is_shared, _, _ in self._input_targets[name]):
+                raise TemplateError(f"요청마다 바뀌는 입력 {name}은(는) 공유 노드에 넣을 수 없습니다.")
+
+        self.output = spec["output"]
+        if self.output not in nodes or self.output in shared:
+            raise TemplateError(f"output {self.output}은(는) 체인 노드여야 합니다.")
+
+        self.presets = {}
+        for preset, values in spec.get("presets", {}).items():
+            self.presets[preset] = self.resolve(overrides=values)
+        self.default_preset = spec.get("default_preset")
+        if self.default_preset is not None and self.default_preset not in self.presets:
+            raise TemplateError(f"default_preset {self.default_preset}이(가) presets에 없습니다.")
+
+    def _coerce(self, name: str, value):
+        declared = self.parameters.get(name)
+        if declared is None:
+            raise TemplateError(f"{self.name} 템플릿에는 {name} 매개변수가 없습니다.")
+        kind = PARAMETER_TYPES[declared["type"]]
+        if kind is int and isinstance(value, float) and not value.is_integer():
+            raise TemplateError(f"{name}은(는) 정수여야 합니다.")
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            raise TemplateError(f"{name} 값이 잘못되었습니다: {value!r}") from None
+        if "min" in declared and value < declared["min"] or "max" in declared and value > declared["max"]:
+            raise TemplateError(f"{name}은(는) {declared.get('min')}~{declared.get('max')} 범위여야 합니다.")
+        if "choices" in declared and value not in declared["choices"]:
+            raise TemplateError(f"{name}은(는) {', '.join(map(str, declared['choices']))} 중 하나여야 합니다.")
+        return value
+
+    def resolve(self, preset: str = None, overrides: dict = None) -> dict:
+        """기본값 <- 프리셋 <- overrides 순서로 덮어쓴, 검증된 매개변수 값을 반환합니다."""
+        settings = {name: declared["default"] for name, declared in self.parameters.items()}
+        if preset is not None:
+            if preset not in self.presets:
+                raise TemplateError(f"{self.name} 템플릿에 {preset} 프리셋이 없습니다. ({', '.join(self.presets)})")
+            settings.update(self.presets[preset])
+        for name, value in (overrides or {}).items():
+            settings[name] = self._coerce(name, value)
+        return settings
+
+    def build(self, settings: dict, chains, filename_prefix: str = "ComfyUI_DiscordBot"):
+        """
+        resolve()한 settings와 (긍정 프롬프트, 부정 프롬프트, seed, batch_size) 체인 목록으로 워크플로우를 만듭니다.
+        공유 노드는 한 번, 체인 노드는 체인마다 번호를 띄워 추가합니다. (결과 노드 ID 목록, 워크플로우)를 반환합니다.
+        """
+        workflow = {}
+        for node_id, class_type, static, _ in self._shared:
+            workflow[node_id] = {"class_type": class_type, "inputs": dict(static)}
+        for name, value in settings.items():
+            for is_shared, node_id, key in self._parameter_targets[name]:
+                if is_shared:
+                    workflow[node_id]["inputs"][key] = value
+
+        output_nodes = []
+        for index, (positive_prompt, negative_prompt, seed, batch_size) in enumerate(chains):
+            base = CHAIN_STRIDE * index
+            chain = {}
+            for node_id, class_type, static, links in self._chain:
+                inputs = dict(static)
+                for key, target, slot in links:
+                    inputs[key] = [str(base + target), slot]
+                chain[node_id] = inputs
+                workflow[str(base + int(node_id))] = {"class_type": class_type, "inputs": inputs}
+            values = {"positive_prompt": positive_prompt, "negative_prompt": negative_prompt, "seed": seed,
+                      "batch_size": batch_size, "filename_prefix": filename_prefix}
+            for name, value in values.items():
+                for _, node_id, key in self._input_targets[name]:
+                    chain[node_id][key] = value
+            for name, value in settings.items():
+                for is_shared, node_id, key in self._parameter_targets[name]:
+                    if not is_shared:
+                        chain[node_id][key] = value
+            output_nodes.append(str(base + int(self.output)))
+        return output_nodes, workflow
+
+
+def load_templates(directory: str) -> dict:
+    """
+    directory의 *.json 템플릿을 모두 불러와 {이름: WorkflowTemplate}로 반환합니다.
+    잘못된 파일은 오류를 기록하고 건너뛰며, 쓸 수 있는 템플릿이 하나도 없으면 TemplateError를 냅니다.
+    """
+    templates = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, encoding="utf-8") as f:
+                template = WorkflowTemplate(json.load(f), source=filename)
+        except (OSError, json.JSONDecodeError, TemplateError) as e:
+            log.error("template.invalid", path=path, error=str(e))
+            continue
+        if template.name in templates:
+            log.error("template.duplicate", path=path, name=template.name)
+            continue
+        templates[template.name] = template
+        log.info("template.loaded", name=template.name, digest=template.digest, presets=list(template.presets))
+    if not templates:
+        raise TemplateError(f"{directory}에 사용할 수 있는 워크플로우 템플릿이 없습니다.")
+    return templates